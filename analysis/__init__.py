@@ -0,0 +1 @@
+"""Analysis tooling for the fingerprinting test results stored in db/data.db."""
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Command line entry point for the analysis tooling.
+
+Example usage:
+        python3 -m analysis stats --group-by browser
+        python3 -m analysis stats --group-by browser,privacy_max --db ./db/data.db
+        python3 -m analysis sketch --window day
+        python3 -m analysis report --group-by browser
+        python3 -m analysis behavior --group-by browser,incognito
+        python3 -m analysis rehash --exclude "Canvas Fingerprint" --include "WebRTC Candidate"
+        python3 -m analysis ablation --config browser,privacy_max --max-k 3
+        python3 -m analysis synth --rows 1000000 --out /tmp/synth.db
+        python3 -m analysis --profile profiles report
+        python3 -m analysis profile profiles --folded campaign.folded
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+from analysis.ablation import default_features, load as load_ablation
+from analysis.db import CONFIG_COLUMNS, DEFAULT_DB_PATH, FEATURE_COLUMNS, connect
+from analysis.incremental import load_checkpoint, save_checkpoint, update_report
+from analysis.profiling import Profiler, aggregate, self_samples, top_functions, write_folded
+from analysis.rehash import FALLBACK_CARDS, PAGE_EXCLUDED, check_page_excluded, evaluate
+from analysis.sketches import WINDOWS, SketchStore, update_sketches, window_of
+from analysis.stats import StatsCache
+from analysis.synth import fit as fit_synth, require_pyarrow, write_parquet, write_sqlite
+
+def parse_group_by(value: Optional[str]) -> list:
+    """Comma separated config columns, in order and without repeats."""
+    return list(dict.fromkeys(c for c in (value or "").split(",") if c))
+
+def print_table(rows: list, columns: list) -> None:
+    """Print a list of dicts as a markdown table (same layout as the README)."""
+    print("| " + " | ".join(columns) + " |")
+    print("|" + "|".join("-" * (len(c) + 2) for c in columns) + "|")
+    for row in rows:
+        cells = []
+        for c in columns:
+            v = row.get(c, "")
+            cells.append(f"{v:.2f}" if isinstance(v, float) else str(v))
+        print("| " + " | ".join(cells) + " |")
+
+def cmd_stats(args) -> int:
+    group_by = parse_group_by(args.group_by)
+    cache = StatsCache(connect(args.db))
+    cache.refresh()
+    try:
+        summary = cache.summary(group_by)
+    except ValueError as e:
+        print(f"[error] {e}")
+        return 2
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"[info] {summary['total_rows']} rows (generation {summary['generation']})")
+        print_table(summary["groups"], group_by + ["rows", "distinct_hashes", "unique_cfh_rate", "avg_privacy_score"])
+    return 0
+
+def cmd_sketch(args) -> int:
+    frequency = [f.partition("=")[::2] for f in args.frequency or []]
+    unknown = [c for c, _ in frequency if c not in FEATURE_COLUMNS.values()]
+    if unknown:
+        print(f"[error] Unknown feature column(s): {', '.join(unknown)}")
+        return 2
+    store = SketchStore(args.sketch_db)
+    added = update_sketches(connect(args.db), store, window=args.window, p=args.precision)
+    print(f"[info] Folded {added} new rows into {store.path}")
+
+    # The modes fold the same rows into different scopes, only one mode may be merged
+    scopes = [s for s in store.scopes() if window_of(s) == args.window and (not args.scope or s in args.scope)]
+    try:
+        sketches, rows = store.merged(scopes)
+    except ValueError as e:
+        # Scopes folded with different --precision (or count-min dimensions)
+        print(f"[error] {e}, select scopes built with the same parameters with --scope")
+        return 1
+    print(f"[info] Scopes: {', '.join(scopes) or '-'} ({rows} rows)")
+
+    table = []
+    for title, col in FEATURE_COLUMNS.items():
+        hll = sketches.get(f"distinct:{col}")
+        if hll is None:
+            continue
+        distinct = hll.count()
+        table.append({"feature": title, "est_distinct": distinct,
+                      "est_distinct_per_row": distinct / rows if rows else 0.0})
+    print_table(table, ["feature", "est_distinct", "est_distinct_per_row"])
+
+    if frequency:
+        frequencies = []
+        for column, value in frequency:
+            cms = sketches.get(f"freq:{column}")
+            estimate = cms.estimate(value) if cms else 0
+            frequencies.append({"feature": column, "value": value, "est_rows": estimate,
+                                "est_share": estimate / rows if rows else 0.0})
+        print()
+        print_table(frequencies, ["feature", "value", "est_rows", "est_share"])
+    return 0
+
+def cmd_report(args) -> int:
+    group_by = parse_group_by(args.group_by)
+    invalid = [c for c in group_by if c not in CONFIG_COLUMNS]
+    if invalid:
+        print(f"[error] Unknown group_by column(s): {', '.join(invalid)}")
+        return 2
+    state = load_checkpoint(args.checkpoint)
+    try:
+        added = update_report(connect(args.db), state)
+    except ValueError as e:
+        print(f"[error] {e}")
+        return 1
+    if not args.no_save:
+        save_checkpoint(state, args.checkpoint)
+    print(f"[info] Processed {added} new rows ({state.rows} total, last id {state.last_id})")
+
+    print()
+    print_table(state.entropies(), ["feature", "distinct", "entropy_bits", "normalized_entropy"])
+    print()
+    print_table(state.summary(group_by), group_by + ["rows", "distinct_hashes", "unique_cfh_rate", "avg_privacy_score"])
+    return 0
+
+def cmd_behavior(args) -> int:
+    # NumPy is only needed for the behavioral features
+    from analysis.behavior import SCALAR_FEATURES, compare_by_config, extract_all
+
+    group_by = parse_group_by(args.group_by)
+    invalid = [c for c in group_by if c not in CONFIG_COLUMNS]
+    if invalid:
+        print(f"[error] Unknown group_by column(s): {', '.join(invalid)}")
+        return 2
+    features = args.feature or ["mouse_events", "mouse_speed_mean", "mouse_curvature_mean",
+                                "key_dwell_mean_ms", "key_flight_mean_ms"]
+    unknown = [f for f in features if f not in SCALAR_FEATURES]
+    if unknown:
+        print(f"[error] Unknown feature(s): {', '.join(unknown)}")
+        return 2
+    result = extract_all(connect(args.db), batch_size=args.batch_size)
+    rows = compare_by_config(result, group_by)
+    if args.json:
+        # Configurations without samples have NaN statistics, null in JSON
+        rows = [{k: None if isinstance(v, float) and not math.isfinite(v) else v for k, v in row.items()}
+                for row in rows]
+        print(json.dumps(rows, indent=2, allow_nan=False))
+        return 0
+    print(f"[info] {len(result['ids'])} sessions")
+    print_table(rows, group_by + ["sessions"] + [f"{f}_{stat}" for f in features for stat in ("mean", "cv")])
+    return 0
+
+def cmd_rehash(args) -> int:
+    group_by = parse_group_by(args.group_by)
+    invalid = [c for c in group_by if c not in CONFIG_COLUMNS]
+    if invalid:
+        print(f"[error] Unknown group_by column(s): {', '.join(invalid)}")
+        return 2
+    titles = set(FEATURE_COLUMNS) | set(FALLBACK_CARDS) | PAGE_EXCLUDED
+    unknown = [t for t in (args.exclude or []) + (args.include or []) if t not in titles]
+    if unknown:
+        print(f"[error] Unknown feature title(s): {', '.join(unknown)}")
+        return 2
+    mismatch = check_page_excluded()
+    if mismatch:
+        print(f"[error] PAGE_EXCLUDED doesn't match public/script.js: {'; '.join(mismatch)}")
+        return 1
+    alternate = frozenset((PAGE_EXCLUDED | set(args.exclude or [])) - set(args.include or []))
+    # Without a different alternate definition only the page's is evaluated
+    definitions = [PAGE_EXCLUDED] + ([alternate] if alternate != PAGE_EXCLUDED else [])
+    result = evaluate(connect(args.db), definitions, group_by, workers=args.workers)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+
+    total = result["verified_rows"] + len(result["unverified_ids"])
+    print(f"[info] {result['verified_rows']} of {total} rows reproduce their stored hash"
+          f" ({result['rows_without_hash']} rows without hash skipped)")
+    if result["unverified_ids"]:
+        print(f"[warn] Not reproduced: ids {', '.join(map(str, result['unverified_ids']))}")
+    for name, definition in zip(("Page definition", "Alternate definition"), result["definitions"]):
+        print()
+        print(f"{name}, excluded: {', '.join(definition['excluded']) or '-'}")
+        print_table(definition["groups"], group_by + ["rows", "distinct_hashes", "unique_cfh_rate"])
+    return 0
+
+def cmd_ablation(args) -> int:
+    config_columns = [c for c in (args.config or "").split(",") if c] or CONFIG_COLUMNS
+    invalid = [c for c in config_columns if c not in CONFIG_COLUMNS]
+    if invalid:
+        print(f"[error] Unknown config column(s): {', '.join(invalid)}")
+        return 2
+    if args.feature:
+        features = args.feature
+    elif args.all_features:
+        features = [t for t in FEATURE_COLUMNS if t != "Comprehensive Fingerprint Hash"]
+    else:
+        features = default_features()
+    unknown = [f for f in features if f not in FEATURE_COLUMNS]
+    if unknown:
+        print(f"[error] Unknown feature title(s): {', '.join(unknown)}")
+        return 2
+
+    ablation = load_ablation(connect(args.db), features, config_columns)
+    greedy = ablation.greedy()
+    result = ablation.exhaustive(max_k=args.max_k, limit=args.limit)
+    if args.json:
+        print(json.dumps({"greedy": greedy, **result}, indent=2))
+        return 0
+
+    separable = sum(1 for c in result["per_config"] if c["separable"])
+    print(f"[info] {ablation.n} rows, {len(ablation.configs)} configurations, {len(features)} features,"
+          f" {result['evaluated_subsets']} subsets evaluated")
+    print(f"[info] All features: {result['target_confused_pairs']} confused row pairs,"
+          f" {separable} of {len(ablation.configs)} configurations separable")
+    print()
+    print("Greedy selection")
+    print_table(greedy, ["feature", "confused_pairs", "separated_configs"])
+    print()
+    if result["minimal_size"] is None:
+        print(f"No subset of up to {args.max_k} features separates as well as all features")
+    else:
+        print(f"Minimal subsets ({result['minimal_size']} features)")
+        for subset in result["minimal_subsets"]:
+            print("  " + " + ".join(subset))
+    print()
+    table = []
+    for entry in result["per_config"]:
+        row = dict(zip(config_columns, entry["config"]))
+        row["rows"] = entry["rows"]
+        if not entry["separable"]:
+            row["minimal_size"], row["example"] = "-", "not separable"
+        elif entry["minimal_size"] is None:
+            row["minimal_size"], row["example"] = f">{args.max_k}", ""
+        else:
+            row["minimal_size"] = entry["minimal_size"]
+            row["example"] = " + ".join(entry["subsets"][0]) or "(no feature needed)"
+        table.append(row)
+    print_table(table, config_columns + ["rows", "minimal_size", "example"])
+    return 0
+
+def cmd_synth(args) -> int:
+    out = Path(args.out)
+    fmt = args.format or ("parquet" if out.suffix == ".parquet" else "sqlite")
+    if args.rows < 1:
+        print("[error] --rows must be at least 1")
+        return 2
+    for name, value in (("coherence", args.coherence), ("coupling", args.coupling)):
+        if not 0 <= value <= 1:
+            print(f"[error] --{name} must be between 0 and 1")
+            return 2
+    db = Path(args.db) if args.db else DEFAULT_DB_PATH
+    if out.resolve() == db.resolve():
+        print(f"[error] --out {out} is the source database")
+        return 2
+    if out.exists() and not args.force:
+        print(f"[error] {out} exists (use --force to replace it)")
+        return 2
+    if fmt == "parquet":
+        try:
+            require_pyarrow()
+        except RuntimeError as e:
+            print(f"[error] {e}")
+            return 1
+
+    conn = connect(args.db)
+    model = fit_synth(conn)
+    print(f"[info] Fitted {len(model.configs)} configurations")
+    chunks = model.generate(args.rows, seed=args.seed, coherence=args.coherence, coupling=args.coupling,
+                            novelty=args.novelty, days=args.days)
+    # Written next to the output and renamed into place, a failed run leaves an existing file alone
+    partial = out.with_name(f".{out.name}.{os.getpid()}.partial")
+    start = time.perf_counter()
+    try:
+        if fmt == "parquet":
+            written = write_parquet(partial, chunks)
+        else:
+            written = write_sqlite(partial, chunks, conn)
+        os.replace(partial, out)
+    except RuntimeError as e:
+        print(f"[error] {e}")
+        return 1
+    finally:
+        partial.unlink(missing_ok=True)
+    elapsed = time.perf_counter() - start
+    print(f"[info] Wrote {written} rows to {out} in {elapsed:.1f}s ({written / max(elapsed, 1e-9):.0f} rows/s)")
+    return 0
+
+def cmd_profile(args) -> int:
+    profile = aggregate(args.path, args.name)
+    if not profile["runs"] and not profile["stacks"]:
+        print(f"[error] No profiles found in {', '.join(args.path)}")
+        return 2
+    print(f"[info] {sum(profile['runs'].values())} runs: "
+          f"{', '.join(f'{name} {n}' for name, n in profile['runs'].most_common())}")
+    if profile["stats"]:
+        print()
+        print(f"Functions by {args.sort} time (cProfile, main thread)")
+        print_table(top_functions(profile["stats"], args.sort, args.top), ["function", "calls", "self_s", "cumulative_s"])
+    if profile["stacks"]:
+        print()
+        print("Frames by samples (all threads)")
+        print_table(self_samples(profile["stacks"], args.top), ["frame", "samples", "share"])
+    if args.folded:
+        write_folded(profile["stacks"], Path(args.folded))
+        print(f"[info] Wrote {len(profile['stacks'])} stacks to {args.folded} (e.g. flamegraph.pl {args.folded} > flame.svg)")
+    return 0
+
+def parse_args(argv=None):
+    """Parse command-line arguments."""
+    p = argparse.ArgumentParser(
+        prog="python3 -m analysis",
+        description="Analyse the fingerprinting test results"
+    )
+    p.add_argument("--db", help="Path to the SQLite database (default: db/data.db)")
+    p.add_argument("--profile", metavar="DIR", help="Profile the command and write the profile to this directory")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    s = sub.add_parser("stats", help="Unique CFH rate and privacy score per configuration group")
+    s.add_argument(
+        "--group-by",
+        default="browser",
+        help=f"Comma separated config columns ({', '.join(CONFIG_COLUMNS)})"
+    )
+    s.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    s.set_defaults(func=cmd_stats)
+
+    k = sub.add_parser("sketch", help="Update and query the approximate distinct-count sketches")
+    k.add_argument("--sketch-db", help="Path to the sketch store (default: db/sketches.db)")
+    k.add_argument("--window", default="all", choices=sorted(WINDOWS), help="Split sketches by time window")
+    k.add_argument("--scope", action="append", help="Only merge these scopes (e.g. day:2025-10-06). Can be repeated.")
+    k.add_argument("--precision", type=int, default=14, help="HyperLogLog precision for new sketches")
+    k.add_argument("--frequency", action="append", metavar="COLUMN=VALUE",
+                   help="Estimate how many rows have this feature value (count-min sketch), "
+                        "e.g. webgl_vendor='Google Inc.'. Can be repeated.")
+    k.set_defaults(func=cmd_sketch)
+
+    r = sub.add_parser("report", help="Incremental report of feature entropies and unique CFH rates")
+    r.add_argument("--checkpoint", help="Path to the checkpoint file (default: db/report_checkpoint.json)")
+    r.add_argument(
+        "--group-by",
+        default="browser",
+        help=f"Comma separated config columns ({', '.join(CONFIG_COLUMNS)})"
+    )
+    r.add_argument("--no-save", action="store_true", help="Do not update the checkpoint")
+    r.set_defaults(func=cmd_report)
+
+    b = sub.add_parser("behavior", help="Behavioral-biometrics features compared across configurations")
+    b.add_argument(
+        "--group-by",
+        default="browser",
+        help=f"Comma separated config columns ({', '.join(CONFIG_COLUMNS)})"
+    )
+    b.add_argument("--batch-size", type=int, default=1000, help="Rows per vectorized batch")
+    b.add_argument("--feature", action="append", help="Feature to show (mean and coefficient of variation). Can be repeated.")
+    b.add_argument("--json", action="store_true", help="Print all features per group as JSON")
+    b.set_defaults(func=cmd_behavior)
+
+    h = sub.add_parser("rehash", help="Recompute the comprehensive hash with another exclusion list")
+    h.add_argument("--exclude", action="append", help="Feature title to leave out of the hash. Can be repeated.")
+    h.add_argument("--include", action="append", help="Excluded feature title to put into the hash. Can be repeated.")
+    h.add_argument(
+        "--group-by",
+        default="browser",
+        help=f"Comma separated config columns ({', '.join(CONFIG_COLUMNS)})"
+    )
+    h.add_argument("--workers", type=int, help="Worker processes (default: number of CPUs, 1 disables the pool)")
+    h.add_argument("--json", action="store_true", help="Print the result as JSON")
+    h.set_defaults(func=cmd_rehash)
+
+    a = sub.add_parser("ablation", help="Smallest feature subsets that still separate the configurations")
+    a.add_argument(
+        "--config",
+        help=f"Comma separated config columns that define a configuration (default: all of {', '.join(CONFIG_COLUMNS)})"
+    )
+    a.add_argument("--feature", action="append", help="Feature title to consider. Can be repeated.")
+    a.add_argument("--all-features", action="store_true",
+                   help="Also consider the features excluded from the comprehensive hash")
+    a.add_argument("--max-k", type=int, default=3, help="Largest subset size of the exhaustive search")
+    a.add_argument("--limit", type=int, default=5, help="Subsets listed per size and configuration")
+    a.add_argument("--json", action="store_true", help="Print the result as JSON")
+    a.set_defaults(func=cmd_ablation)
+
+    y = sub.add_parser("synth", help="Generate a synthetic dataset fitted to the recorded rows")
+    y.add_argument("--rows", type=int, default=1000000, help="Number of rows to generate")
+    y.add_argument("--out", required=True, help="Output file (.db for SQLite, .parquet for Parquet)")
+    y.add_argument("--format", choices=["sqlite", "parquet"], help="Output format (default: from the file suffix)")
+    y.add_argument("--seed", type=int, help="Random seed")
+    y.add_argument("--coherence", type=float, default=0.5,
+                   help="Share of rows copying all features of one recorded row of their configuration")
+    y.add_argument("--coupling", type=float, default=1.0,
+                   help="Chance an independently drawn feature follows its configuration's distribution")
+    y.add_argument("--novelty", type=float, default=1.0,
+                   help="Scale of the estimated rate of never seen values (0: recorded values only)")
+    y.add_argument("--days", type=float, default=30, help="Time span of the timestamps")
+    y.add_argument("--force", action="store_true", help="Replace an existing output file")
+    y.set_defaults(func=cmd_synth)
+
+    f = sub.add_parser("profile", help="Merge the --profile output of collector, orchestrator and analysis runs")
+    f.add_argument("path", nargs="+", help="Profile directories or .prof/.folded files")
+    f.add_argument("--name", help="Only runs whose name starts with this, e.g. collect-firefox or analysis-report")
+    f.add_argument("--sort", choices=["cumulative", "self"], default="cumulative", help="Order of the function table")
+    f.add_argument("--top", type=int, default=25, help="Rows per table")
+    f.add_argument("--folded", help="Write the merged collapsed stacks to this file (flame graph input)")
+    f.set_defaults(func=cmd_profile)
+
+    return p.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.profile:
+        with Profiler(args.profile, f"analysis-{args.command}"):
+            status = args.func(args)
+        sys.exit(status)
+    sys.exit(args.func(args))
+
+if __name__ == "__main__":
+    main()
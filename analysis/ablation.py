@@ -0,0 +1,176 @@
+"""
+Feature ablation: which subsets of features still tell the test configurations apart.
+
+The rows are split into classes of equal feature values (partition
+refinement, one feature at a time). Classes are bitsets (ints) of row
+indexes. A class that only contains rows of one configuration can never
+become mixed again by adding features, so it is dropped right away and only
+the mixed classes are kept. A feature subset separates the configurations
+when no mixed class is left. Partitions are memoized per feature prefix, so
+the subsets of an exhaustive search share the work of their common prefixes.
+"""
+
+from __future__ import annotations
+import itertools
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+from analysis.db import CONFIG_COLUMNS, FEATURE_COLUMNS, iter_rows
+from analysis.rehash import PAGE_EXCLUDED
+
+_popcount = getattr(int, "bit_count", None) or (lambda x: bin(x).count("1"))
+
+def default_features() -> List[str]:
+    """Feature titles used by default: the ones that make up the comprehensive hash."""
+    return [t for t, col in FEATURE_COLUMNS.items()
+            if col != "comprehensive_fingerprint_hash" and t not in PAGE_EXCLUDED]
+
+def _bitset(indexes: List[int], n: int) -> int:
+    bits = bytearray((n + 7) // 8)
+    for i in indexes:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, "little")
+
+class Ablation:
+    """Partition refinement over the rows of the tests table."""
+
+    def __init__(self, rows: list, features: List[str], config_columns: List[str] = CONFIG_COLUMNS):
+        self.features = list(features)
+        self.n = len(rows)
+        configs: Dict[tuple, List[int]] = {}
+        for i, row in enumerate(rows):
+            configs.setdefault(tuple(row[c] for c in config_columns), []).append(i)
+        self.configs = list(configs)
+        self.config_masks = [_bitset(idx, self.n) for idx in configs.values()]
+        self.row_config = [0] * self.n
+        for c, idx in enumerate(configs.values()):
+            for i in idx:
+                self.row_config[i] = c
+        everything = (1 << self.n) - 1
+        self.outside = [everything ^ mask for mask in self.config_masks]
+
+        # Per feature the bitsets of its values, keeping only values shared by
+        # several configurations (all other classes are pure), largest first
+        self.value_masks: Dict[str, List[int]] = {}
+        for title in self.features:
+            col = FEATURE_COLUMNS[title]
+            by_value: Dict[object, List[int]] = {}
+            for i, row in enumerate(rows):
+                value = row[col]
+                by_value.setdefault("" if value is None else value, []).append(i)
+            masks = [_bitset(idx, self.n) for idx in by_value.values()
+                     if len({self.row_config[i] for i in idx}) > 1]
+            self.value_masks[title] = sorted(masks, key=_popcount, reverse=True)
+
+        root = [everything] if self.n and self._mixed(everything) else []
+        self._memo: Dict[tuple, List[int]] = {(): root}
+        self.full = self.partition(tuple(self.features))
+
+    def _mixed(self, block: int) -> bool:
+        lowest = (block & -block).bit_length() - 1
+        return bool(block & self.outside[self.row_config[lowest]])
+
+    def _refine(self, blocks: List[int], title: str) -> List[int]:
+        result = []
+        masks = self.value_masks[title]
+        for block in blocks:
+            rest = block
+            for mask in masks:
+                part = rest & mask
+                if part:
+                    rest ^= part
+                    if self._mixed(part):
+                        result.append(part)
+                    if not rest:
+                        break
+        return result
+
+    def partition(self, subset: tuple) -> List[int]:
+        """Mixed classes of the rows for a tuple of feature titles (memoized per prefix)."""
+        blocks = self._memo.get(subset)
+        if blocks is None:
+            blocks = self._refine(self.partition(subset[:-1]), subset[-1])
+            self._memo[subset] = blocks
+        return blocks
+
+    def confused_pairs(self, blocks: List[int]) -> int:
+        """Number of row pairs of different configurations with equal feature values."""
+        pairs = 0
+        for block in blocks:
+            size = _popcount(block)
+            same = sum(_popcount(block & mask) ** 2 for mask in self.config_masks)
+            pairs += (size * size - same) // 2
+        return pairs
+
+    def separated(self, blocks: List[int]) -> List[int]:
+        """Indexes of the configurations whose rows are not in any mixed class."""
+        mixed = 0
+        for block in blocks:
+            mixed |= block
+        return [c for c, mask in enumerate(self.config_masks) if not mask & mixed]
+
+    def greedy(self) -> List[dict]:
+        """Add the feature that removes the most confused pairs until all features' level is reached."""
+        target = self.confused_pairs(self.full)
+        chosen: tuple = ()
+        steps = []
+        current = self.confused_pairs(self.partition(chosen))
+        while current > target:
+            best = min((f for f in self.features if f not in chosen),
+                       key=lambda f: self.confused_pairs(self.partition(chosen + (f,))))
+            chosen = chosen + (best,)
+            blocks = self.partition(chosen)
+            current = self.confused_pairs(blocks)
+            steps.append({
+                "feature": best,
+                "confused_pairs": current,
+                "separated_configs": len(self.separated(blocks)),
+            })
+        return steps
+
+    def exhaustive(self, max_k: int = 3, limit: int = 10) -> dict:
+        """Smallest subsets (up to max_k features) that separate as well as all features,
+        overall and per configuration."""
+        target = self.confused_pairs(self.full)
+        separable = set(self.separated(self.full))
+        per_config: Dict[int, Tuple[int, list]] = {}
+        minimal: Optional[Tuple[int, list]] = None
+        evaluated = 0
+        for k in range(0, max_k + 1):
+            for subset in itertools.combinations(self.features, k):
+                blocks = self.partition(subset)
+                evaluated += 1
+                if minimal is None or minimal[0] == k:
+                    if self.confused_pairs(blocks) == target:
+                        if minimal is None:
+                            minimal = (k, [])
+                        if len(minimal[1]) < limit:
+                            minimal[1].append(list(subset))
+                for c in separable.intersection(self.separated(blocks)):
+                    entry = per_config.setdefault(c, (k, []))
+                    if entry[0] == k and len(entry[1]) < limit:
+                        entry[1].append(list(subset))
+            if minimal is not None and len(per_config) == len(separable):
+                break
+        return {
+            "evaluated_subsets": evaluated,
+            "target_confused_pairs": target,
+            "minimal_size": minimal[0] if minimal else None,
+            "minimal_subsets": minimal[1] if minimal else [],
+            "per_config": [
+                {
+                    "config": self.configs[c],
+                    "rows": _popcount(mask),
+                    "separable": c in separable,
+                    "minimal_size": per_config[c][0] if c in per_config else None,
+                    "subsets": per_config[c][1] if c in per_config else [],
+                }
+                for c, mask in enumerate(self.config_masks)
+            ],
+        }
+
+def load(conn: sqlite3.Connection, features: Optional[List[str]] = None,
+         config_columns: List[str] = CONFIG_COLUMNS) -> Ablation:
+    features = features or default_features()
+    columns = [FEATURE_COLUMNS[t] for t in features] + list(config_columns)
+    return Ablation(list(iter_rows(conn, columns)), features, config_columns)
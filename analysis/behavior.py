@@ -0,0 +1,281 @@
+"""
+Behavioral-biometrics features from the stored mouse, key and scroll samples.
+
+Sessions are processed in batches: the events of all sessions in a batch are
+concatenated into flat arrays with a session index, so every feature is
+computed with a handful of vectorized NumPy operations instead of a Python
+loop per session. Binary traces (analysis/traces.py) are used when a row has
+one; otherwise the capped JSON samples are used, which carry no timestamps,
+so only the path-shape features are available for them.
+
+Requires NumPy (see analysis/requirements.txt).
+"""
+
+from __future__ import annotations
+import json
+import sqlite3
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from analysis.db import CONFIG_COLUMNS, has_column, iter_rows
+from analysis.traces import TraceFormatError, decode_trace
+
+# Histogram bin edges in milliseconds
+DWELL_BINS_MS = np.array([0, 50, 100, 150, 200, 300, 500, np.inf])
+FLIGHT_BINS_MS = np.array([0, 50, 100, 200, 400, 800, 1600, np.inf])
+
+SAMPLE_COLUMNS = ["mouse_sample", "key_press_sample", "scroll_sample"]
+
+# Scalar features in output order
+SCALAR_FEATURES = [
+    "mouse_events",
+    "mouse_path_px",
+    "mouse_speed_mean",
+    "mouse_speed_std",
+    "mouse_speed_max",
+    "mouse_accel_mean",
+    "mouse_accel_std",
+    "mouse_curvature_mean",
+    "mouse_curvature_std",
+    "key_events",
+    "key_dwell_mean_ms",
+    "key_flight_mean_ms",
+    "scroll_events",
+    "scroll_speed_mean",
+]
+
+def _parse_json_points(text: Optional[str]) -> np.ndarray:
+    """Parse a legacy JSON sample like [[x, y], ...] into an (n, 2) array."""
+    try:
+        points = json.loads(text) if text else []
+    except (TypeError, ValueError):
+        return np.zeros((0, 2))
+    points = [p for p in points if isinstance(p, list) and len(p) == 2]
+    return np.array(points, dtype=np.float64).reshape(-1, 2)
+
+def session_from_row(row, trace: Optional[dict] = None) -> Dict[str, Dict[str, np.ndarray]]:
+    """Build the event streams of one session from a decoded trace or the JSON samples."""
+    if trace is not None:
+        return trace
+    session = {}
+    for name, col in (("mouse", "mouse_sample"), ("scroll", "scroll_sample")):
+        pts = _parse_json_points(row[col])
+        # Legacy samples have no timestamps
+        session[name] = {"t": np.full(len(pts), np.nan), "x": pts[:, 0], "y": pts[:, 1]}
+    try:
+        keys = json.loads(row["key_press_sample"]) if row["key_press_sample"] else []
+    except (TypeError, ValueError):
+        keys = []
+    keys = keys if isinstance(keys, list) else []
+    # Key names are mapped to ids in order of first use, like in trace mode
+    ids = {}
+    key_ids = [ids.setdefault(k, len(ids)) for k in map(str, keys)]
+    session["key"] = {"t": np.full(len(keys), np.nan), "key_id": np.array(key_ids, dtype=np.float64),
+                      "down": np.ones(len(keys))}
+    return session
+
+class _Flat:
+    """Events of one stream of all sessions in a batch, concatenated."""
+
+    def __init__(self, sessions: List[dict], stream: str, fields: tuple):
+        parts = [s.get(stream, {}) for s in sessions]
+        lengths = np.array([len(p.get(fields[0], ())) for p in parts], dtype=np.int64)
+        self.n_sessions = len(sessions)
+        self.counts = lengths
+        self.session = np.repeat(np.arange(len(sessions)), lengths)
+        for f in fields:
+            arrays = [np.asarray(p[f], dtype=np.float64) for p in parts if len(p.get(fields[0], ()))]
+            setattr(self, f, np.concatenate(arrays) if arrays else np.zeros(0))
+
+    def same_session(self, lag: int = 1) -> np.ndarray:
+        """Mask over positions i >= lag where event i and i - lag belong to the same session."""
+        return self.session[lag:] == self.session[:-lag] if len(self.session) > lag else np.zeros(0, bool)
+
+def _group_mean_std(values: np.ndarray, session: np.ndarray, n: int):
+    """Per-session mean and standard deviation, ignoring NaN values."""
+    ok = np.isfinite(values)
+    v, s = values[ok], session[ok]
+    count = np.bincount(s, minlength=n).astype(np.float64)
+    total = np.bincount(s, weights=v, minlength=n)
+    squares = np.bincount(s, weights=v * v, minlength=n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+        std = np.sqrt(np.maximum(squares / count - mean * mean, 0.0))
+    return mean, std
+
+def _group_max(values: np.ndarray, session: np.ndarray, n: int) -> np.ndarray:
+    out = np.full(n, np.nan)
+    ok = np.isfinite(values)
+    if ok.any():
+        out_ok = np.full(n, -np.inf)
+        np.maximum.at(out_ok, session[ok], values[ok])
+        out = np.where(np.isinf(out_ok), np.nan, out_ok)
+    return out
+
+def _group_histogram(values_ms: np.ndarray, session: np.ndarray, n: int, edges: np.ndarray) -> np.ndarray:
+    """Normalized per-session histogram, shape (n, len(edges) - 1)."""
+    bins = len(edges) - 1
+    idx = np.clip(np.searchsorted(edges, values_ms, side="right") - 1, 0, bins - 1)
+    counts = np.bincount(session * bins + idx, minlength=n * bins).reshape(n, bins).astype(np.float64)
+    totals = counts.sum(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(totals > 0, counts / totals, 0.0)
+
+def _pointer_features(flat: _Flat, prefix: str, out: dict, with_shape: bool) -> None:
+    n = flat.n_sessions
+    same = flat.same_session()
+    dx, dy, dt = np.diff(flat.x), np.diff(flat.y), np.diff(flat.t)
+    step = np.hypot(dx, dy)[same]
+    step_session = flat.session[1:][same]
+    out[f"{prefix}_events"] = flat.counts.astype(np.float64)
+    if with_shape:
+        out[f"{prefix}_path_px"] = np.bincount(step_session, weights=step, minlength=n)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        speed = np.where(dt[same] > 0, step / dt[same], np.nan)
+    mean, std = _group_mean_std(speed, step_session, n)
+    out[f"{prefix}_speed_mean"] = mean
+    if not with_shape:
+        return
+    out[f"{prefix}_speed_std"] = std
+    out[f"{prefix}_speed_max"] = _group_max(speed, step_session, n)
+
+    # Acceleration between consecutive steps of the same session
+    same2 = step_session[1:] == step_session[:-1]
+    step_t = flat.t[1:][same]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        accel = np.diff(speed) / np.diff(step_t)
+    mean, std = _group_mean_std(np.where(same2, accel, np.nan), step_session[1:], n)
+    out[f"{prefix}_accel_mean"], out[f"{prefix}_accel_std"] = mean, std
+
+    # Curvature: change of heading per pixel travelled
+    heading = np.arctan2(dy[same], dx[same])
+    turn = np.abs(np.angle(np.exp(1j * np.diff(heading))))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        curvature = np.where(same2 & (step[1:] > 0), turn / step[1:], np.nan)
+    mean, std = _group_mean_std(curvature, step_session[1:], n)
+    out[f"{prefix}_curvature_mean"], out[f"{prefix}_curvature_std"] = mean, std
+
+def _key_features(flat: _Flat, out: dict, hist: dict) -> None:
+    n = flat.n_sessions
+    out["key_events"] = flat.counts.astype(np.float64)
+    if not len(flat.t):
+        out["key_dwell_mean_ms"] = out["key_flight_mean_ms"] = np.full(n, np.nan)
+        hist["key_dwell_hist"] = np.zeros((n, len(DWELL_BINS_MS) - 1))
+        hist["key_flight_hist"] = np.zeros((n, len(FLIGHT_BINS_MS) - 1))
+        return
+    t_ms = flat.t * 1000.0
+
+    # Dwell: key down followed by the next event of the same key being its release
+    order = np.lexsort((t_ms, flat.key_id, flat.session))
+    s, k, d, t = flat.session[order], flat.key_id[order], flat.down[order], t_ms[order]
+    pair = (s[1:] == s[:-1]) & (k[1:] == k[:-1]) & (d[:-1] == 1) & (d[1:] == 0)
+    dwell, dwell_session = (t[1:] - t[:-1])[pair], s[:-1][pair]
+
+    # Flight: time from the last release to the next key down in the same session
+    order = np.lexsort((t_ms, flat.session))
+    s, d, t = flat.session[order], flat.down[order], t_ms[order]
+    last_up = np.maximum.accumulate(np.where(d == 0, np.arange(len(t)), -1))
+    prev_up = np.concatenate(([-1], last_up[:-1]))
+    valid = (d == 1) & (prev_up >= 0)
+    valid[valid] &= s[prev_up[valid]] == s[valid]
+    flight, flight_session = t[valid] - t[prev_up[valid]], s[valid]
+
+    out["key_dwell_mean_ms"] = _group_mean_std(dwell, dwell_session, n)[0]
+    out["key_flight_mean_ms"] = _group_mean_std(flight, flight_session, n)[0]
+    hist["key_dwell_hist"] = _group_histogram(dwell, dwell_session, n, DWELL_BINS_MS)
+    hist["key_flight_hist"] = _group_histogram(flight, flight_session, n, FLIGHT_BINS_MS)
+
+def extract_batch(sessions: List[dict]) -> Dict[str, np.ndarray]:
+    """Compute all features for a batch of sessions.
+
+    Returns {feature name: array} with one entry per session; scalar features
+    have shape (n,), histograms (n, bins).
+    """
+    out: Dict[str, np.ndarray] = {}
+    hist: Dict[str, np.ndarray] = {}
+    _pointer_features(_Flat(sessions, "mouse", ("t", "x", "y")), "mouse", out, with_shape=True)
+    _pointer_features(_Flat(sessions, "scroll", ("t", "x", "y")), "scroll", out, with_shape=False)
+    _key_features(_Flat(sessions, "key", ("t", "key_id", "down")), out, hist)
+    return {**{name: out[name] for name in SCALAR_FEATURES}, **hist}
+
+def stream_features(conn: sqlite3.Connection, batch_size: int = 1000,
+                    after_id: int = 0) -> Iterator[dict]:
+    """Yield the features of the tests table batch by batch.
+
+    Each item has the test ids, the config columns and the feature arrays of
+    one batch, so large tables never have to be held in memory at once.
+    """
+    with_traces = has_column(conn, "tests", "behavior_trace_id")
+    columns = SAMPLE_COLUMNS + CONFIG_COLUMNS + (["behavior_trace_id"] if with_traces else [])
+    batch: list = []
+
+    def flush():
+        traces = _load_traces(conn, [r["behavior_trace_id"] for r in batch]) if with_traces else {}
+        sessions = [session_from_row(r, traces.get(r["behavior_trace_id"]) if with_traces else None)
+                    for r in batch]
+        return {
+            "ids": np.array([r["id"] for r in batch]),
+            "configs": {c: np.array([r[c] for r in batch]) for c in CONFIG_COLUMNS},
+            "features": extract_batch(sessions),
+        }
+
+    for row in iter_rows(conn, columns, after_id=after_id):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield flush()
+            batch = []
+    if batch:
+        yield flush()
+
+def _load_traces(conn: sqlite3.Connection, trace_ids: list) -> dict:
+    ids = [t for t in trace_ids if t]
+    traces = {}
+    # Stay below SQLite's host parameter limit
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        rows = conn.execute(f"SELECT trace_id, data FROM behavior_traces WHERE trace_id IN "
+                            f"({', '.join('?' * len(chunk))})", chunk)
+        for trace_id, blob in rows:
+            try:
+                traces[trace_id] = decode_trace(blob)
+            except TraceFormatError:
+                continue
+    return traces
+
+def extract_all(conn: sqlite3.Connection, batch_size: int = 1000) -> dict:
+    """Concatenate all batches of stream_features()."""
+    batches = list(stream_features(conn, batch_size))
+    if not batches:
+        return {"ids": np.zeros(0, dtype=np.int64), "configs": {c: np.zeros(0) for c in CONFIG_COLUMNS},
+                "features": {}}
+    return {
+        "ids": np.concatenate([b["ids"] for b in batches]),
+        "configs": {c: np.concatenate([b["configs"][c] for b in batches]) for c in CONFIG_COLUMNS},
+        "features": {f: np.concatenate([b["features"][f] for b in batches]) for f in batches[0]["features"]},
+    }
+
+def compare_by_config(result: dict, group_by: list) -> list:
+    """Mean, standard deviation and coefficient of variation of every scalar
+    feature per config group, to compare behavioral stability across configs."""
+    configs = result["configs"]
+    keys = list(zip(*(configs[c].tolist() for c in group_by))) if group_by else [()] * len(result["ids"])
+    groups: Dict[tuple, list] = {}
+    for i, key in enumerate(keys):
+        groups.setdefault(key, []).append(i)
+
+    rows = []
+    for key, idx in groups.items():
+        idx = np.array(idx)
+        row = {**dict(zip(group_by, key)), "sessions": len(idx)}
+        for name in SCALAR_FEATURES:
+            values = result["features"][name][idx]
+            values = values[np.isfinite(values)]
+            mean = float(values.mean()) if len(values) else float("nan")
+            std = float(values.std()) if len(values) else float("nan")
+            row[f"{name}_mean"] = mean
+            row[f"{name}_std"] = std
+            row[f"{name}_cv"] = std / abs(mean) if len(values) and mean else float("nan")
+        rows.append(row)
+    return rows
@@ -0,0 +1,98 @@
+"""
+Helpers for reading the tests table of the fingerprinting database (db/data.db).
+
+The column names and the feature titles mirror index.js and testing_api_schema.json.
+"""
+
+from __future__ import annotations
+import sqlite3
+from pathlib import Path
+from typing import Iterator, Optional
+
+DEFAULT_DB_PATH = Path(__file__).resolve().parent.parent / "db" / "data.db"
+
+# Test configuration columns, in the order used by index.js
+CONFIG_COLUMNS = [
+    "browser",
+    "privacy_max",
+    "incognito",
+    "ublock_origin",
+    "privacy_badger",
+    "noscript",
+    "canvasblocker",
+]
+
+# Columns that add up to the privacy score (see README 2.4)
+PRIVACY_SCORE_COLUMNS = CONFIG_COLUMNS[1:]
+
+# Feature title as shown on the page -> column in the tests table
+FEATURE_COLUMNS = {
+    "Comprehensive Fingerprint Hash": "comprehensive_fingerprint_hash",
+    "Canvas Fingerprint": "canvas_fingerprint",
+    "WebGL Vendor": "webgl_vendor",
+    "WebGL Renderer": "webgl_renderer",
+    "WebGL Shader Precision": "webgl_shader_precision",
+    "Detected Fonts": "detected_fonts",
+    "User-Agent": "user_agent",
+    "Screen Resolution": "screen_resolution",
+    "Device Pixel Ratio": "device_pixel_ratio",
+    "Color Depth": "color_depth",
+    "Time Zone": "time_zone",
+    "Locale": "locale",
+    "Platform": "platform",
+    "CPU Cores": "cpu_cores",
+    "Device Memory (GB)": "device_memory_gb",
+    "Multi-Monitor Position": "multi_monitor_position",
+    "Media Devices": "media_devices",
+    "WebRTC Candidate": "webrtc_candidate",
+    "Cookies Enabled": "cookies_enabled",
+    "Accept-Language": "accept_language",
+    "Do Not Track": "do_not_track",
+    "Plugins": "plugins",
+    "Audio Fingerprint": "audio_fingerprint",
+    "WASM Compile Time (ms)": "wasm_compile_time_ms",
+    "TLS / JA3": "tls_ja3",
+    "SNI / DNS / Cert Info": "sni_dns_cert_info",
+    "Device Motion": "device_motion",
+    "Device Orientation": "device_orientation",
+    "Mouse Sample": "mouse_sample",
+    "Key Press Sample": "key_press_sample",
+    "Scroll Sample": "scroll_sample",
+    "Touch Gestures Sample": "touch_gestures_sample",
+}
+
+def connect(db_path: Optional[str] = None) -> sqlite3.Connection:
+    """Open the database read-only with rows accessible by column name."""
+    path = Path(db_path) if db_path else DEFAULT_DB_PATH
+    if not path.exists():
+        raise FileNotFoundError(f"Database not found: {path}")
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def has_column(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    """Return True if the table has the column (some columns were added later)."""
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+def max_rowid(conn: sqlite3.Connection) -> int:
+    """Return the highest id in the tests table (0 if empty)."""
+    return conn.execute("SELECT COALESCE(MAX(id), 0) FROM tests").fetchone()[0]
+
+def iter_rows(conn: sqlite3.Connection, columns: list, after_id: int = 0,
+              batch_size: int = 1000) -> Iterator[sqlite3.Row]:
+    """Yield rows with id > after_id in id order, fetched in batches."""
+    cols = ", ".join(["id"] + [c for c in columns if c != "id"])
+    cur = conn.execute(f"SELECT {cols} FROM tests WHERE id > ? ORDER BY id", (after_id,))
+    while True:
+        batch = cur.fetchmany(batch_size)
+        if not batch:
+            break
+        yield from batch
+
+def config_key(row) -> tuple:
+    """Return the test configuration of a row as a hashable tuple."""
+    return tuple(row[c] for c in CONFIG_COLUMNS)
+
+def privacy_score(row) -> int:
+    """Privacy score = Incognito + uBlock + Badger + NoScript + CanvasBlocker + PrivacyMax."""
+    return sum(int(row[c] or 0) for c in PRIVACY_SCORE_COLUMNS)
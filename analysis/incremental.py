@@ -0,0 +1,120 @@
+"""
+Incremental reports over the tests table.
+
+A checkpoint file stores the last processed row id together with the
+accumulators of the report (value counts per feature, per-config tallies).
+Each run only reads rows added since the checkpoint, so the cost of a nightly
+report grows with the new data instead of the total table size.
+"""
+
+from __future__ import annotations
+import json
+import math
+import os
+import sqlite3
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Optional
+
+from analysis.db import (CONFIG_COLUMNS, DEFAULT_DB_PATH, FEATURE_COLUMNS, config_key,
+                         iter_rows, max_rowid, privacy_score)
+from analysis.stats import ConfigStats, summarize
+
+DEFAULT_CHECKPOINT_PATH = DEFAULT_DB_PATH.parent / "report_checkpoint.json"
+CHECKPOINT_VERSION = 1
+
+def shannon_entropy(counts: Counter) -> float:
+    """Entropy in bits of the value distribution given by counts."""
+    total = sum(counts.values())
+    if not total:
+        return 0.0
+    return -sum((c / total) * math.log2(c / total) for c in counts.values() if c)
+
+class ReportState:
+    """Accumulators of the report, serializable to a checkpoint."""
+
+    def __init__(self):
+        self.last_id = 0
+        self.rows = 0
+        self.feature_counts: Dict[str, Counter] = {col: Counter() for col in FEATURE_COLUMNS.values()}
+        self.configs: Dict[tuple, ConfigStats] = {}
+
+    def fold(self, row) -> None:
+        for col, counts in self.feature_counts.items():
+            counts[row[col]] += 1
+        key = config_key(row)
+        entry = self.configs.get(key)
+        if entry is None:
+            entry = self.configs[key] = ConfigStats(config=dict(zip(CONFIG_COLUMNS, key)))
+        entry.add(row["comprehensive_fingerprint_hash"], privacy_score(row))
+        self.rows += 1
+        self.last_id = row["id"]
+
+    def entropies(self) -> list:
+        """Entropy, normalized entropy and distinct values per feature."""
+        result = []
+        for title, col in FEATURE_COLUMNS.items():
+            counts = self.feature_counts[col]
+            bits = shannon_entropy(counts)
+            max_bits = math.log2(self.rows) if self.rows > 1 else 0.0
+            result.append({
+                "feature": title,
+                "distinct": len(counts),
+                "entropy_bits": bits,
+                "normalized_entropy": bits / max_bits if max_bits else 0.0,
+            })
+        return result
+
+    def summary(self, group_by: list) -> list:
+        return summarize(self.configs.values(), group_by)
+
+    def to_dict(self) -> dict:
+        return {
+            "version": CHECKPOINT_VERSION,
+            "last_id": self.last_id,
+            "rows": self.rows,
+            # Lists of [value, count] pairs keep NULL values distinct from "null"
+            "feature_counts": {col: list(c.items()) for col, c in self.feature_counts.items()},
+            "configs": [entry.to_dict() for entry in self.configs.values()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ReportState":
+        if data.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version: {data.get('version')}")
+        state = cls()
+        state.last_id = data["last_id"]
+        state.rows = data["rows"]
+        for col, pairs in data["feature_counts"].items():
+            state.feature_counts[col] = Counter(dict((v, c) for v, c in pairs))
+        for item in data["configs"]:
+            entry = ConfigStats.from_dict(item)
+            state.configs[tuple(entry.config[c] for c in CONFIG_COLUMNS)] = entry
+        return state
+
+def load_checkpoint(path: Optional[str] = None) -> ReportState:
+    """Return the saved state, or an empty one if there is no checkpoint yet."""
+    path = Path(path) if path else DEFAULT_CHECKPOINT_PATH
+    if not path.exists():
+        return ReportState()
+    with open(path, "r", encoding="utf-8") as f:
+        return ReportState.from_dict(json.load(f))
+
+def save_checkpoint(state: ReportState, path: Optional[str] = None) -> None:
+    """Write the checkpoint atomically so an interrupted run keeps the old one."""
+    path = Path(path) if path else DEFAULT_CHECKPOINT_PATH
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state.to_dict(), f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def update_report(conn: sqlite3.Connection, state: ReportState) -> int:
+    """Fold rows added since the checkpoint into the state, return how many were read."""
+    if max_rowid(conn) < state.last_id:
+        raise ValueError("Checkpoint is ahead of the database, delete it to rebuild the report")
+    added = 0
+    for row in iter_rows(conn, list(FEATURE_COLUMNS.values()) + CONFIG_COLUMNS,
+                         after_id=state.last_id):
+        state.fold(row)
+        added += 1
+    return added
@@ -0,0 +1,156 @@
+"""
+Profiling of collector, orchestrator and analysis runs (--profile DIR).
+
+A Profiler records one run two ways: cProfile for exact call counts and
+times of the main thread, and a sampler that takes the Python stack of every
+thread every few milliseconds, which also covers the worker threads of
+blocking WebDriver calls and shows where wall time goes. On exit it writes
+<name>-<time>-<pid>.prof (pstats) and .folded (collapsed stacks, one
+"frame;frame;frame count" line per stack, as read by flamegraph.pl,
+speedscope and inferno) into the directory.
+
+aggregate() merges the files of many runs, e.g. all collector runs of a
+campaign, into one pstats table and one folded file.
+
+Only uses the standard library, so the collectors of website-calls can
+import it without the analysis requirements.
+"""
+
+from __future__ import annotations
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+DEFAULT_INTERVAL = 0.005
+
+def frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class Sampler:
+    """Collapsed Python stacks of all threads, sampled from a daemon thread."""
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, daemon=True, name="profile-sampler")
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(frame_label(frame.f_code))
+                    frame = frame.f_back
+                labels.append(f"thread {names.get(ident, ident)}")
+                self.stacks[";".join(reversed(labels))] += 1
+
+class Profiler:
+    """cProfile and stack sampling of one run, written to a directory when stopped.
+
+    Usable as a context manager or with start()/stop(), e.g. around a main()
+    that leaves through sys.exit().
+    """
+
+    def __init__(self, directory, name: str, interval: float = DEFAULT_INTERVAL):
+        self.directory = Path(directory)
+        self.name = name
+        self.profile = cProfile.Profile()
+        self.sampler = Sampler(interval)
+        self.started = 0.0
+        self.paths: List[Path] = []
+
+    def start(self) -> "Profiler":
+        self.started = time.perf_counter()
+        self.sampler.start()
+        self.profile.enable()
+        return self
+
+    def stop(self) -> List[Path]:
+        """Write the .prof and .folded files of the run and return their paths."""
+        self.profile.disable()
+        self.sampler.stop()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        base = self.directory / f"{self.name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.profile.dump_stats(str(base) + ".prof")
+        with open(str(base) + ".folded", "w", encoding="utf-8") as f:
+            for stack, count in self.sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self.paths = [Path(str(base) + ".prof"), Path(str(base) + ".folded")]
+        print(f"[info] Profile of {time.perf_counter() - self.started:.1f}s written to {base}.prof/.folded")
+        return self.paths
+
+    def __enter__(self) -> "Profiler":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+def read_folded(path: Path) -> Counter:
+    stacks: Counter = Counter()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if stack and count.isdigit():
+                stacks[stack] += int(count)
+    return stacks
+
+def run_name(path: Path) -> str:
+    """Name a run was profiled under, without its time and PID."""
+    return path.stem.rsplit("-", 3)[0]
+
+def aggregate(paths: Iterable, name: Optional[str] = None) -> dict:
+    """Merge the profiles of many runs (files or directories of them), optionally only runs of one name."""
+    files: List[Path] = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob("*.prof")) + sorted(path.glob("*.folded")) if path.is_dir() else [path])
+    if name:
+        files = [f for f in files if run_name(f).startswith(name)]
+    profiles = [f for f in files if f.suffix == ".prof"]
+    stacks: Counter = Counter()
+    for f in files:
+        if f.suffix == ".folded":
+            stacks.update(read_folded(f))
+    stats = pstats.Stats(*map(str, profiles)) if profiles else None
+    return {"runs": Counter(run_name(f) for f in profiles), "stats": stats, "stacks": stacks}
+
+def top_functions(stats: pstats.Stats, sort: str = "cumulative", limit: int = 25) -> List[dict]:
+    """Rows of the merged pstats table, sorted by "cumulative" or "self" time."""
+    rows = []
+    for (filename, line, function), (_, calls, self_time, cumulative, _) in stats.stats.items():
+        rows.append({"function": f"{function} ({os.path.basename(filename)}:{line})", "calls": calls,
+                     "self_s": self_time, "cumulative_s": cumulative})
+    key = "self_s" if sort == "self" else "cumulative_s"
+    return sorted(rows, key=lambda r: -r[key])[:limit]
+
+def self_samples(stacks: Dict[str, int], limit: int = 25) -> List[dict]:
+    """Frames that were on top of the sampled stacks most often (where the wall time went)."""
+    leaves: Counter = Counter()
+    for stack, count in stacks.items():
+        leaves[stack.rsplit(";", 1)[-1]] += count
+    total = sum(leaves.values()) or 1
+    return [{"frame": frame, "samples": count, "share": count / total} for frame, count in leaves.most_common(limit)]
+
+def write_folded(stacks: Dict[str, int], path: Path) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in sorted(stacks.items()):
+            f.write(f"{stack} {count}\n")
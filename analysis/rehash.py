@@ -0,0 +1,192 @@
+"""
+Recompute comprehensive fingerprint hashes from the stored features.
+
+Reproduces the hash of public/script.js, SHA-256 over
+JSON.stringify(allFeatures, Object.keys(allFeatures).sort()), so that other
+hash definitions (e.g. a different exclusion list) can be evaluated on the
+stored rows without running the browsers again.
+
+The collectors only store the features with the expected titles. The cards
+the page shows instead when an API fails ("WebGL", "WebRTC", "WASM Perf") are
+inferred from the empty columns and checked against the stored hash.
+"""
+
+from __future__ import annotations
+import hashlib
+import itertools
+import json
+import os
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from json.encoder import encode_basestring
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from analysis.db import CONFIG_COLUMNS, FEATURE_COLUMNS, config_key, iter_rows, privacy_score
+from analysis.stats import ConfigStats, summarize
+
+# Must match excludedParams in public/script.js (see check_page_excluded), the
+# collectors of website-calls import it from here
+PAGE_EXCLUDED = frozenset([
+    "WebRTC Candidate",
+    "WASM Compile Time (ms)",
+    "Mouse Sample",
+    "Scroll Sample",
+    "Behavior Trace ID",
+    "TLS Request ID",
+])
+
+# Card the page adds when an API fails -> (columns left empty, possible values)
+FALLBACK_CARDS = {
+    "WebGL": (("webgl_vendor", "webgl_renderer", "webgl_shader_precision"), ("Not supported", "Blocked")),
+    "WebRTC": (("webrtc_candidate",), ("Blocked",)),
+    "WASM Perf": (("wasm_compile_time_ms",), ("Not supported",)),
+}
+
+HASH_COLUMN = "comprehensive_fingerprint_hash"
+
+SCRIPT_PATH = Path(__file__).resolve().parent.parent / "public" / "script.js"
+EXCLUDED_PARAMS = re.compile(r"const excludedParams = \[(.*?)\];", re.S)
+
+def check_page_excluded(script_path: Path = SCRIPT_PATH) -> List[str]:
+    """Differences between PAGE_EXCLUDED and excludedParams of the page script, empty if they match."""
+    match = EXCLUDED_PARAMS.search(script_path.read_text(encoding="utf-8"))
+    if not match:
+        return [f"no excludedParams in {script_path}"]
+    page = set(re.findall(r"'([^']*)'", match.group(1)))
+    return ([f"missing in PAGE_EXCLUDED: {t}" for t in sorted(page - PAGE_EXCLUDED)]
+            + [f"not excluded by the page: {t}" for t in sorted(PAGE_EXCLUDED - page)])
+
+@lru_cache(maxsize=None)
+def _title_key(title: str) -> bytes:
+    # Array.prototype.sort() compares UTF-16 code units, not code points
+    return title.encode("utf-16-be")
+
+@lru_cache(maxsize=None)
+def _title_prefix(title: str) -> str:
+    return encode_basestring(title) + ":"
+
+def _encode_value(value) -> str:
+    if isinstance(value, str):
+        return encode_basestring(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+def encode_cards(cards: dict) -> List[tuple]:
+    """Return (title, '"title":value') members in the key order of JSON.stringify(obj, Object.keys(obj).sort()).
+
+    Every value is serialized once, so hashing the same cards with several
+    definitions only joins and hashes the members.
+    """
+    return [(title, _title_prefix(title) + _encode_value(cards[title]))
+            for title in sorted(cards, key=_title_key)]
+
+def hash_members(members: List[tuple], excluded: Iterable[str] = PAGE_EXCLUDED) -> str:
+    body = ",".join(member for title, member in members if title not in excluded)
+    return hashlib.sha256(("{" + body + "}").encode("utf-8")).hexdigest()
+
+def canonical_json(features: dict) -> str:
+    """Serialize like JSON.stringify(obj, Object.keys(obj).sort())."""
+    return "{" + ",".join(member for _, member in encode_cards(features)) + "}"
+
+def page_hash(cards: dict, excluded: Iterable[str] = PAGE_EXCLUDED) -> str:
+    """Comprehensive hash of the cards shown on the page, without the excluded titles."""
+    return hash_members(encode_cards(cards), excluded)
+
+def _empty(value) -> bool:
+    return value is None or value == ""
+
+def candidate_members(row) -> List[List[tuple]]:
+    """Encoded cards the page may have shown for a row, most likely first.
+
+    Empty columns were missing on the page (the collectors fill them with "").
+    """
+    base = encode_cards({title: row[col] for title, col in FEATURE_COLUMNS.items()
+                         if col != HASH_COLUMN and not _empty(row[col])})
+    options = []
+    for title, (columns, values) in FALLBACK_CARDS.items():
+        if all(_empty(row[c]) for c in columns):
+            options.append([encode_cards({title: v})[0] for v in values] + [None])
+    candidates = []
+    for combo in itertools.product(*options):
+        extra = [member for member in combo if member]
+        candidates.append(sorted(base + extra, key=lambda m: _title_key(m[0])) if extra else base)
+    return candidates
+
+def reconstruct(row) -> tuple:
+    """Return the encoded cards of a row and whether they reproduce the stored hash."""
+    candidates = candidate_members(row)
+    for members in candidates:
+        if hash_members(members) == row[HASH_COLUMN]:
+            return members, True
+    return candidates[0], False
+
+def _rehash_chunk(task) -> list:
+    rows, definitions = task
+    result = []
+    for row in rows:
+        if _empty(row[HASH_COLUMN]):
+            # The page script did not run (e.g. blocked by NoScript)
+            result.append((row["id"], config_key(row), privacy_score(row), None, None))
+            continue
+        members, verified = reconstruct(row)
+        hashes = [hash_members(members, excluded) for excluded in definitions]
+        result.append((row["id"], config_key(row), privacy_score(row), verified, hashes))
+    return result
+
+def rehash(conn: sqlite3.Connection, definitions: List[frozenset], workers: Optional[int] = None,
+           chunk_size: int = 2000) -> Iterator[tuple]:
+    """Yield (id, config key, privacy score, verified, hashes) per row, with one
+    hash per definition (set of excluded titles).
+
+    verified and hashes are None for rows without a stored hash. Chunks of
+    rows are hashed in a process pool unless workers is 1.
+    """
+    columns = list(FEATURE_COLUMNS.values()) + CONFIG_COLUMNS
+    rows = (dict(zip(row.keys(), row)) for row in iter_rows(conn, columns, batch_size=chunk_size))
+
+    def tasks():
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                return
+            yield chunk, definitions
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for task in tasks():
+            yield from _rehash_chunk(task)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(_rehash_chunk, tasks()):
+            yield from result
+
+def evaluate(conn: sqlite3.Connection, definitions: List[frozenset], group_by: list,
+             workers: Optional[int] = None) -> dict:
+    """Unique CFH rates per config group for every hash definition."""
+    configs: List[Dict[tuple, ConfigStats]] = [{} for _ in definitions]
+    verified_rows = skipped = 0
+    unverified = []
+    for row_id, key, score, verified, hashes in rehash(conn, definitions, workers=workers):
+        if verified is None:
+            skipped += 1
+            continue
+        if verified:
+            verified_rows += 1
+        else:
+            unverified.append(row_id)
+        for stats, cfh in zip(configs, hashes):
+            entry = stats.get(key)
+            if entry is None:
+                entry = stats[key] = ConfigStats(config=dict(zip(CONFIG_COLUMNS, key)))
+            entry.add(cfh, score)
+    return {
+        "verified_rows": verified_rows,
+        "unverified_ids": unverified,
+        "rows_without_hash": skipped,
+        "definitions": [
+            {"excluded": sorted(excluded), "groups": summarize(stats.values(), group_by)}
+            for excluded, stats in zip(definitions, configs)
+        ],
+    }
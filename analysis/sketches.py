@@ -0,0 +1,246 @@
+"""
+Approximate statistics with fixed memory: HyperLogLog for distinct counts and
+count-min sketches for value frequencies.
+
+Sketches with the same parameters can be merged, so collections can be split
+into shards or time windows and combined later. They are persisted in a small
+SQLite file next to data.db (db/sketches.db).
+"""
+
+from __future__ import annotations
+import hashlib
+import math
+import sqlite3
+import struct
+from array import array
+from pathlib import Path
+from typing import Dict, Optional
+
+from analysis.db import CONFIG_COLUMNS, DEFAULT_DB_PATH, FEATURE_COLUMNS, config_key, iter_rows
+
+DEFAULT_SKETCH_PATH = DEFAULT_DB_PATH.parent / "sketches.db"
+
+# NULL columns; 0xFF never occurs in UTF-8, so no text value encodes the same
+NULL_BYTES = b"\xff"
+
+def _encode(value) -> bytes:
+    if value is None:
+        return NULL_BYTES
+    return value if isinstance(value, bytes) else str(value).encode("utf-8")
+
+def _hash64(value) -> int:
+    """Stable 64-bit hash of a value (Python's hash() is salted per process)."""
+    data = _encode(value)
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+class HyperLogLog:
+    """Distinct counter with a relative error of about 1.04 / sqrt(2**p)."""
+
+    KIND = "hll"
+
+    def __init__(self, p: int = 14, registers: Optional[bytearray] = None):
+        if not 4 <= p <= 18:
+            raise ValueError("HyperLogLog precision must be between 4 and 18")
+        self.p = p
+        self.m = 1 << p
+        self.registers = registers if registers is not None else bytearray(self.m)
+
+    def add(self, value) -> None:
+        h = _hash64(value)
+        idx = h >> (64 - self.p)
+        rest = (h << self.p) & 0xFFFFFFFFFFFFFFFF
+        # Position of the leftmost 1-bit in the remaining 64 - p bits
+        rank = min(64 - rest.bit_length() + 1, 64 - self.p + 1)
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def count(self) -> int:
+        m = self.m
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if other.p != self.p:
+            raise ValueError("Cannot merge HyperLogLog sketches of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def to_bytes(self) -> bytes:
+        return struct.pack("<B", self.p) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        return cls(p=data[0], registers=bytearray(data[1:]))
+
+class CountMinSketch:
+    """Frequency estimator that never under-counts; over-counts by at most
+    e / width * total with probability 1 - exp(-depth)."""
+
+    KIND = "cms"
+
+    def __init__(self, width: int = 2048, depth: int = 4, counts: Optional[array] = None,
+                 total: int = 0):
+        self.width = width
+        self.depth = depth
+        self.counts = counts if counts is not None else array("Q", bytes(8 * width * depth))
+        self.total = total
+
+    def _indexes(self, value):
+        digest = hashlib.blake2b(_encode(value), digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", digest)
+        # Double hashing gives depth independent-enough row hashes
+        return [row * self.width + (h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def add(self, value, count: int = 1) -> None:
+        for i in self._indexes(value):
+            self.counts[i] += count
+        self.total += count
+
+    def estimate(self, value) -> int:
+        return min(self.counts[i] for i in self._indexes(value))
+
+    def merge(self, other: "CountMinSketch") -> "CountMinSketch":
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Cannot merge count-min sketches of different dimensions")
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.total += other.total
+        return self
+
+    def to_bytes(self) -> bytes:
+        return struct.pack("<IIQ", self.width, self.depth, self.total) + self.counts.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "CountMinSketch":
+        width, depth, total = struct.unpack_from("<IIQ", data)
+        counts = array("Q")
+        counts.frombytes(data[16:])
+        return cls(width=width, depth=depth, counts=counts, total=total)
+
+SKETCH_TYPES = {cls.KIND: cls for cls in (HyperLogLog, CountMinSketch)}
+
+# Time window of a row -> scope name; "all" puts every row in one scope
+WINDOWS = {
+    "all": lambda ts: "all",
+    "month": lambda ts: "month:" + (ts or "")[:7],
+    "day": lambda ts: "day:" + (ts or "")[:10],
+}
+
+def window_of(scope: str) -> str:
+    """Window mode a scope was built by ("all", "month" or "day")."""
+    return scope.split(":", 1)[0]
+
+class SketchStore:
+    """Named sketches persisted in SQLite, grouped by scope (shard or time window)."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = Path(path) if path else DEFAULT_SKETCH_PATH
+        self.conn = sqlite3.connect(self.path)
+        with self.conn:
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS sketches (
+                scope TEXT,
+                name TEXT,
+                kind TEXT,
+                data BLOB,
+                PRIMARY KEY (scope, name)
+            )""")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS scopes (
+                scope TEXT PRIMARY KEY,
+                rows INTEGER
+            )""")
+            # Last row id folded in per window mode
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS progress (
+                window TEXT PRIMARY KEY,
+                last_id INTEGER
+            )""")
+
+    def load(self, scope: str) -> Dict[str, object]:
+        return {name: SKETCH_TYPES[kind].from_bytes(data) for name, kind, data in self.conn.execute(
+            "SELECT name, kind, data FROM sketches WHERE scope = ?", (scope,))}
+
+    def rows(self, scope: str) -> int:
+        row = self.conn.execute("SELECT rows FROM scopes WHERE scope = ?", (scope,)).fetchone()
+        return row[0] if row else 0
+
+    def last_id(self, window: str) -> int:
+        row = self.conn.execute("SELECT last_id FROM progress WHERE window = ?", (window,)).fetchone()
+        return row[0] if row else 0
+
+    def save(self, window: str, last_id: int, scopes: Dict[str, tuple]) -> None:
+        """Persist the sketches and row counts of the given scopes in one transaction."""
+        with self.conn:
+            for scope, (sketches, rows) in scopes.items():
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO sketches (scope, name, kind, data) VALUES (?, ?, ?, ?)",
+                    [(scope, name, s.KIND, s.to_bytes()) for name, s in sketches.items()])
+                self.conn.execute("INSERT OR REPLACE INTO scopes (scope, rows) VALUES (?, ?)",
+                                  (scope, rows))
+            self.conn.execute("INSERT OR REPLACE INTO progress (window, last_id) VALUES (?, ?)",
+                              (window, last_id))
+
+    def scopes(self, prefix: str = "") -> list:
+        return [r[0] for r in self.conn.execute(
+            "SELECT scope FROM scopes WHERE scope LIKE ? ORDER BY scope", (prefix + "%",))]
+
+    def merged(self, scopes: list) -> tuple:
+        """Merge the sketches of several scopes, e.g. all shards or a range of windows.
+
+        Returns the merged sketches and the total number of rows.
+        """
+        result: Dict[str, object] = {}
+        rows = 0
+        for scope in scopes:
+            rows += self.rows(scope)
+            for name, sketch in self.load(scope).items():
+                if name in result:
+                    result[name].merge(sketch)
+                else:
+                    result[name] = sketch
+        return result, rows
+
+def update_sketches(conn: sqlite3.Connection, store: SketchStore, window: str = "all",
+                    p: int = 14, width: int = 2048, depth: int = 4) -> int:
+    """Fold rows added since the last update into the sketches of their scope.
+
+    Per feature column there is a HyperLogLog (distinct values) and a count-min
+    sketch (value frequencies), plus one HyperLogLog of the comprehensive hash
+    per test configuration. Returns the number of rows read.
+    """
+    scope_of = WINDOWS[window]
+    last_id = store.last_id(window)
+    touched: Dict[str, list] = {}
+
+    def sketches_for(scope):
+        if scope not in touched:
+            touched[scope] = [store.load(scope), store.rows(scope)]
+        return touched[scope]
+
+    def get(sketches, name, factory):
+        sketch = sketches.get(name)
+        if sketch is None:
+            sketch = sketches[name] = factory()
+        return sketch
+
+    columns = list(FEATURE_COLUMNS.values())
+    added = 0
+    for row in iter_rows(conn, columns + CONFIG_COLUMNS + ["timestamp"], after_id=last_id):
+        entry = sketches_for(scope_of(row["timestamp"]))
+        sketches = entry[0]
+        for col in columns:
+            value = row[col]
+            get(sketches, f"distinct:{col}", lambda: HyperLogLog(p)).add(value)
+            get(sketches, f"freq:{col}", lambda: CountMinSketch(width, depth)).add(value)
+        config = "|".join(str(v) for v in config_key(row))
+        get(sketches, f"distinct_cfh:{config}", lambda: HyperLogLog(p)).add(row["comprehensive_fingerprint_hash"])
+        entry[1] += 1
+        last_id = row["id"]
+        added += 1
+
+    if added:
+        store.save(window, last_id, {scope: tuple(entry) for scope, entry in touched.items()})
+    return added
@@ -0,0 +1,128 @@
+"""
+Cached aggregate statistics over the tests table, mirroring lib/stats_cache.js.
+
+The cache folds in only rows that were added since the last refresh. The
+generation is the highest processed row id, summaries are memoized per
+generation so repeated queries do not touch the database.
+"""
+
+from __future__ import annotations
+import sqlite3
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from analysis.db import CONFIG_COLUMNS, config_key, iter_rows, max_rowid, privacy_score
+
+@dataclass
+class ConfigStats:
+    """Counters for one test configuration."""
+    config: dict
+    rows: int = 0
+    privacy_score_sum: int = 0
+    singletons: int = 0
+    hashes: Counter = field(default_factory=Counter)
+
+    def add(self, cfh: str, score: int) -> None:
+        seen = self.hashes[cfh]
+        self.hashes[cfh] = seen + 1
+        # Keep the number of hashes seen exactly once up to date
+        if seen == 0:
+            self.singletons += 1
+        elif seen == 1:
+            self.singletons -= 1
+        self.rows += 1
+        self.privacy_score_sum += score
+
+    def to_dict(self) -> dict:
+        return {
+            "config": self.config,
+            "rows": self.rows,
+            "privacy_score_sum": self.privacy_score_sum,
+            "singletons": self.singletons,
+            "hashes": list(self.hashes.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ConfigStats":
+        return cls(config=data["config"], rows=data["rows"],
+                   privacy_score_sum=data["privacy_score_sum"],
+                   singletons=data["singletons"], hashes=Counter(dict(data["hashes"])))
+
+def summarize(configs, group_by: list) -> list:
+    """Aggregate ConfigStats entries by the given config columns."""
+    groups: Dict[tuple, dict] = {}
+    for entry in configs:
+        key = tuple(entry.config[c] for c in group_by)
+        group = groups.setdefault(key, {"rows": 0, "privacy_score_sum": 0, "hashes": Counter()})
+        group["rows"] += entry.rows
+        group["privacy_score_sum"] += entry.privacy_score_sum
+        # The same hash can show up in several configs of a group
+        group["hashes"].update(entry.hashes)
+
+    result = []
+    for key, group in groups.items():
+        singletons = sum(1 for count in group["hashes"].values() if count == 1)
+        rows = group["rows"]
+        result.append({
+            **dict(zip(group_by, key)),
+            "rows": rows,
+            "singletons": singletons,
+            "distinct_hashes": len(group["hashes"]),
+            "unique_cfh_rate": singletons / rows if rows else 0.0,
+            "avg_privacy_score": group["privacy_score_sum"] / rows if rows else 0.0,
+        })
+    return result
+
+class StatsCache:
+    """Per-config counts of the tests table, updated incrementally."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.generation = 0
+        self.total_rows = 0
+        self.configs: Dict[tuple, ConfigStats] = {}
+        self._summaries: Dict[tuple, dict] = {}
+
+    def record(self, row) -> None:
+        key = config_key(row)
+        entry = self.configs.get(key)
+        if entry is None:
+            entry = self.configs[key] = ConfigStats(config=dict(zip(CONFIG_COLUMNS, key)))
+        entry.add(row["comprehensive_fingerprint_hash"], privacy_score(row))
+        self.total_rows += 1
+        self.generation = max(self.generation, row["id"])
+        self._summaries.clear()
+
+    def refresh(self) -> int:
+        """Fold in rows added since the last refresh and return how many were read."""
+        if max_rowid(self.conn) < self.generation:
+            # Rows were deleted, the counters cannot be rolled back
+            self.__init__(self.conn)
+        added = 0
+        for row in iter_rows(self.conn, CONFIG_COLUMNS + ["comprehensive_fingerprint_hash"],
+                             after_id=self.generation):
+            self.record(row)
+            added += 1
+        return added
+
+    def summary(self, group_by: Optional[list] = None) -> dict:
+        """Aggregate the per-config counters by the given config columns."""
+        # A repeated column would not change the groups
+        group_by = list(dict.fromkeys(group_by or []))
+        invalid = [c for c in group_by if c not in CONFIG_COLUMNS]
+        if invalid:
+            raise ValueError(f"Unknown group_by column(s): {', '.join(invalid)}")
+
+        cache_key = tuple(group_by)
+        if cache_key in self._summaries:
+            return self._summaries[cache_key]
+
+        summary = {
+            "generation": self.generation,
+            "total_rows": self.total_rows,
+            "group_by": group_by,
+            "groups": summarize(self.configs.values(), group_by),
+        }
+        self._summaries[cache_key] = summary
+        return summary
@@ -0,0 +1,234 @@
+"""
+Synthetic tests rows for scale testing, fitted to the recorded data.
+
+The model keeps, per configuration, the recorded rows and the value
+distribution of every feature. A synthetic row picks a configuration (as
+often as it was recorded), then either copies the features of a recorded row
+of that configuration as a whole (--coherence) or draws every feature on its
+own, from the configuration's distribution (--coupling) or from the
+distribution over all configurations. Rows where the page script did not run
+(no comprehensive hash) are reproduced at their recorded rate per
+configuration.
+
+Values never seen before are drawn at the Good-Turing rate of the feature
+(values seen once per configuration / rows, scaled by --novelty), by
+re-rolling the digits of a recorded value; this is what makes e.g. canvas or
+audio hashes unique across synthetic users instead of repeating the 69
+recorded ones. Rows that differ from their recorded template get their
+comprehensive hash recomputed from the features (see rehash.py).
+"""
+
+from __future__ import annotations
+import datetime
+import random
+import re
+import sqlite3
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from analysis.db import CONFIG_COLUMNS, FEATURE_COLUMNS, config_key, iter_rows
+from analysis.rehash import HASH_COLUMN, encode_cards, hash_members
+
+FEATURE_TITLES = [t for t, col in FEATURE_COLUMNS.items() if col != HASH_COLUMN]
+OUTPUT_COLUMNS = ["timestamp"] + CONFIG_COLUMNS + list(FEATURE_COLUMNS.values())
+
+_HEX = re.compile(r"^[0-9a-f]{16,}$")
+_NUMBER = re.compile(r"\d+")
+
+@dataclass
+class Marginal:
+    values: list
+    cumulative: np.ndarray
+
+    @classmethod
+    def fit(cls, values: list) -> "Marginal":
+        counts = Counter(values)
+        weights = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+        return cls(list(counts), np.cumsum(weights / weights.sum()))
+
+    def sample(self, rng: np.random.Generator, size: int) -> list:
+        idx = np.searchsorted(self.cumulative, rng.random(size), side="right")
+        idx = np.minimum(idx, len(self.values) - 1)
+        return [self.values[i] for i in idx]
+
+@dataclass
+class ConfigModel:
+    config: tuple
+    rows: List[list]
+    blocked: List[list]
+    marginals: Dict[str, Marginal]
+
+def novel_value(value, rnd: random.Random):
+    """A value of the same shape that was (almost certainly) never recorded."""
+    if not isinstance(value, str) or not value:
+        return value
+    if _HEX.match(value):
+        return f"{rnd.getrandbits(4 * len(value)):0{len(value)}x}"
+
+    def reroll(m):
+        digits = len(m.group())
+        return str(rnd.randrange(10 ** (digits - 1) if digits > 1 else 0, 10 ** digits))
+    return _NUMBER.sub(reroll, value)
+
+class SynthModel:
+    """Per-config, per-feature value distributions fitted from the tests table."""
+
+    def __init__(self, rows: list):
+        by_config: Dict[tuple, List[list]] = {}
+        for row in rows:
+            by_config.setdefault(config_key(row), []).append(row)
+        if not by_config:
+            raise ValueError("No rows to fit the model on")
+
+        scripted = [r for r in rows if r[HASH_COLUMN]]
+        self.global_marginals = {t: Marginal.fit([r[FEATURE_COLUMNS[t]] for r in scripted] or [""])
+                                 for t in FEATURE_TITLES}
+        self.configs: List[ConfigModel] = []
+        singletons = Counter()
+        for config, group in by_config.items():
+            ran = [r for r in group if r[HASH_COLUMN]]
+            marginals = {}
+            for title in FEATURE_TITLES:
+                values = [r[FEATURE_COLUMNS[title]] for r in ran]
+                if values:
+                    marginals[title] = Marginal.fit(values)
+                    singletons[title] += sum(1 for c in Counter(values).values() if c == 1)
+            self.configs.append(ConfigModel(
+                config=config,
+                rows=[[r[c] for c in FEATURE_COLUMNS.values()] for r in ran],
+                blocked=[[r[c] for c in FEATURE_COLUMNS.values()] for r in group if not r[HASH_COLUMN]],
+                marginals=marginals,
+            ))
+        weights = np.array([len(c.rows) + len(c.blocked) for c in self.configs], dtype=np.float64)
+        self.config_weights = weights / weights.sum()
+        # Good-Turing: probability mass of unseen values ~ values seen once / observations
+        self.novel_rate = {t: singletons[t] / max(1, len(scripted)) for t in FEATURE_TITLES}
+
+    def generate(self, n: int, seed: Optional[int] = None, coherence: float = 0.5, coupling: float = 1.0,
+                 novelty: float = 1.0, start: Optional[datetime.datetime] = None, days: float = 30,
+                 chunk_size: int = 50000) -> Iterator[List[tuple]]:
+        """Yield chunks of rows as tuples in OUTPUT_COLUMNS order."""
+        rng = np.random.default_rng(seed)
+        # Scalar draws (digits of novel values) are much cheaper from random.Random
+        rnd = random.Random(int(rng.integers(2 ** 63)))
+        start = start or datetime.datetime.now() - datetime.timedelta(days=days)
+        step = days * 86400 / max(1, n)
+        hash_index = list(FEATURE_COLUMNS.values()).index(HASH_COLUMN)
+        columns = list(FEATURE_COLUMNS.values())
+        feature_index = [columns.index(FEATURE_COLUMNS[t]) for t in FEATURE_TITLES]
+        novel_rate = np.array([min(1.0, self.novel_rate[t] * novelty) for t in FEATURE_TITLES])
+        # Features in the key order of the page's JSON.stringify, with the
+        # encoded members of recorded values cached
+        hash_order = [FEATURE_TITLES.index(t) for t, _ in encode_cards(dict.fromkeys(FEATURE_TITLES, ""))]
+        members: Dict[tuple, tuple] = {}
+
+        def row_hash(values: list, novel_row) -> str:
+            encoded = []
+            for f in hash_order:
+                value = values[feature_index[f]]
+                if value is None or value == "":
+                    continue
+                if novel_row[f]:
+                    encoded.append(encode_cards({FEATURE_TITLES[f]: value})[0])
+                    continue
+                member = members.get((f, value))
+                if member is None:
+                    member = members[(f, value)] = encode_cards({FEATURE_TITLES[f]: value})[0]
+                encoded.append(member)
+            return hash_members(encoded)
+
+        for offset in range(0, n, chunk_size):
+            size = min(chunk_size, n - offset)
+            picks = rng.choice(len(self.configs), size=size, p=self.config_weights)
+            chunk: List[Optional[tuple]] = [None] * size
+            seconds = ((offset + np.arange(size) + rng.random(size)) * step).tolist()
+            for c, model in enumerate(self.configs):
+                positions = np.flatnonzero(picks == c)
+                if not len(positions):
+                    continue
+                total = len(model.rows) + len(model.blocked)
+                # Python lists: indexing numpy arrays element-wise in the row loop is slow
+                blocked = (rng.random(len(positions)) < len(model.blocked) / total).tolist()
+                joint = (rng.random(len(positions)) < coherence).tolist()
+                from_config = (rng.random((len(positions), len(FEATURE_TITLES))) < coupling).tolist()
+                novel = (rng.random((len(positions), len(FEATURE_TITLES))) < novel_rate).tolist()
+                templates = rng.integers(0, max(1, len(model.rows)), len(positions)).tolist()
+                blocked_templates = rng.integers(0, max(1, len(model.blocked)), len(positions)).tolist()
+                drawn = {t: (m.sample(rng, len(positions)), self.global_marginals[t].sample(rng, len(positions)))
+                         for t, m in model.marginals.items()}
+
+                for j, pos in enumerate(positions.tolist()):
+                    if blocked[j] or not model.rows:
+                        values = list(model.blocked[blocked_templates[j]])
+                    else:
+                        template = model.rows[templates[j]]
+                        values = list(template)
+                        independent = changed = not joint[j]
+                        novel_row = novel[j]
+                        for f, title in enumerate(FEATURE_TITLES):
+                            i = feature_index[f]
+                            if independent:
+                                local, pooled = drawn[title]
+                                values[i] = local[j] if from_config[j][f] else pooled[j]
+                            if novel_row[f]:
+                                values[i] = novel_value(values[i], rnd)
+                                changed = True
+                        if changed:
+                            values[hash_index] = row_hash(values, novel_row)
+                    timestamp = (start + datetime.timedelta(seconds=seconds[pos])).isoformat()
+                    chunk[pos] = (timestamp, *model.config, *values)
+            yield chunk
+
+def fit(conn: sqlite3.Connection) -> SynthModel:
+    columns = CONFIG_COLUMNS + list(FEATURE_COLUMNS.values())
+    return SynthModel([dict(zip(row.keys(), row)) for row in iter_rows(conn, columns)])
+
+def write_sqlite(path: Path, chunks: Iterator[List[tuple]], source: sqlite3.Connection) -> int:
+    """Bulk insert into a new database with the schema of the source database."""
+    out = sqlite3.connect(str(path))
+    try:
+        # No journal and no fsync: the file is rebuilt from scratch when a run fails
+        out.execute("PRAGMA journal_mode = OFF")
+        out.execute("PRAGMA synchronous = OFF")
+        for (sql,) in source.execute("SELECT sql FROM sqlite_master WHERE type = 'table' "
+                                     "AND name NOT LIKE 'sqlite_%' AND sql IS NOT NULL"):
+            out.execute(sql)
+        insert = (f"INSERT INTO tests ({', '.join(OUTPUT_COLUMNS)}) "
+                  f"VALUES ({', '.join('?' * len(OUTPUT_COLUMNS))})")
+        written = 0
+        with out:
+            for chunk in chunks:
+                out.executemany(insert, chunk)
+                written += len(chunk)
+        return written
+    finally:
+        out.close()
+
+def require_pyarrow():
+    """Import pyarrow, raising RuntimeError with an install hint when it is missing."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise RuntimeError("Parquet output needs pyarrow (pip install pyarrow)") from None
+    return pa
+
+def write_parquet(path: Path, chunks: Iterator[List[tuple]]) -> int:
+    """Write the rows to a Parquet file, one row group per chunk (needs pyarrow)."""
+    pa = require_pyarrow()
+    pq = pa.parquet
+
+    types = {c: pa.string() for c in OUTPUT_COLUMNS}
+    types.update({c: pa.int64() for c in CONFIG_COLUMNS[1:]})
+    schema = pa.schema([(c, types[c]) for c in OUTPUT_COLUMNS])
+    written = 0
+    with pq.ParquetWriter(str(path), schema, compression="zstd") as writer:
+        for chunk in chunks:
+            arrays = [pa.array(list(column), type=types[c]) for c, column in zip(OUTPUT_COLUMNS, zip(*chunk))]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            written += len(chunk)
+    return written
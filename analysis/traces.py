@@ -0,0 +1,119 @@
+"""
+Reader for the binary behavioral traces uploaded by the page in trace mode (?traces=1).
+
+Format (all integers are unsigned LEB128 varints unless noted):
+    "BT" magic, version byte (1), time unit in microseconds, number of streams,
+    then per stream: kind byte, field count byte, event count, and per field
+    a delta flag byte followed by one zigzag varint per event. Delta coded
+    fields store the difference to the previous event.
+
+Requires NumPy (see analysis/requirements.txt).
+"""
+
+from __future__ import annotations
+import sqlite3
+from typing import Dict, Iterator, Tuple
+
+import numpy as np
+
+MAGIC = b"BT"
+FORMAT_VERSION = 1
+
+# Stream kind -> (name, field names), must match behaviorTraces() in public/script.js
+STREAM_KINDS = {
+    1: ("mouse", ("t", "x", "y")),
+    2: ("key", ("t", "key_id", "down")),
+    3: ("scroll", ("t", "x", "y")),
+    4: ("touch", ("t", "x", "y", "phase")),
+}
+
+class TraceFormatError(ValueError):
+    pass
+
+def _read_varint(buf: bytes, pos: int) -> Tuple[int, int]:
+    """Decode a single varint at pos, return (value, next position)."""
+    value = shift = 0
+    while True:
+        if pos >= len(buf):
+            raise TraceFormatError("Truncated varint")
+        b = buf[pos]
+        pos += 1
+        value |= (b & 0x7F) << shift
+        if b < 0x80:
+            return value, pos
+        shift += 7
+
+def decode_varints(data: np.ndarray, pos: int, count: int) -> Tuple[np.ndarray, int]:
+    """Vectorized decode of count consecutive varints starting at pos.
+
+    Returns the values as uint64 and the position after the last varint.
+    """
+    if count == 0:
+        return np.zeros(0, dtype=np.uint64), pos
+    rest = data[pos:]
+    ends = np.flatnonzero(rest < 0x80)
+    if len(ends) < count:
+        raise TraceFormatError("Truncated field data")
+    end = ends[count - 1] + 1
+    chunk = rest[:end].astype(np.uint64)
+    starts = np.empty(count, dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:count - 1] + 1
+    # Byte position inside its varint -> shift of its 7-bit payload
+    group = np.repeat(np.arange(count), np.diff(np.append(starts, end)))
+    shifts = (np.arange(end) - starts[group]).astype(np.uint64) * np.uint64(7)
+    values = np.add.reduceat((chunk & np.uint64(0x7F)) << shifts, starts)
+    return values, pos + int(end)
+
+def unzigzag(values: np.ndarray) -> np.ndarray:
+    v = values.astype(np.uint64)
+    return (v >> np.uint64(1)).astype(np.int64) ^ -(v & np.uint64(1)).astype(np.int64)
+
+def decode_trace(blob: bytes) -> Dict[str, Dict[str, np.ndarray]]:
+    """Decode a trace blob into {stream name: {field name: array}}.
+
+    Timestamps ("t") are returned as float64 seconds since page load,
+    all other fields as int64.
+    """
+    blob = bytes(blob)
+    if len(blob) < 3 or blob[:2] != MAGIC:
+        raise TraceFormatError("Not a behavior trace")
+    if blob[2] != FORMAT_VERSION:
+        raise TraceFormatError(f"Unsupported trace format version {blob[2]}")
+    data = np.frombuffer(blob, dtype=np.uint8)
+    unit_us, pos = _read_varint(blob, 3)
+    n_streams, pos = _read_varint(blob, pos)
+
+    result: Dict[str, Dict[str, np.ndarray]] = {}
+    for _ in range(n_streams):
+        if pos + 2 > len(blob):
+            raise TraceFormatError("Truncated stream header")
+        kind, n_fields = blob[pos], blob[pos + 1]
+        count, pos = _read_varint(blob, pos + 2)
+        name, names = STREAM_KINDS.get(kind, (f"kind{kind}", ()))
+        fields = {}
+        for i in range(n_fields):
+            delta = blob[pos]
+            values, pos = decode_varints(data, pos + 1, count)
+            values = unzigzag(values)
+            if delta:
+                values = np.cumsum(values)
+            field = names[i] if i < len(names) else f"f{i}"
+            fields[field] = values
+        if "t" in fields:
+            fields["t"] = fields["t"] * (unit_us / 1e6)
+        result[name] = fields
+    return result
+
+def iter_traces(conn: sqlite3.Connection, after_id: int = 0,
+                batch_size: int = 500) -> Iterator[Tuple[int, Dict[str, Dict[str, np.ndarray]]]]:
+    """Yield (test id, decoded trace) for test rows that have a stored trace."""
+    cur = conn.execute("""SELECT t.id, b.data FROM tests t
+                          JOIN behavior_traces b ON b.trace_id = t.behavior_trace_id
+                          WHERE t.id > ? ORDER BY t.id""", (after_id,))
+    while True:
+        batch = cur.fetchmany(batch_size)
+        if not batch:
+            break
+        for test_id, blob in batch:
+            yield test_id, decode_trace(blob)
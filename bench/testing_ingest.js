@@ -0,0 +1,128 @@
+// Benchmark of the /api/testing ingestion path: the previous handler
+// (validator compiled at runtime, INSERT prepared by db.run for every request)
+// against lib/testing_ingest.js (standalone validator, statement prepared once).
+// Payloads are the recorded rows of db/data.db, inserted into a scratch database.
+//
+// Usage: npm run bench -- [requests] [concurrency,...]
+
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+const sqlite3 = require('sqlite3');
+const Ajv = require('ajv').default;
+const { TestingIngest, load_validator, EXTENSION_COLUMNS } = require('../lib/testing_ingest');
+
+const REQUESTS = Number(process.argv[2]) || 20000;
+const CONCURRENCY = (process.argv[3] || '1,8,64').split(',').map(Number);
+const schema = require('../testing_api_schema.json');
+
+function open(file, mode) {
+    return new Promise((resolve, reject) => {
+        const db = new sqlite3.Database(file, mode, (err) => err ? reject(err) : resolve(db));
+    });
+}
+
+function all(db, sql, params = []) {
+    return new Promise((resolve, reject) => db.all(sql, params, (err, rows) => err ? reject(err) : resolve(rows)));
+}
+
+function exec(db, sql) {
+    return new Promise((resolve, reject) => db.exec(sql, (err) => err ? reject(err) : resolve()));
+}
+
+// Request bodies as the collectors send them
+async function load_payloads(ingest) {
+    const source = await open(path.join(__dirname, '..', 'db', 'data.db'), sqlite3.OPEN_READONLY);
+    const rows = await all(source, 'SELECT * FROM tests');
+    const [{ sql: create_sql }] = await all(source, "SELECT sql FROM sqlite_master WHERE name = 'tests'");
+    source.close();
+    const payloads = rows.map(row => ({
+        timestamp: row.timestamp,
+        config: {
+            browser: row.browser,
+            privacy_max: Boolean(row.privacy_max),
+            incognito: Boolean(row.incognito),
+            extensions: Object.entries(EXTENSION_COLUMNS).filter(([col]) => row[col]).map(([, name]) => name)
+        },
+        title: 'Browser Fingerprinting Demo',
+        features: Object.fromEntries(ingest.features
+            .filter(([, column]) => typeof row[column] === 'string')
+            .map(([title, column]) => [title, row[column]]))
+    }));
+    return { payloads, create_sql };
+}
+
+// The previous handler: db.run compiles the INSERT for every request
+function legacy_handler(db, ingest, validate) {
+    return (body) => new Promise((resolve, reject) => {
+        if (!validate(body)) return reject(new Error('invalid body'));
+        const row = ingest.row(body);
+        db.run(ingest.sql, ingest.columns.map(column => row[column]), (err) => err ? reject(err) : resolve());
+    });
+}
+
+function prepared_handler(ingest, validate) {
+    return (body) => {
+        if (!validate(body)) return Promise.reject(new Error('invalid body'));
+        return ingest.insert(ingest.row(body));
+    };
+}
+
+// Closed loop: concurrency callers, each sending its next request after the previous answer
+async function run(handler, payloads, concurrency) {
+    let next = 0;
+    const start = process.hrtime.bigint();
+    const caller = async () => {
+        while (next < REQUESTS) {
+            await handler(payloads[next++ % payloads.length]);
+        }
+    };
+    await Promise.all(Array.from({ length: concurrency }, caller));
+    return REQUESTS / (Number(process.hrtime.bigint() - start) / 1e9);
+}
+
+function time_validation(validate, payloads) {
+    const start = process.hrtime.bigint();
+    for (let i = 0; i < REQUESTS; i++) {
+        validate(payloads[i % payloads.length]);
+    }
+    return REQUESTS / (Number(process.hrtime.bigint() - start) / 1e9);
+}
+
+async function main() {
+    const scratch = path.join(fs.mkdtempSync(path.join(os.tmpdir(), 'bench-')), 'bench.db');
+    const db = await open(scratch, sqlite3.OPEN_READWRITE | sqlite3.OPEN_CREATE);
+    const ingest = new TestingIngest(db, schema);
+    const { payloads, create_sql } = await load_payloads(ingest);
+    await exec(db, create_sql);
+    // Columns added by ensure_columns in index.js may be missing from an older data.db
+    const existing = (await all(db, 'PRAGMA table_info(tests)')).map(row => row.name);
+    for (const column of ingest.columns.filter(column => !existing.includes(column))) {
+        await exec(db, `ALTER TABLE tests ADD COLUMN ${column} TEXT`);
+    }
+    await exec(db, 'CREATE TABLE tls_captures (request_id TEXT PRIMARY KEY)');
+    await ingest.prepare();
+
+    const runtime_validate = new Ajv().compile(schema);
+    const standalone_validate = load_validator();
+    console.log(`${payloads.length} payloads, ${REQUESTS} requests per run, scratch database ${scratch}`);
+    console.log(`validation only: runtime ${time_validation(runtime_validate, payloads).toFixed(0)}/s, ` +
+        `standalone ${time_validation(standalone_validate, payloads).toFixed(0)}/s`);
+
+    const legacy = legacy_handler(db, ingest, runtime_validate);
+    const prepared = prepared_handler(ingest, standalone_validate);
+    console.log('concurrency | previous handler (req/s) | prepared statement (req/s) | speedup');
+    for (const concurrency of CONCURRENCY) {
+        const before = await run(legacy, payloads, concurrency);
+        const after = await run(prepared, payloads, concurrency);
+        console.log(`${concurrency} | ${before.toFixed(0)} | ${after.toFixed(0)} | ${(after / before).toFixed(2)}x`);
+    }
+
+    ingest.finalize();
+    db.close(() => fs.rmSync(path.dirname(scratch), { recursive: true, force: true }));
+}
+
+main().catch((err) => {
+    console.error(err);
+    process.exit(1);
+});
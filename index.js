@@ -1,80 +1,61 @@
+const cluster = require('cluster');
+const fs = require('fs');
+const os = require('os');
 const path = require('path');
 const express = require('express');
-const sqlite3 = require('sqlite3').verbose();
-const ajv = require("ajv").default;
+const { CONFIG_COLUMNS } = require('./lib/stats_cache');
+const { TlsCapture, feature_values } = require('./lib/tls_capture');
+const { TestingIngest, load_validator } = require('./lib/testing_ingest');
+const { Store, RemoteStore, serve_store } = require('./lib/store');
+const { StaticAssets, Page } = require('./lib/assets');
+const { registry, http_metrics, render_metrics, serve_metrics } = require('./lib/metrics');
 
 const app = express();
 const port = 3000;
-
-const db = new sqlite3.Database('./db/data.db', (err) => {
-    if (err) {
-        console.error("Could not connect to SQLite database", err);
-        process.exit(1);
-    }
-    console.log("Connected to SQLite database");
-});
-
-db.serialize(() => {
-    db.run(`CREATE TABLE IF NOT EXISTS users (
-        id TEXT PRIMARY KEY,
-        behaviour INTEGER
-    )`);
-    db.run(`CREATE TABLE IF NOT EXISTS tests (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp TEXT,
-        browser TEXT,
-        privacy_max INTEGER,
-        incognito INTEGER,
-        ublock_origin INTEGER,
-        privacy_badger INTEGER,
-        noscript INTEGER,
-        canvasblocker INTEGER,
-        comprehensive_fingerprint_hash TEXT,
-        canvas_fingerprint TEXT,
-        webgl_vendor TEXT,
-        webgl_renderer TEXT,
-        webgl_shader_precision TEXT,
-        detected_fonts TEXT,
-        user_agent TEXT,
-        screen_resolution TEXT,
-        device_pixel_ratio TEXT,
-        color_depth TEXT,
-        time_zone TEXT,
-        locale TEXT,
-        platform TEXT,
-        cpu_cores TEXT,
-        device_memory_gb TEXT,
-        multi_monitor_position TEXT,
-        media_devices TEXT,
-        webrtc_candidate TEXT,
-        cookies_enabled TEXT,
-        accept_language TEXT,
-        do_not_track TEXT,
-        plugins TEXT,
-        audio_fingerprint TEXT,
-        wasm_compile_time_ms TEXT,
-        tls_ja3 TEXT,
-        sni_dns_cert_info TEXT,
-        device_motion TEXT,
-        device_orientation TEXT,
-        mouse_sample TEXT,
-        key_press_sample TEXT,
-        scroll_sample TEXT,
-        touch_gestures_sample TEXT
-    )`);
-});
+const tls_port = process.env.TLS_PORT || 3443;
+// Scratch databases (e.g. for load tests) can be used instead of the collected data
+const db_path = process.env.DB_PATH || './db/data.db';
+// Number of HTTP worker processes, CLUSTER_WORKERS=auto starts one per core.
+// With more than one, the primary process only owns the database and the
+// workers forward their reads and writes to it.
+const cluster_workers = process.env.CLUSTER_WORKERS === 'auto'
+    ? os.availableParallelism()
+    : Number(process.env.CLUSTER_WORKERS) || 1;
+const serves_http = !(cluster.isPrimary && cluster_workers > 1);
+// NO_CACHE=1 sends every page and asset with "Cache-Control: no-store" (cold loads)
+const no_cache = ['1', 'true'].includes(process.env.NO_CACHE);
 
 const schema_testing_api = require("./testing_api_schema.json");
-const ajv_validator = new ajv();
-const validate_testing_api = ajv_validator.compile(schema_testing_api);
-
-app.set('view engine', 'ejs');
+// Generated by the primary process before the workers are forked, so they only load it
+const validate_testing_api = load_validator();
+// Only maps request bodies to rows here, the statements are prepared by the store
+const testing_ingest = new TestingIngest(null, schema_testing_api);
+const testing_rejections = registry.counter('testing_api_rejections_total',
+    'Bodies of /api/testing rejected by the JSON schema, by the keyword and path of the first error', ['keyword', 'path']);
+
+const store = cluster.isWorker ? new RemoteStore() : new Store(db_path, schema_testing_api);
+if (store.ready) {
+    store.ready.catch((err) => {
+        console.error("Could not open SQLite database", err);
+        process.exit(1);
+    });
+}
+
+// Page and assets are read, fingerprinted and compressed once at startup
+const assets = serves_http ? new StaticAssets(path.join(__dirname, 'public'), { no_cache }) : null;
+const page = serves_http ? new Page(path.join(__dirname, 'views', 'index.ejs'), assets, { no_cache }) : null;
+
+// First, so static files and the page are counted too
+app.use(http_metrics());
+if (assets) {
+    app.use(assets.middleware());
+}
 app.use(express.static(path.join(__dirname, 'public')));
 app.use(express.json());
 
 
 app.get('/', (req, res) => {
-    res.render('index');
+    page.send(req, res);
 });
 
 app.get('/api/fingerprint', async (req, res) => {
@@ -84,12 +65,7 @@ app.get('/api/fingerprint', async (req, res) => {
     }
 
     try {
-        const storedBehaviour = await new Promise((resolve, reject) => {
-            db.get("SELECT behaviour FROM users WHERE id = ?", [fingerprintId], (err, row) => {
-                if (err) reject(err);
-                else resolve(row);
-            });
-        });
+        const storedBehaviour = await store.get_behaviour(fingerprintId);
 
         if (!storedBehaviour) {
             return res.status(404).json({ success: false, message: 'No stored behaviour for fingerprintId.' });
@@ -112,13 +88,7 @@ app.post('/api/fingerprint', async (req, res) => {
     }
 
     try {
-        await new Promise((resolve, reject) => {
-            db.run("INSERT INTO users (id, behaviour) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET behaviour = (?)",
-                [fingerprintId, behaviour, behaviour], (err) => {
-                    if (err) reject(err);
-                    else resolve();
-                });
-        });
+        await store.save_behaviour(fingerprintId, behaviour);
 
         res.json({ success: true, message: 'FingerprintId and behaviour saved correctly!' });
     } catch (error) {
@@ -129,148 +99,13 @@ app.post('/api/fingerprint', async (req, res) => {
 
 app.post('/api/testing', async (req, res) => {
     if (!validate_testing_api(req.body)) {
+        const [error] = validate_testing_api.errors || [];
+        testing_rejections.inc({ keyword: error ? error.keyword : '', path: error ? error.instancePath : '' });
         return res.status(400).json({ success: false, message: 'Body does not match the required JSON schema for the endpoint.' });
     }
-    
-    const { 
-        timestamp, 
-        config: {
-            browser, 
-            privacy_max, 
-            incognito, 
-            extensions 
-        }, 
-        features: {
-            "Comprehensive Fingerprint Hash": comprehensive_fingerprint_hash,
-            "Canvas Fingerprint": canvas_fingerprint,
-             "WebGL Vendor": webgl_vendor,
-            "WebGL Renderer": webgl_renderer,
-            "WebGL Shader Precision": webgl_shader_precision,
-            "Detected Fonts": detected_fonts,
-            "User-Agent": user_agent,
-            "Screen Resolution": screen_resolution,
-            "Device Pixel Ratio": device_pixel_ratio,
-            "Color Depth": color_depth,
-            "Time Zone": time_zone,
-            "Locale": locale,
-            "Platform": platform,
-            "CPU Cores": cpu_cores,
-            "Device Memory (GB)": device_memory_gb,
-            "Multi-Monitor Position": multi_monitor_position,
-            "Media Devices": media_devices,
-            "WebRTC Candidate": webrtc_candidate,
-            "Cookies Enabled": cookies_enabled,
-            "Accept-Language":accept_language,
-            "Do Not Track": do_not_track,
-            "Plugins": plugins,
-            "Audio Fingerprint": audio_fingerprint,
-            "WASM Compile Time (ms)": wasm_compile_time_ms,
-            "TLS / JA3": tls_ja3,
-            "SNI / DNS / Cert Info": sni_dns_cert_info,
-            "Device Motion": device_motion,
-            "Device Orientation": device_orientation,
-            "Mouse Sample": mouse_sample,
-            "Key Press Sample": key_press_sample,
-            "Scroll Sample": scroll_sample,
-            "Touch Gestures Sample": touch_gestures_sample
-        } 
-    } = req.body;
-    
-    const ublock_origin = extensions.findIndex(elm => elm.includes("ublock origin (lite)")) === -1 ? 0 : 1;
-    const privacy_badger = extensions.findIndex(elm => elm.includes("privacy badger")) === -1 ? 0 : 1;
-    const noscript = extensions.findIndex(elm => elm.includes("noscript")) === -1 ? 0 : 1;
-    const canvasblocker = extensions.findIndex(elm => elm.includes("canvasblocker")) === -1 ? 0 : 1;
 
     try {
-        await new Promise((resolve, reject) => {
-            db.run(`INSERT INTO tests (
-                        timestamp,
-                        browser,
-                        privacy_max,
-                        incognito,
-                        ublock_origin,
-                        privacy_badger,
-                        noscript,
-                        canvasblocker,
-                        comprehensive_fingerprint_hash,
-                        canvas_fingerprint,
-                        webgl_vendor,
-                        webgl_renderer,
-                        webgl_shader_precision,
-                        detected_fonts,
-                        user_agent,
-                        screen_resolution,
-                        device_pixel_ratio,
-                        color_depth,
-                        time_zone,
-                        locale,
-                        platform,
-                        cpu_cores,
-                        device_memory_gb,
-                        multi_monitor_position,
-                        media_devices,
-                        webrtc_candidate,
-                        cookies_enabled,
-                        accept_language,
-                        do_not_track,
-                        plugins,
-                        audio_fingerprint,
-                        wasm_compile_time_ms,
-                        tls_ja3,
-                        sni_dns_cert_info,
-                        device_motion,
-                        device_orientation,
-                        mouse_sample,
-                        key_press_sample,
-                        scroll_sample,
-                        touch_gestures_sample
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)`,
-                [
-                    timestamp,
-                    browser,
-                    privacy_max,
-                    incognito,
-                    ublock_origin,
-                    privacy_badger,
-                    noscript,
-                    canvasblocker,
-                    comprehensive_fingerprint_hash,
-                    canvas_fingerprint,
-                    webgl_vendor,
-                    webgl_renderer,
-                    webgl_shader_precision,
-                    detected_fonts,
-                    user_agent,
-                    screen_resolution,
-                    device_pixel_ratio,
-                    color_depth,
-                    time_zone,
-                    locale,
-                    platform,
-                    cpu_cores,
-                    device_memory_gb,
-                    multi_monitor_position,
-                    media_devices,
-                    webrtc_candidate,
-                    cookies_enabled,
-                    accept_language,
-                    do_not_track,
-                    plugins,
-                    audio_fingerprint,
-                    wasm_compile_time_ms,
-                    tls_ja3,
-                    sni_dns_cert_info,
-                    device_motion,
-                    device_orientation,
-                    mouse_sample,
-                    key_press_sample,
-                    scroll_sample,
-                    touch_gestures_sample
-                ], (err) => {
-                    if (err) reject(err);
-                    else resolve();
-                });
-        });
+        await store.insert_test(testing_ingest.row(req.body));
 
         res.json({ success: true, message: 'Test results saved correctly!' });
     } catch (error) {
@@ -279,23 +114,131 @@ app.post('/api/testing', async (req, res) => {
     }
 });
 
-const server = app.listen(port, () => {
-    console.log(`Server running at http://localhost:${port}`);
+// Binary behavioral traces recorded by the page in trace mode (?traces=1)
+const TRACE_ID_PATTERN = /^[0-9a-f-]{32,36}$/;
+const TRACE_MAGIC = Buffer.from([0x42, 0x54]); // "BT"
+
+app.post('/api/traces/:traceId', express.raw({ type: 'application/octet-stream', limit: '2mb' }), async (req, res) => {
+    const traceId = req.params.traceId;
+    if (!TRACE_ID_PATTERN.test(traceId)) {
+        return res.status(400).json({ success: false, message: 'Invalid trace id.' });
+    }
+    if (!Buffer.isBuffer(req.body) || req.body.length < 3 || !req.body.subarray(0, 2).equals(TRACE_MAGIC)) {
+        return res.status(400).json({ success: false, message: 'Body is not an encoded behavior trace.' });
+    }
+
+    try {
+        await store.insert_trace(traceId, req.body);
+
+        res.json({ success: true, message: 'Behavior trace saved correctly!' });
+    } catch (error) {
+        console.error('Error adding behavior trace: ', error);
+        res.status(500).json({ error: 'Failed to save behavior trace' });
+    }
 });
 
-// Handle shutdown gracefully
-process.on("SIGTERM", () => {
-  console.log("SIGTERM received, shutting down...");
-  server.close(() => {
-    console.log("HTTP server closed");
-    process.exit(0);
-  });
+// TLS fingerprint (JA3/JA4) of the connection, only for requests to the TLS capture port.
+// The page passes a random request id so the capture can be joined to its test row.
+app.get('/api/tls/:requestId', async (req, res) => {
+    const requestId = req.params.requestId;
+    if (!TRACE_ID_PATTERN.test(requestId)) {
+        return res.status(400).json({ success: false, message: 'Invalid request id.' });
+    }
+    const capture = tls_capture ? tls_capture.lookup(req) : null;
+    if (!capture) {
+        return res.status(404).json({ success: false, message: 'Request was not made to the TLS capture port.' });
+    }
+
+    try {
+        await store.save_tls_capture(requestId, capture);
+
+        res.json({ success: true, ...capture, features: feature_values(capture) });
+    } catch (error) {
+        console.error('Error adding TLS capture: ', error);
+        res.status(500).json({ error: 'Failed to save TLS capture' });
+    }
+});
+
+app.get('/api/stats', async (req, res) => {
+    // A repeated column would not change the groups
+    const group_by = [...new Set(req.query.group_by ? String(req.query.group_by).split(',').filter(col => col) : [])];
+    const invalid = group_by.filter(col => !CONFIG_COLUMNS.includes(col));
+    if (invalid.length) {
+        return res.status(400).json({ success: false, message: `group_by must be a subset of: ${CONFIG_COLUMNS.join(', ')}` });
+    }
+
+    try {
+        const summary = await store.stats(group_by);
+        res.set('ETag', `"stats-${summary.generation}"`);
+        res.json(summary);
+    } catch (error) {
+        console.error('Error reading statistics: ', error);
+        res.status(500).json({ error: 'Failed to read statistics' });
+    }
 });
 
-process.on("SIGINT", () => {
-  console.log("SIGINT received, shutting down...");
-  server.close(() => {
-    console.log("HTTP server closed");
-    process.exit(0);
-  });
+// Prometheus metrics; in cluster mode the sum of all worker processes and the primary
+app.get('/metrics', async (req, res) => {
+    try {
+        res.set('Content-Type', 'text/plain; version=0.0.4; charset=utf-8');
+        res.send(await render_metrics());
+    } catch (error) {
+        console.error('Error collecting metrics: ', error);
+        res.status(500).send('Failed to collect metrics\n');
+    }
 });
+
+const server = serves_http ? app.listen(port, () => {
+    console.log(`Server running at http://localhost:${port}` + (cluster.isWorker ? ` (worker ${process.pid})` : ''));
+}) : null;
+
+// Optional TLS port with ClientHello capture, enabled when a key and certificate are configured
+const tls_capture = serves_http && process.env.TLS_KEY && process.env.TLS_CERT
+    ? new TlsCapture(app, {
+        key: fs.readFileSync(process.env.TLS_KEY),
+        cert: fs.readFileSync(process.env.TLS_CERT)
+    }).listen(tls_port, () => {
+        console.log(`TLS capture running at https://localhost:${tls_port}`);
+    })
+    : null;
+
+let shutting_down = false;
+
+if (!serves_http) {
+    // Buffers (behavior traces) are sent through IPC without a JSON round trip
+    cluster.setupPrimary({ serialization: 'advanced' });
+    const fork = () => {
+        const worker = cluster.fork();
+        serve_store(store, worker);
+        serve_metrics(worker);
+    };
+    for (let i = 0; i < cluster_workers; i++) {
+        fork();
+    }
+    cluster.on('exit', (worker, code, signal) => {
+        if (shutting_down) return;
+        console.error(`Worker ${worker.process.pid} exited (${signal || code}), starting a new one`);
+        fork();
+    });
+    console.log(`Cluster mode: ${cluster_workers} HTTP workers, database owned by process ${process.pid}`);
+}
+
+// Handle shutdown gracefully, the store writes its last batch before the process exits
+function shutdown(signal) {
+    if (shutting_down) return;
+    shutting_down = true;
+    console.log(`${signal} received, shutting down...`);
+    if (tls_capture) tls_capture.close();
+    const close_store = () => store.close ? store.close(() => process.exit(0)) : process.exit(0);
+    if (server) {
+        server.close(() => {
+            console.log("HTTP server closed");
+            close_store();
+        });
+    } else {
+        cluster.disconnect(close_store);
+    }
+}
+
+process.on("SIGTERM", () => shutdown("SIGTERM"));
+process.on("SIGINT", () => shutdown("SIGINT"));
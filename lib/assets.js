@@ -0,0 +1,143 @@
+// In-memory cache of the demonstrator page and its static assets.
+// Every file of public/ is read once at startup, fingerprinted with a hash of
+// its content and compressed ahead of time with brotli and gzip. The page
+// (views/index.ejs) is compiled and rendered once and links the assets by
+// their hashed names, so the browsers can keep them for a year and only
+// revalidate the page itself (ETag). With no_cache every response is sent
+// with "Cache-Control: no-store" for experiments that need cold loads.
+
+const crypto = require('crypto');
+const fs = require('fs');
+const path = require('path');
+const zlib = require('zlib');
+const ejs = require('ejs');
+
+// Preferred first
+const ENCODINGS = ['br', 'gzip'];
+
+const CONTENT_TYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.js': 'text/javascript; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.json': 'application/json; charset=utf-8',
+    '.svg': 'image/svg+xml',
+    '.png': 'image/png',
+    '.ico': 'image/x-icon'
+};
+
+const IMMUTABLE = 'public, max-age=31536000, immutable';
+const REVALIDATE = 'no-cache';
+
+// Identity body plus the compressed variants that are actually smaller
+function make_entry(body, type) {
+    const variants = { identity: body };
+    if (type.includes('charset') || type === 'image/svg+xml') {
+        const br = zlib.brotliCompressSync(body, {
+            params: {
+                [zlib.constants.BROTLI_PARAM_QUALITY]: zlib.constants.BROTLI_MAX_QUALITY,
+                [zlib.constants.BROTLI_PARAM_SIZE_HINT]: body.length
+            }
+        });
+        const gzip = zlib.gzipSync(body, { level: zlib.constants.Z_BEST_COMPRESSION });
+        if (br.length < body.length) variants.br = br;
+        if (gzip.length < body.length) variants.gzip = gzip;
+    }
+    return {
+        hash: crypto.createHash('sha256').update(body).digest('hex').slice(0, 12),
+        type,
+        variants
+    };
+}
+
+// Best encoding of an entry allowed by the Accept-Encoding header
+function negotiate(accept_encoding, variants) {
+    const accepted = new Map();
+    for (const part of String(accept_encoding || '').split(',')) {
+        const [name, ...params] = part.trim().toLowerCase().split(';');
+        const q = params.map(p => p.trim()).find(p => p.startsWith('q='));
+        accepted.set(name, q ? Number(q.slice(2)) : 1);
+    }
+    for (const encoding of ENCODINGS) {
+        const q = accepted.has(encoding) ? accepted.get(encoding) : (accepted.get('*') || 0);
+        if (variants[encoding] && q > 0) return encoding;
+    }
+    return 'identity';
+}
+
+function send_entry(req, res, entry, cache_control, no_cache) {
+    const encoding = negotiate(req.headers['accept-encoding'], entry.variants);
+    const body = entry.variants[encoding];
+    res.setHeader('Content-Type', entry.type);
+    res.setHeader('Vary', 'Accept-Encoding');
+    if (no_cache) {
+        res.setHeader('Cache-Control', 'no-store');
+    } else {
+        const etag = `"${entry.hash}${encoding === 'identity' ? '' : '-' + encoding}"`;
+        res.setHeader('Cache-Control', cache_control);
+        res.setHeader('ETag', etag);
+        const if_none_match = req.headers['if-none-match'];
+        if (if_none_match && if_none_match.split(',').some(tag => tag.trim().replace(/^W\//, '') === etag)) {
+            res.statusCode = 304;
+            return res.end();
+        }
+    }
+    if (encoding !== 'identity') {
+        res.setHeader('Content-Encoding', encoding);
+    }
+    res.setHeader('Content-Length', body.length);
+    res.end(req.method === 'HEAD' ? undefined : body);
+}
+
+class StaticAssets {
+    constructor(dir, { no_cache = false } = {}) {
+        this.no_cache = no_cache;
+        this.files = new Map();
+        this.hashed_names = new Map();
+        for (const name of fs.readdirSync(dir)) {
+            const file = path.join(dir, name);
+            if (!fs.statSync(file).isFile()) continue;
+            const ext = path.extname(name);
+            const entry = make_entry(fs.readFileSync(file), CONTENT_TYPES[ext] || 'application/octet-stream');
+            entry.hashed_name = `${path.basename(name, ext)}.${entry.hash}${ext}`;
+            this.files.set(name, entry);
+            this.hashed_names.set(entry.hashed_name, entry);
+        }
+    }
+
+    // URL of an asset for the page: the hashed name, or the plain one with no_cache
+    url(name) {
+        const entry = this.files.get(name);
+        if (!entry) {
+            throw new Error(`Unknown asset ${name}`);
+        }
+        return '/' + (this.no_cache ? name : entry.hashed_name);
+    }
+
+    // Express middleware, hashed names are cached for good, plain names are revalidated
+    middleware() {
+        return (req, res, next) => {
+            if (req.method !== 'GET' && req.method !== 'HEAD') return next();
+            const name = req.path.slice(1);
+            const hashed = this.hashed_names.get(name);
+            const entry = hashed || this.files.get(name);
+            if (!entry) return next();
+            send_entry(req, res, entry, hashed ? IMMUTABLE : REVALIDATE, this.no_cache);
+        };
+    }
+}
+
+// The demonstrator page, rendered once from the precompiled template
+class Page {
+    constructor(view_path, assets, { no_cache = false } = {}) {
+        this.no_cache = no_cache;
+        const template = ejs.compile(fs.readFileSync(view_path, 'utf8'), { filename: view_path });
+        const html = template({ asset: (name) => assets.url(name) });
+        this.entry = make_entry(Buffer.from(html), CONTENT_TYPES['.html']);
+    }
+
+    send(req, res) {
+        send_entry(req, res, this.entry, REVALIDATE, this.no_cache);
+    }
+}
+
+module.exports = { StaticAssets, Page, negotiate };
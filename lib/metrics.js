@@ -0,0 +1,273 @@
+// Prometheus metrics of the webserver, served on /metrics in the text
+// exposition format (version 0.0.4), without a client library.
+// Counters and histograms live in the process that records them. In cluster
+// mode the HTTP workers record the requests and the primary process the
+// database writes; a worker answering /metrics asks the primary, which
+// collects a snapshot of every worker and adds them up.
+
+const cluster = require('cluster');
+
+// Seconds, from a cached static asset to a slow batch commit
+const DEFAULT_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10];
+// Workers that did not send their snapshot by then are left out
+const COLLECT_TIMEOUT_MS = 1000;
+
+function label_key(label_names, labels) {
+    return JSON.stringify(label_names.map(name => String(labels[name] ?? '')));
+}
+
+function format_labels(label_names, values, extra = '') {
+    const pairs = label_names.map((name, i) =>
+        `${name}="${values[i].replace(/\\/g, '\\\\').replace(/\n/g, '\\n').replace(/"/g, '\\"')}"`);
+    if (extra) pairs.push(extra);
+    return pairs.length ? `{${pairs.join(',')}}` : '';
+}
+
+function format_value(value) {
+    return Number.isFinite(value) ? String(value) : (value > 0 ? '+Inf' : value < 0 ? '-Inf' : 'NaN');
+}
+
+class Metric {
+    constructor(type, name, help, label_names = []) {
+        this.type = type;
+        this.name = name;
+        this.help = help;
+        this.label_names = label_names;
+        // label_key -> value (counter, gauge) or { buckets, sum, count } (histogram)
+        this.values = new Map();
+    }
+}
+
+class Counter extends Metric {
+    constructor(name, help, label_names) {
+        super('counter', name, help, label_names);
+    }
+
+    inc(labels = {}, amount = 1) {
+        const key = label_key(this.label_names, labels);
+        this.values.set(key, (this.values.get(key) || 0) + amount);
+    }
+}
+
+class Gauge extends Metric {
+    constructor(name, help, label_names) {
+        super('gauge', name, help, label_names);
+    }
+
+    inc(labels = {}, amount = 1) {
+        const key = label_key(this.label_names, labels);
+        this.values.set(key, (this.values.get(key) || 0) + amount);
+    }
+
+    dec(labels = {}, amount = 1) {
+        this.inc(labels, -amount);
+    }
+}
+
+class Histogram extends Metric {
+    constructor(name, help, label_names, buckets = DEFAULT_BUCKETS) {
+        super('histogram', name, help, label_names);
+        this.buckets = buckets;
+    }
+
+    observe(labels, value) {
+        const key = label_key(this.label_names, labels);
+        let entry = this.values.get(key);
+        if (!entry) {
+            entry = { buckets: new Array(this.buckets.length).fill(0), sum: 0, count: 0 };
+            this.values.set(key, entry);
+        }
+        // Cumulative buckets are summed up when rendering
+        const i = this.buckets.findIndex(bound => value <= bound);
+        if (i >= 0) entry.buckets[i]++;
+        entry.sum += value;
+        entry.count++;
+    }
+
+    // Observes the seconds until the returned function is called
+    start_timer(labels = {}) {
+        const start = process.hrtime.bigint();
+        return (more_labels = {}) => this.observe({ ...labels, ...more_labels },
+            Number(process.hrtime.bigint() - start) / 1e9);
+    }
+}
+
+class Registry {
+    constructor() {
+        this.metrics = new Map();
+    }
+
+    register(metric) {
+        if (this.metrics.has(metric.name)) {
+            throw new Error(`Metric ${metric.name} is already registered`);
+        }
+        this.metrics.set(metric.name, metric);
+        return metric;
+    }
+
+    counter(name, help, label_names) {
+        return this.register(new Counter(name, help, label_names));
+    }
+
+    gauge(name, help, label_names) {
+        return this.register(new Gauge(name, help, label_names));
+    }
+
+    histogram(name, help, label_names, buckets) {
+        return this.register(new Histogram(name, help, label_names, buckets));
+    }
+
+    // Plain object of all metrics, sent through IPC
+    snapshot() {
+        return [...this.metrics.values()].map(m => ({
+            type: m.type, name: m.name, help: m.help, label_names: m.label_names, buckets: m.buckets,
+            values: [...m.values.entries()]
+        }));
+    }
+
+    // Text exposition of the summed snapshots of one or more processes
+    static render(snapshots) {
+        const merged = new Map();
+        for (const metric of snapshots.flat()) {
+            let target = merged.get(metric.name);
+            if (!target) {
+                target = { ...metric, values: new Map() };
+                merged.set(metric.name, target);
+            }
+            for (const [key, value] of metric.values) {
+                const current = target.values.get(key);
+                if (metric.type !== 'histogram') {
+                    target.values.set(key, (current || 0) + value);
+                } else if (!current) {
+                    target.values.set(key, { buckets: [...value.buckets], sum: value.sum, count: value.count });
+                } else {
+                    value.buckets.forEach((n, i) => { current.buckets[i] += n; });
+                    current.sum += value.sum;
+                    current.count += value.count;
+                }
+            }
+        }
+
+        const lines = [];
+        for (const m of merged.values()) {
+            lines.push(`# HELP ${m.name} ${m.help}`, `# TYPE ${m.name} ${m.type}`);
+            for (const [key, value] of m.values) {
+                const values = JSON.parse(key);
+                if (m.type !== 'histogram') {
+                    lines.push(`${m.name}${format_labels(m.label_names, values)} ${format_value(value)}`);
+                    continue;
+                }
+                let cumulative = 0;
+                m.buckets.forEach((bound, i) => {
+                    cumulative += value.buckets[i];
+                    lines.push(`${m.name}_bucket${format_labels(m.label_names, values, `le="${bound}"`)} ${cumulative}`);
+                });
+                lines.push(`${m.name}_bucket${format_labels(m.label_names, values, 'le="+Inf"')} ${value.count}`);
+                lines.push(`${m.name}_sum${format_labels(m.label_names, values)} ${format_value(value.sum)}`);
+                lines.push(`${m.name}_count${format_labels(m.label_names, values)} ${value.count}`);
+            }
+        }
+        return lines.join('\n') + '\n';
+    }
+}
+
+// Metrics of this process
+const registry = new Registry();
+
+const http_requests = registry.counter('http_requests_total',
+    'HTTP requests by method, route and status code', ['method', 'route', 'status']);
+const http_duration = registry.histogram('http_request_duration_seconds',
+    'Time until the response was sent, by method and route', ['method', 'route']);
+const http_in_flight = registry.gauge('http_requests_in_flight', 'Requests being handled');
+
+// Route label of a finished request: the Express route pattern, so ids in
+// the path don't create a series per request
+function route_label(req, res) {
+    if (req.route) return req.baseUrl + req.route.path;
+    return res.statusCode === 404 ? 'unmatched' : 'static';
+}
+
+// Records every request; mounted before the static files and routes
+function http_metrics() {
+    return (req, res, next) => {
+        const end_timer = http_duration.start_timer({ method: req.method });
+        http_in_flight.inc();
+        let done = false;
+        const finish = () => {
+            if (done) return;
+            done = true;
+            http_in_flight.dec();
+            const route = route_label(req, res);
+            end_timer({ route });
+            http_requests.inc({ method: req.method, route, status: res.statusCode });
+        };
+        res.on('finish', finish);
+        res.on('close', finish);
+        next();
+    };
+}
+
+// Primary process: answer the /metrics requests of the workers with the sum of all processes
+function serve_metrics(worker) {
+    worker.on('message', (msg) => {
+        if (!msg || msg.metrics_call === undefined) return;
+        const workers = Object.values(cluster.workers).filter(w => w.isConnected());
+        Promise.all(workers.map(collect_snapshot)).then((snapshots) => {
+            const text = Registry.render([registry.snapshot(), ...snapshots.filter(s => s)]);
+            if (worker.isConnected()) worker.send({ metrics_reply: msg.metrics_call, text });
+        });
+    });
+}
+
+let next_collect = 0;
+
+// Snapshot of a worker's registry, null if it doesn't answer in time
+function collect_snapshot(worker) {
+    return new Promise((resolve) => {
+        const id = next_collect++;
+        const done = (snapshot) => {
+            clearTimeout(timer);
+            worker.off('message', on_message);
+            resolve(snapshot);
+        };
+        const on_message = (msg) => {
+            if (msg && msg.metrics_snapshot === id) done(msg.snapshot);
+        };
+        const timer = setTimeout(() => done(null), COLLECT_TIMEOUT_MS);
+        worker.on('message', on_message);
+        worker.send({ metrics_collect: id });
+    });
+}
+
+// Worker process: send snapshots to the primary and forward /metrics to it
+let next_call = 0;
+const pending_calls = new Map();
+
+if (cluster.isWorker) {
+    process.on('message', (msg) => {
+        if (msg && msg.metrics_collect !== undefined) {
+            process.send({ metrics_snapshot: msg.metrics_collect, snapshot: registry.snapshot() });
+        } else if (msg && msg.metrics_reply !== undefined) {
+            const resolve = pending_calls.get(msg.metrics_reply);
+            pending_calls.delete(msg.metrics_reply);
+            if (resolve) resolve(msg.text);
+        }
+    });
+}
+
+// Text of /metrics: this process alone, or every process in cluster mode
+function render_metrics() {
+    if (!cluster.isWorker) return Promise.resolve(Registry.render([registry.snapshot()]));
+    return new Promise((resolve, reject) => {
+        const id = next_call++;
+        pending_calls.set(id, resolve);
+        process.send({ metrics_call: id }, (err) => {
+            if (err) {
+                pending_calls.delete(id);
+                reject(err);
+            }
+        });
+    });
+}
+
+module.exports = { Registry, Counter, Gauge, Histogram, registry, http_metrics, render_metrics, serve_metrics };
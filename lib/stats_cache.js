@@ -0,0 +1,128 @@
+// Cached aggregate statistics over the tests table.
+// The cache is filled once from the database at startup and then updated
+// incrementally on every /api/testing insert. Every insert bumps the
+// generation number, rendered responses are only reused for the same generation.
+
+const CONFIG_COLUMNS = [
+    'browser',
+    'privacy_max',
+    'incognito',
+    'ublock_origin',
+    'privacy_badger',
+    'noscript',
+    'canvasblocker'
+];
+
+// Columns that contribute to the privacy score (see README 2.4)
+const PRIVACY_SCORE_COLUMNS = CONFIG_COLUMNS.filter(col => col !== 'browser');
+
+function config_key(row) {
+    return CONFIG_COLUMNS.map(col => String(row[col])).join('|');
+}
+
+class StatsCache {
+    constructor() {
+        this.generation = 0;
+        this.total_rows = 0;
+        this.configs = new Map();
+        this.responses = new Map();
+    }
+
+    // Fill the cache from all stored rows, only called once at startup
+    load(db) {
+        return new Promise((resolve, reject) => {
+            db.each(`SELECT ${CONFIG_COLUMNS.join(', ')}, comprehensive_fingerprint_hash FROM tests`,
+                (err, row) => {
+                    if (!err) this.record(row);
+                },
+                (err) => {
+                    if (err) reject(err);
+                    else resolve(this.generation);
+                });
+        });
+    }
+
+    record(row) {
+        const key = config_key(row);
+        let entry = this.configs.get(key);
+        if (!entry) {
+            entry = { config: {}, rows: 0, privacy_score_sum: 0, singletons: 0, hashes: new Map() };
+            CONFIG_COLUMNS.forEach(col => entry.config[col] = row[col]);
+            this.configs.set(key, entry);
+        }
+
+        const hash = row.comprehensive_fingerprint_hash;
+        const seen = entry.hashes.get(hash) || 0;
+        entry.hashes.set(hash, seen + 1);
+        // Keep the number of hashes seen exactly once up to date
+        if (seen === 0) entry.singletons++;
+        else if (seen === 1) entry.singletons--;
+
+        entry.rows++;
+        entry.privacy_score_sum += PRIVACY_SCORE_COLUMNS.reduce((sum, col) => sum + Number(row[col]), 0);
+        this.total_rows++;
+        this.generation++;
+        this.responses.clear();
+    }
+
+    // Aggregate the per-config entries by the given config columns.
+    // The result is cached until the next insert.
+    summary(group_by = []) {
+        // A repeated column would not change the groups
+        group_by = [...new Set(group_by)];
+        const invalid = group_by.filter(col => !CONFIG_COLUMNS.includes(col));
+        if (invalid.length) {
+            throw new Error(`Unknown group_by column(s): ${invalid.join(', ')}`);
+        }
+
+        const cache_key = group_by.join(',');
+        const cached = this.responses.get(cache_key);
+        if (cached) return cached;
+
+        const groups = new Map();
+        for (const entry of this.configs.values()) {
+            const key = group_by.map(col => String(entry.config[col])).join('|');
+            let group = groups.get(key);
+            if (!group) {
+                group = { rows: 0, privacy_score_sum: 0, hashes: new Map() };
+                group_by.forEach(col => group[col] = entry.config[col]);
+                groups.set(key, group);
+            }
+            group.rows += entry.rows;
+            group.privacy_score_sum += entry.privacy_score_sum;
+            if (new Set(group_by).size === CONFIG_COLUMNS.length) {
+                // A single config per group, reuse its counters directly
+                group.hashes = entry.hashes;
+                group.singletons = entry.singletons;
+                continue;
+            }
+            // The same hash can show up in several configs of a group
+            for (const [hash, count] of entry.hashes) {
+                group.hashes.set(hash, (group.hashes.get(hash) || 0) + count);
+            }
+        }
+
+        const response = {
+            generation: this.generation,
+            total_rows: this.total_rows,
+            group_by: group_by,
+            groups: Array.from(groups.values()).map(group => {
+                const { privacy_score_sum, hashes, ...rest } = group;
+                const singletons = group.singletons !== undefined
+                    ? group.singletons
+                    : Array.from(hashes.values()).filter(count => count === 1).length;
+                return {
+                    ...rest,
+                    singletons: singletons,
+                    distinct_hashes: hashes.size,
+                    unique_cfh_rate: group.rows ? singletons / group.rows : 0,
+                    avg_privacy_score: group.rows ? privacy_score_sum / group.rows : 0
+                };
+            })
+        };
+        this.responses.set(cache_key, response);
+        return response;
+    }
+}
+
+module.exports = { StatsCache, CONFIG_COLUMNS, config_key };
@@ -0,0 +1,299 @@
+// Database access of the webserver.
+// Store owns the SQLite connection: it creates the schema, keeps the
+// statistics cache and writes /api/testing rows in batches (one transaction
+// per batch). In cluster mode only the primary process opens the database;
+// the HTTP workers use RemoteStore, which forwards the same calls over IPC.
+
+const sqlite3 = require('sqlite3').verbose();
+const { StatsCache } = require('./stats_cache');
+const { TestingIngest } = require('./testing_ingest');
+const { feature_values } = require('./tls_capture');
+const { registry } = require('./metrics');
+
+// A batch is written when it is full or when the oldest row waited this long
+const BATCH_MAX_ROWS = 200;
+const BATCH_DELAY_MS = 5;
+
+const db_write_duration = registry.histogram('db_write_duration_seconds',
+    'Time of a database write; test_batch is the transaction of one batch of tests rows', ['operation']);
+const db_batch_rows = registry.histogram('db_batch_rows', 'Rows per batch of the tests table', [],
+    [1, 2, 5, 10, 20, 50, 100, BATCH_MAX_ROWS]);
+
+// Methods that can be called through RemoteStore
+const STORE_METHODS = ['get_behaviour', 'save_behaviour', 'insert_test', 'insert_trace', 'save_tls_capture', 'stats'];
+
+class Store {
+    constructor(db_path, schema) {
+        this.stats_cache = new StatsCache();
+        this.testing_ingest = null;
+        this.pending_tests = [];
+        this.flush_timer = null;
+        this.ready = new Promise((resolve, reject) => {
+            this.db = new sqlite3.Database(db_path, (err) => {
+                if (err) return reject(err);
+                console.log("Connected to SQLite database");
+                this.testing_ingest = new TestingIngest(this.db, schema);
+                this.create_schema()
+                    .then(() => Promise.all([this.testing_ingest.prepare(), this.stats_cache.load(this.db)]))
+                    .then(() => {
+                        console.log(`Statistics cache loaded (${this.stats_cache.total_rows} test rows)`);
+                        resolve(this);
+                    }, reject);
+            });
+        });
+    }
+
+    create_schema() {
+        const db = this.db;
+        let columns_ready;
+        db.serialize(() => {
+            db.run(`CREATE TABLE IF NOT EXISTS users (
+                id TEXT PRIMARY KEY,
+                behaviour INTEGER
+            )`);
+            db.run(`CREATE TABLE IF NOT EXISTS tests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT,
+                browser TEXT,
+                privacy_max INTEGER,
+                incognito INTEGER,
+                ublock_origin INTEGER,
+                privacy_badger INTEGER,
+                noscript INTEGER,
+                canvasblocker INTEGER,
+                comprehensive_fingerprint_hash TEXT,
+                canvas_fingerprint TEXT,
+                webgl_vendor TEXT,
+                webgl_renderer TEXT,
+                webgl_shader_precision TEXT,
+                detected_fonts TEXT,
+                user_agent TEXT,
+                screen_resolution TEXT,
+                device_pixel_ratio TEXT,
+                color_depth TEXT,
+                time_zone TEXT,
+                locale TEXT,
+                platform TEXT,
+                cpu_cores TEXT,
+                device_memory_gb TEXT,
+                multi_monitor_position TEXT,
+                media_devices TEXT,
+                webrtc_candidate TEXT,
+                cookies_enabled TEXT,
+                accept_language TEXT,
+                do_not_track TEXT,
+                plugins TEXT,
+                audio_fingerprint TEXT,
+                wasm_compile_time_ms TEXT,
+                tls_ja3 TEXT,
+                sni_dns_cert_info TEXT,
+                device_motion TEXT,
+                device_orientation TEXT,
+                mouse_sample TEXT,
+                key_press_sample TEXT,
+                scroll_sample TEXT,
+                touch_gestures_sample TEXT,
+                behavior_trace_id TEXT,
+                tls_request_id TEXT
+            )`);
+            db.run(`CREATE TABLE IF NOT EXISTS behavior_traces (
+                trace_id TEXT PRIMARY KEY,
+                received TEXT,
+                data BLOB
+            )`);
+            db.run(`CREATE TABLE IF NOT EXISTS tls_captures (
+                request_id TEXT PRIMARY KEY,
+                received TEXT,
+                ja3 TEXT,
+                ja3_hash TEXT,
+                ja3n_hash TEXT,
+                ja4 TEXT,
+                sni TEXT,
+                alpn TEXT,
+                protocol TEXT,
+                cipher TEXT
+            )`);
+            columns_ready = this.ensure_columns('tests', { behavior_trace_id: 'TEXT', tls_request_id: 'TEXT' });
+        });
+        return columns_ready;
+    }
+
+    // Add columns that were introduced after the tests table was first created
+    ensure_columns(table, columns) {
+        return new Promise((resolve, reject) => {
+            this.db.all(`PRAGMA table_info(${table})`, (err, rows) => {
+                if (err) {
+                    console.error(`Could not read columns of table ${table}`, err);
+                    return reject(err);
+                }
+                const existing = rows.map(row => row.name);
+                const missing = Object.entries(columns).filter(([name]) => !existing.includes(name));
+                let pending = missing.length;
+                if (!pending) return resolve();
+                for (const [name, type] of missing) {
+                    this.db.run(`ALTER TABLE ${table} ADD COLUMN ${name} ${type}`, (err) => {
+                        if (err) return reject(err);
+                        if (--pending === 0) resolve();
+                    });
+                }
+            });
+        });
+    }
+
+    get_behaviour(fingerprint_id) {
+        return new Promise((resolve, reject) => {
+            this.db.get("SELECT behaviour FROM users WHERE id = ?", [fingerprint_id], (err, row) => {
+                if (err) reject(err);
+                else resolve(row);
+            });
+        });
+    }
+
+    save_behaviour(fingerprint_id, behaviour) {
+        const end_timer = db_write_duration.start_timer({ operation: 'behaviour' });
+        return new Promise((resolve, reject) => {
+            this.db.run("INSERT INTO users (id, behaviour) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET behaviour = (?)",
+                [fingerprint_id, behaviour, behaviour], (err) => {
+                    end_timer();
+                    if (err) reject(err);
+                    else resolve();
+                });
+        });
+    }
+
+    // Queue a row of the tests table (see TestingIngest.row), resolves once it is committed
+    async insert_test(row) {
+        await this.ready;
+        // Prefer the ClientHello captured by the server over the values reported by the page
+        const tls_capture_row = row.tls_request_id ? await this.testing_ingest.tls_capture(row.tls_request_id) : null;
+        if (tls_capture_row) {
+            Object.assign(row, feature_values(tls_capture_row));
+        }
+        return new Promise((resolve, reject) => {
+            this.pending_tests.push({ row, resolve, reject });
+            if (this.pending_tests.length >= BATCH_MAX_ROWS) {
+                this.flush_tests();
+            } else if (!this.flush_timer) {
+                this.flush_timer = setTimeout(() => this.flush_tests(), BATCH_DELAY_MS);
+            }
+        });
+    }
+
+    // Write the queued rows in one transaction. A failing row only rejects its
+    // own request; a failing commit rejects the whole batch.
+    flush_tests() {
+        clearTimeout(this.flush_timer);
+        this.flush_timer = null;
+        const batch = this.pending_tests;
+        this.pending_tests = [];
+        if (!batch.length) return;
+
+        db_batch_rows.observe({}, batch.length);
+        const end_timer = db_write_duration.start_timer({ operation: 'test_batch' });
+        this.db.serialize(() => {
+            this.db.run('BEGIN');
+            const inserts = batch.map(({ row }) => this.testing_ingest.insert(row).then(() => null, err => err));
+            this.db.run('COMMIT', (commit_err) => {
+                end_timer();
+                Promise.all(inserts).then(errors => batch.forEach(({ row, resolve, reject }, i) => {
+                    const err = commit_err || errors[i];
+                    if (err) return reject(err);
+                    this.stats_cache.record(row);
+                    resolve();
+                }));
+            });
+        });
+    }
+
+    insert_trace(trace_id, data) {
+        const end_timer = db_write_duration.start_timer({ operation: 'trace' });
+        return new Promise((resolve, reject) => {
+            this.db.run("INSERT INTO behavior_traces (trace_id, received, data) VALUES (?, ?, ?)",
+                // Arrives as a Uint8Array through IPC
+                [trace_id, new Date().toISOString(), Buffer.from(data.buffer, data.byteOffset, data.byteLength)], (err) => {
+                    end_timer();
+                    if (err) reject(err);
+                    else resolve();
+                });
+        });
+    }
+
+    save_tls_capture(request_id, capture) {
+        const end_timer = db_write_duration.start_timer({ operation: 'tls_capture' });
+        return new Promise((resolve, reject) => {
+            this.db.run(`INSERT OR REPLACE INTO tls_captures (request_id, received, ja3, ja3_hash, ja3n_hash, ja4, sni, alpn, protocol, cipher)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)`,
+                [request_id, new Date().toISOString(), capture.ja3, capture.ja3_hash, capture.ja3n_hash,
+                    capture.ja4, capture.sni, capture.alpn, capture.protocol, capture.cipher], (err) => {
+                    end_timer();
+                    if (err) reject(err);
+                    else resolve();
+                });
+        });
+    }
+
+    stats(group_by) {
+        return this.stats_cache.summary(group_by);
+    }
+
+    close(callback) {
+        this.flush_tests();
+        // Queued behind the COMMIT of the last batch
+        this.db.serialize(() => this.db.get('SELECT 1', () => {
+            if (this.testing_ingest) this.testing_ingest.finalize();
+            this.db.close(callback);
+        }));
+    }
+}
+
+// Store of an HTTP worker: every call is answered by the database owner (primary process)
+class RemoteStore {
+    constructor() {
+        this.next_id = 0;
+        this.pending = new Map();
+        process.on('message', (msg) => {
+            const call = msg && msg.store_reply !== undefined ? this.pending.get(msg.store_reply) : null;
+            if (!call) return;
+            this.pending.delete(msg.store_reply);
+            if (msg.error !== undefined) call.reject(new Error(msg.error));
+            else call.resolve(msg.result);
+        });
+    }
+
+    call(method, args) {
+        return new Promise((resolve, reject) => {
+            const id = this.next_id++;
+            this.pending.set(id, { resolve, reject });
+            process.send({ store_call: id, method, args }, (err) => {
+                if (err) {
+                    this.pending.delete(id);
+                    reject(err);
+                }
+            });
+        });
+    }
+}
+
+for (const method of STORE_METHODS) {
+    RemoteStore.prototype[method] = function (...args) {
+        return this.call(method, args);
+    };
+}
+
+// Answer the RemoteStore calls of a cluster worker
+function serve_store(store, worker) {
+    worker.on('message', (msg) => {
+        if (!msg || msg.store_call === undefined) return;
+        const reply = (fields) => {
+            if (worker.isConnected()) worker.send({ store_reply: msg.store_call, ...fields });
+        };
+        if (!STORE_METHODS.includes(msg.method)) {
+            return reply({ error: `Unknown store method ${msg.method}` });
+        }
+        Promise.resolve()
+            .then(() => store[msg.method](...msg.args))
+            .then(result => reply({ result }), err => reply({ error: err.message || String(err) }));
+    });
+}
+
+module.exports = { Store, RemoteStore, serve_store, STORE_METHODS };
@@ -0,0 +1,141 @@
+// Ingestion path of /api/testing.
+// The validator is generated from testing_api_schema.json as standalone code
+// (npm run build, also run by the Dockerfile; regenerated at startup when the
+// schema is newer and the directory is writable), the
+// feature title -> column mapping is derived from the same schema, and the
+// INSERT is prepared once at startup and reused for every request.
+
+const fs = require('fs');
+const path = require('path');
+const { CONFIG_COLUMNS } = require('./stats_cache');
+
+const SCHEMA_PATH = path.join(__dirname, '..', 'testing_api_schema.json');
+const VALIDATOR_PATH = path.join(__dirname, 'generated', 'validate_testing_api.js');
+
+// Extension names sent by the collectors -> config column
+const EXTENSION_COLUMNS = {
+    ublock_origin: 'ublock origin (lite)',
+    privacy_badger: 'privacy badger',
+    noscript: 'noscript',
+    canvasblocker: 'canvasblocker'
+};
+
+// "Device Memory (GB)" -> device_memory_gb, same as the columns of the tests table
+function column_name(title) {
+    return title.toLowerCase().replace(/[^a-z0-9]+/g, '_').replace(/^_+|_+$/g, '');
+}
+
+// Compile the schema, returns the validator and its standalone code
+function compile_validator(schema_path = SCHEMA_PATH) {
+    const Ajv = require('ajv').default;
+    const standalone_code = require('ajv/dist/standalone').default;
+    const ajv = new Ajv({ code: { source: true } });
+    const validate = ajv.compile(JSON.parse(fs.readFileSync(schema_path, 'utf8')));
+    return { validate, code: standalone_code(ajv, validate) };
+}
+
+// Write the standalone validator (npm run build)
+function generate_validator(schema_path = SCHEMA_PATH, validator_path = VALIDATOR_PATH) {
+    fs.mkdirSync(path.dirname(validator_path), { recursive: true });
+    fs.writeFileSync(validator_path, compile_validator(schema_path).code);
+    return validator_path;
+}
+
+// Load the standalone validator, generating it when it is missing or older than the schema.
+// Falls back to the in-memory validator if the generated file can't be written.
+function load_validator(schema_path = SCHEMA_PATH, validator_path = VALIDATOR_PATH) {
+    const schema_mtime = fs.statSync(schema_path).mtimeMs;
+    try {
+        if (fs.statSync(validator_path).mtimeMs >= schema_mtime) {
+            return require(validator_path);
+        }
+    } catch (err) {
+        // Not generated yet
+    }
+
+    const { validate, code } = compile_validator(schema_path);
+    try {
+        fs.mkdirSync(path.dirname(validator_path), { recursive: true });
+        fs.writeFileSync(validator_path, code);
+        delete require.cache[require.resolve(validator_path)];
+        return require(validator_path);
+    } catch (err) {
+        console.error('Could not write the standalone validator (see npm run build), using the compiled one', err);
+        return validate;
+    }
+}
+
+class TestingIngest {
+    constructor(db, schema) {
+        this.db = db;
+        this.features = Object.keys(schema.properties.features.properties)
+            .map(title => [title, column_name(title)]);
+        this.columns = ['timestamp', ...CONFIG_COLUMNS, ...this.features.map(([, column]) => column)];
+        this.sql = `INSERT INTO tests (${this.columns.join(', ')}) VALUES (${this.columns.map(() => '?').join(', ')})`;
+        this.insert_statement = null;
+        this.tls_statement = null;
+    }
+
+    // Prepare the statements, call once the tests table has all columns
+    prepare() {
+        const prepare = (sql) => new Promise((resolve, reject) => {
+            const statement = this.db.prepare(sql, (err) => {
+                if (err) reject(err);
+                else resolve(statement);
+            });
+        });
+        return Promise.all([
+            prepare(this.sql),
+            prepare('SELECT * FROM tls_captures WHERE request_id = ?')
+        ]).then(([insert_statement, tls_statement]) => {
+            this.insert_statement = insert_statement;
+            this.tls_statement = tls_statement;
+            return this;
+        });
+    }
+
+    // Row of the tests table (column -> value) for a validated request body
+    row(body) {
+        const { config, features } = body;
+        const row = {
+            timestamp: body.timestamp,
+            browser: config.browser,
+            privacy_max: config.privacy_max ? 1 : 0,
+            incognito: config.incognito ? 1 : 0
+        };
+        for (const [column, name] of Object.entries(EXTENSION_COLUMNS)) {
+            row[column] = config.extensions.some(ext => ext.includes(name)) ? 1 : 0;
+        }
+        for (const [title, column] of this.features) {
+            const value = features[title];
+            row[column] = value === undefined ? null : value;
+        }
+        return row;
+    }
+
+    tls_capture(request_id) {
+        return new Promise((resolve, reject) => {
+            this.tls_statement.get([request_id], (err, row) => {
+                if (err) reject(err);
+                else resolve(row);
+            });
+        });
+    }
+
+    insert(row) {
+        return new Promise((resolve, reject) => {
+            this.insert_statement.run(this.columns.map(column => row[column]), function (err) {
+                if (err) reject(err);
+                else resolve(this.lastID);
+            });
+        });
+    }
+
+    finalize() {
+        for (const statement of [this.insert_statement, this.tls_statement]) {
+            if (statement) statement.finalize();
+        }
+    }
+}
+
+module.exports = { TestingIngest, load_validator, generate_validator, column_name, EXTENSION_COLUMNS };
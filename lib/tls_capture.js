@@ -0,0 +1,278 @@
+const crypto = require('crypto');
+const https = require('https');
+const net = require('net');
+
+// A ClientHello larger than this (or slower than the timeout) is not a browser
+const MAX_HELLO_BYTES = 64 * 1024;
+const HELLO_TIMEOUT_MS = 10000;
+
+const TLS_VERSIONS = { 0x0304: '13', 0x0303: '12', 0x0302: '11', 0x0301: '10', 0x0300: 's3' };
+
+// GREASE values (RFC 8701) are random per connection and ignored by JA3/JA4
+function is_grease(value) {
+    return (value & 0x0f0f) === 0x0a0a && (value >> 8) === (value & 0xff);
+}
+
+function read_u16_list(buf, pos, length, out) {
+    for (const end = pos + length; pos + 1 < end; pos += 2) {
+        out.push(buf.readUInt16BE(pos));
+    }
+}
+
+// Collect the handshake message from one or more TLS records.
+// Returns null while the message is incomplete.
+function read_handshake(buf) {
+    const parts = [];
+    let have = 0;
+    let needed = -1;
+    let pos = 0;
+    while (pos + 5 <= buf.length) {
+        if (buf[pos] !== 0x16) {
+            throw new TypeError('Not a TLS handshake record');
+        }
+        const length = buf.readUInt16BE(pos + 3);
+        if (pos + 5 + length > buf.length) {
+            return null;
+        }
+        parts.push(buf.subarray(pos + 5, pos + 5 + length));
+        have += length;
+        pos += 5 + length;
+        const message = parts.length === 1 ? parts[0] : Buffer.concat(parts);
+        if (needed < 0 && have >= 4) {
+            if (message[0] !== 0x01) {
+                throw new TypeError('Not a ClientHello');
+            }
+            needed = 4 + message.readUIntBE(1, 3);
+        }
+        if (needed >= 0 && have >= needed) {
+            return message.subarray(0, needed);
+        }
+    }
+    if (buf.length && buf[0] !== 0x16) {
+        throw new TypeError('Not a TLS handshake record');
+    }
+    return null;
+}
+
+function parse_body(hs) {
+    let pos = 4;
+    const version = hs.readUInt16BE(pos);
+    pos += 2 + 32; // legacy version, random
+    pos += 1 + hs[pos]; // session id
+    const cipher_length = hs.readUInt16BE(pos);
+    const ciphers = [];
+    read_u16_list(hs, pos + 2, cipher_length, ciphers);
+    pos += 2 + cipher_length;
+    pos += 1 + hs[pos]; // compression methods
+
+    const hello = {
+        version,
+        ciphers,
+        extensions: [],
+        groups: [],
+        point_formats: [],
+        signature_algorithms: [],
+        supported_versions: [],
+        alpn: [],
+        sni: ''
+    };
+    if (pos >= hs.length) {
+        return hello;
+    }
+    const ext_end = pos + 2 + hs.readUInt16BE(pos);
+    if (ext_end > hs.length) {
+        throw new RangeError('Extensions overrun the ClientHello');
+    }
+    pos += 2;
+    while (pos + 4 <= ext_end) {
+        const type = hs.readUInt16BE(pos);
+        const start = pos + 4;
+        pos = start + hs.readUInt16BE(pos + 2);
+        if (pos > ext_end) {
+            throw new RangeError('Extension overruns the ClientHello');
+        }
+        hello.extensions.push(type);
+        switch (type) {
+            case 0x0000: // server_name: list length, name type, name length, name
+                if (pos - start >= 5 && hs[start + 2] === 0) {
+                    hello.sni = hs.toString('latin1', start + 5, Math.min(pos, start + 5 + hs.readUInt16BE(start + 3)));
+                }
+                break;
+            case 0x000a: // supported_groups
+                read_u16_list(hs, start + 2, hs.readUInt16BE(start), hello.groups);
+                break;
+            case 0x000b: // ec_point_formats
+                for (let i = 0; i < hs[start] && start + 1 + i < pos; i++) {
+                    hello.point_formats.push(hs[start + 1 + i]);
+                }
+                break;
+            case 0x000d: // signature_algorithms
+                read_u16_list(hs, start + 2, hs.readUInt16BE(start), hello.signature_algorithms);
+                break;
+            case 0x0010: { // application_layer_protocol_negotiation
+                const end = Math.min(pos, start + 2 + hs.readUInt16BE(start));
+                for (let p = start + 2; p < end; p += 1 + hs[p]) {
+                    hello.alpn.push(hs.toString('latin1', p + 1, Math.min(end, p + 1 + hs[p])));
+                }
+                break;
+            }
+            case 0x002b: // supported_versions
+                read_u16_list(hs, start + 1, hs[start], hello.supported_versions);
+                break;
+        }
+    }
+    return hello;
+}
+
+// Parse the ClientHello at the start of a connection.
+// Returns null if more bytes are needed, throws TypeError if it is not one.
+function parse_client_hello(buf) {
+    const hs = read_handshake(buf);
+    if (!hs) {
+        return null;
+    }
+    try {
+        return parse_body(hs);
+    } catch (err) {
+        if (err instanceof RangeError) {
+            throw new TypeError('Malformed ClientHello');
+        }
+        throw err;
+    }
+}
+
+const no_grease = (values) => values.filter(value => !is_grease(value));
+const hex4 = (value) => value.toString(16).padStart(4, '0');
+const count2 = (values) => String(Math.min(values.length, 99)).padStart(2, '0');
+const hash = (algorithm, text) => crypto.createHash(algorithm).update(text).digest('hex');
+
+function ja3_string(hello, sort_extensions = false) {
+    const extensions = no_grease(hello.extensions);
+    if (sort_extensions) {
+        extensions.sort((a, b) => a - b);
+    }
+    return [
+        hello.version,
+        no_grease(hello.ciphers).join('-'),
+        extensions.join('-'),
+        no_grease(hello.groups).join('-'),
+        hello.point_formats.join('-')
+    ].join(',');
+}
+
+function alpn_chars(alpn) {
+    if (!alpn) {
+        return '00';
+    }
+    const first = alpn[0];
+    const last = alpn[alpn.length - 1];
+    if (/^[0-9A-Za-z]$/.test(first) && /^[0-9A-Za-z]$/.test(last)) {
+        return first + last;
+    }
+    const hex = Buffer.from(alpn, 'latin1').toString('hex');
+    return hex[0] + hex[hex.length - 1];
+}
+
+function ja4(hello) {
+    const ciphers = no_grease(hello.ciphers);
+    const extensions = no_grease(hello.extensions);
+    const versions = no_grease(hello.supported_versions);
+    const version = versions.length ? Math.max(...versions) : hello.version;
+    const prefix = 't' + (TLS_VERSIONS[version] || '00') + (hello.sni ? 'd' : 'i') +
+        count2(ciphers) + count2(extensions) + alpn_chars(hello.alpn[0]);
+    const cipher_hash = ciphers.length
+        ? hash('sha256', ciphers.map(hex4).sort().join(',')).slice(0, 12)
+        : '000000000000';
+    // SNI and ALPN are already part of the prefix
+    const ext_list = extensions.filter(e => e !== 0x0000 && e !== 0x0010).map(hex4).sort().join(',');
+    const sig_list = no_grease(hello.signature_algorithms).map(hex4).join(',');
+    const ext_hash = extensions.length
+        ? hash('sha256', sig_list ? `${ext_list}_${sig_list}` : ext_list).slice(0, 12)
+        : '000000000000';
+    return `${prefix}_${cipher_hash}_${ext_hash}`;
+}
+
+// JA3 changes with the extension order, which Chromium randomizes per
+// connection; JA3N (sorted extensions) and JA4 are stable per client
+function fingerprint(hello) {
+    const ja3 = ja3_string(hello);
+    return {
+        ja3,
+        ja3_hash: hash('md5', ja3),
+        ja3n_hash: hash('md5', ja3_string(hello, true)),
+        ja4: ja4(hello),
+        sni: hello.sni,
+        alpn: hello.alpn.join(',')
+    };
+}
+
+// Values of the "TLS / JA3" and "SNI / DNS / Cert Info" features for a capture
+function feature_values(capture) {
+    return {
+        tls_ja3: `JA4 ${capture.ja4} / JA3N ${capture.ja3n_hash}`,
+        sni_dns_cert_info: `SNI ${capture.sni || '-'} / ALPN ${capture.alpn || '-'} / ${capture.protocol} ${capture.cipher}`
+    };
+}
+
+// TLS terminating listener in front of the Express app: reads the ClientHello
+// of every connection, remembers its fingerprint, then hands the connection
+// (with the ClientHello put back) to a regular HTTPS server.
+class TlsCapture {
+    constructor(app, { key, cert }) {
+        this.connections = new Map();
+        this.https_server = https.createServer({ key, cert }, app);
+        this.server = net.createServer(socket => this.accept(socket));
+    }
+
+    listen(port, callback) {
+        this.server.listen(port, callback);
+        return this;
+    }
+
+    close(callback) {
+        this.https_server.close();
+        this.server.close(callback);
+    }
+
+    accept(socket) {
+        let buf = Buffer.alloc(0);
+        socket.on('error', () => socket.destroy());
+        socket.setTimeout(HELLO_TIMEOUT_MS, () => socket.destroy());
+        const on_data = (chunk) => {
+            buf = buf.length ? Buffer.concat([buf, chunk]) : chunk;
+            let hello;
+            try {
+                hello = parse_client_hello(buf);
+            } catch (err) {
+                return socket.destroy();
+            }
+            if (!hello) {
+                if (buf.length > MAX_HELLO_BYTES) {
+                    socket.destroy();
+                }
+                return;
+            }
+            socket.removeListener('data', on_data);
+            socket.setTimeout(0);
+            socket.pause();
+            const key = `${socket.remoteAddress}:${socket.remotePort}`;
+            this.connections.set(key, fingerprint(hello));
+            socket.once('close', () => this.connections.delete(key));
+            socket.unshift(buf);
+            this.https_server.emit('connection', socket);
+            process.nextTick(() => socket.resume());
+        };
+        socket.on('data', on_data);
+    }
+
+    // Fingerprint of the connection a request came in on, null for plain HTTP
+    lookup(req) {
+        const capture = this.connections.get(`${req.socket.remoteAddress}:${req.socket.remotePort}`);
+        if (!capture || !req.socket.encrypted) {
+            return null;
+        }
+        return { ...capture, protocol: req.socket.getProtocol(), cipher: req.socket.getCipher().name };
+    }
+}
+
+module.exports = { TlsCapture, parse_client_hello, fingerprint, feature_values, ja4 };
@@ -193,6 +193,87 @@ async function create_fingerprint() {
     window.addEventListener("touchend", e => touches.push("end"));
     setTimeout(() => addFeature("Touch Gestures Sample", touches), 5000);
 
+    // Full-resolution behavioral traces (only with ?traces=1)
+    // Every event is stored with a timestamp, the streams are packed column-wise as
+    // delta + zigzag varints and uploaded as one binary blob to /api/traces/<id>.
+    // Keys are stored as per-session ids in order of first use, never the key itself.
+    (function behaviorTraces() {
+        if (new URLSearchParams(window.location.search).get("traces") !== "1") return;
+
+        const MAX_EVENTS = 10000;
+        const TIME_UNIT_US = 100; // timestamps in units of 0.1 ms
+        // kind id -> field names, the first field is always the timestamp
+        const streams = {
+            mouse: { kind: 1, fields: ["t", "x", "y"], rows: [] },
+            key: { kind: 2, fields: ["t", "key_id", "down"], rows: [] },
+            scroll: { kind: 3, fields: ["t", "x", "y"], rows: [] },
+            touch: { kind: 4, fields: ["t", "x", "y", "phase"], rows: [] }
+        };
+        const keyIds = new Map();
+        const now = () => Math.round(performance.now() * 1000 / TIME_UNIT_US);
+        const push = (stream, row) => { if (stream.rows.length < MAX_EVENTS) stream.rows.push(row); };
+
+        window.addEventListener("mousemove", e => push(streams.mouse, [now(), e.clientX, e.clientY]));
+        window.addEventListener("scroll", () => push(streams.scroll, [now(), Math.round(scrollX), Math.round(scrollY)]));
+        const onKey = (e, down) => {
+            if (!keyIds.has(e.code)) keyIds.set(e.code, keyIds.size);
+            push(streams.key, [now(), keyIds.get(e.code), down]);
+        };
+        window.addEventListener("keydown", e => { if (!e.repeat) onKey(e, 1); });
+        window.addEventListener("keyup", e => onKey(e, 0));
+        const onTouch = (e, phase) => {
+            const t = e.changedTouches[0];
+            if (t) push(streams.touch, [now(), Math.round(t.clientX), Math.round(t.clientY), phase]);
+        };
+        window.addEventListener("touchstart", e => onTouch(e, 0));
+        window.addEventListener("touchmove", e => onTouch(e, 1));
+        window.addEventListener("touchend", e => onTouch(e, 2));
+
+        function encode() {
+            const out = [];
+            const varint = (v) => {
+                while (v >= 0x80) { out.push((v % 0x80) | 0x80); v = Math.floor(v / 0x80); }
+                out.push(v);
+            };
+            const zigzag = (v) => v >= 0 ? v * 2 : -v * 2 - 1;
+            out.push(0x42, 0x54, 1); // "BT", format version 1
+            varint(TIME_UNIT_US);
+            const used = Object.values(streams).filter(s => s.rows.length);
+            varint(used.length);
+            for (const s of used) {
+                out.push(s.kind, s.fields.length);
+                varint(s.rows.length);
+                s.fields.forEach((field, col) => {
+                    // Timestamps and coordinates are delta coded, ids and flags are not
+                    const delta = field === "t" || field === "x" || field === "y";
+                    out.push(delta ? 1 : 0);
+                    let prev = 0;
+                    for (const row of s.rows) {
+                        varint(zigzag(delta ? row[col] - prev : row[col]));
+                        prev = row[col];
+                    }
+                });
+            }
+            return new Uint8Array(out);
+        }
+
+        const traceId = crypto.randomUUID ? crypto.randomUUID()
+            : Array.from(crypto.getRandomValues(new Uint8Array(16)), b => b.toString(16).padStart(2, "0")).join("");
+        setTimeout(async () => {
+            try {
+                const response = await fetch('/api/traces/' + traceId, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/octet-stream' },
+                    body: encode()
+                });
+                if (!response.ok) throw new Error(`Response status: ${response.status}`);
+                addFeature("Behavior Trace ID", traceId);
+            } catch (error) {
+                addFeature("Behavior Trace ID", "Upload failed");
+            }
+        }, 4000);
+    })();
+
     // WASM performance micro-benchmark
     (async function wasmPerf() {
         try {
@@ -205,9 +286,27 @@ async function create_fingerprint() {
         }
     })();
 
-    // TLS / DNS / Cert info – only available to network observers
-    addFeature("TLS / JA3", "Unavailable in browser JS");
-    addFeature("SNI / DNS / Cert Info", "Unavailable in browser JS");
+    // TLS / DNS / Cert info – only available to network observers.
+    // Served from the TLS capture port, the server reports the ClientHello it saw.
+    (async function tlsCapture() {
+        if (window.location.protocol !== "https:") {
+            addFeature("TLS / JA3", "Unavailable in browser JS");
+            addFeature("SNI / DNS / Cert Info", "Unavailable in browser JS");
+            return;
+        }
+        const requestId = crypto.randomUUID();
+        try {
+            const response = await fetch(`/api/tls/${requestId}`);
+            if (!response.ok) throw new Error(`Response status: ${response.status}`);
+            const capture = await response.json();
+            addFeature("TLS / JA3", capture.features.tls_ja3);
+            addFeature("SNI / DNS / Cert Info", capture.features.sni_dns_cert_info);
+            addFeature("TLS Request ID", requestId);
+        } catch (error) {
+            addFeature("TLS / JA3", "Capture failed");
+            addFeature("SNI / DNS / Cert Info", "Capture failed");
+        }
+    })();
 
     // ========= COMPREHENSIVE FINGERPRINT HASH =========
     // Create a single hash from all collected fingerprint data (excluding certain parameters)
@@ -222,7 +321,9 @@ async function create_fingerprint() {
                 'WebRTC Candidate',
                 'WASM Compile Time (ms)',
                 'Mouse Sample',
-                'Scroll Sample'
+                'Scroll Sample',
+                'Behavior Trace ID',
+                'TLS Request ID'
             ];
             
             features.forEach(li => {
@@ -0,0 +1,141 @@
+"""
+Adaptive repetition of configurations, for orchestrator.py --adaptive.
+
+Instead of a fixed number of runs per configuration, a configuration is run
+again only while its fingerprint is not settled. After every run we ask
+whether it produced a Comprehensive Fingerprint Hash (CFH) not seen in the
+earlier runs of the same configuration; the rate of such new CFHs is what
+decides whether more runs can still change the picture. A configuration is
+settled once the upper confidence bound on that rate drops below --epsilon.
+
+The bound comes from a beta-binomial mixture confidence sequence (Robbins):
+a rate p is rejected once B(k+1, m-k+1) / (p^k (1-p)^(m-k)) >= 1/delta,
+for k new CFHs in m repeat runs. By Ville's inequality it holds for every m
+at once, so checking it after every run, and stopping on it, keeps the
+confidence level. The rate is averaged over all runs so far; a configuration
+that only varied early is judged conservatively.
+
+Runs until a configuration settles (k = 0 gives a bound of
+1 - (delta / (m + 1)) ** (1 / m) after m repeat runs):
+
+        epsilon  confidence  stable CFH  one new CFH
+        0.3      0.9         16          23
+        0.3      0.95        18          25
+        0.5      0.9          8          12
+
+The defaults (0.3 at 0.9) are what "settled" is meant to say: with 90%
+confidence fewer than 3 in 10 further runs would show a new CFH. That
+costs 16 runs for a stable configuration; to spend fewer browser runs,
+lower --runs (the cap per configuration) rather than the confidence.
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import math
+from typing import Dict, List, Optional
+
+from fp_common import EXCLUDED_FIELDS
+
+# Fields that don't describe the configuration: the per-run ones and the CFH itself
+UNHASHED_FIELDS = EXCLUDED_FIELDS | {"Comprehensive Fingerprint Hash"}
+
+def log_beta(a: float, b: float) -> float:
+    return math.lgamma(a) + math.lgamma(b) - math.lgamma(a + b)
+
+def rate_upper_bound(k: int, m: int, delta: float) -> float:
+    """Upper end of the (1 - delta) confidence sequence for a rate with k hits in m trials."""
+    if m == 0:
+        return 1.0
+    log_mixture = log_beta(k + 1, m - k + 1)
+    threshold = math.log(1 / delta)
+
+    def rejected(p: float) -> bool:
+        return log_mixture - k * math.log(p) - (m - k) * math.log1p(-p) >= threshold
+
+    low, high = k / m, 1.0
+    if k == m or not rejected(1 - 1e-12):
+        return 1.0
+    for _ in range(50):
+        mid = (low + high) / 2
+        if rejected(mid):
+            high = mid
+        else:
+            low = mid
+    return high
+
+def sample_hash(features: dict) -> str:
+    """The CFH of a run, or a hash of its hashed features when the page could not compute one."""
+    cfh = features.get("Comprehensive Fingerprint Hash", "")
+    if cfh and not cfh.startswith("Error"):
+        return cfh
+    hashed = {k: v for k, v in features.items() if k not in UNHASHED_FIELDS}
+    return "local:" + hashlib.sha256(json.dumps(hashed, sort_keys=True).encode()).hexdigest()
+
+class ConfigStats:
+    """Runs of one configuration: the CFH of every run and the values seen per feature."""
+
+    def __init__(self):
+        self.hashes: List[str] = []
+        self.new_hashes = 0
+        self.values: Dict[str, set] = {}
+
+    def observe(self, features: dict) -> None:
+        cfh = sample_hash(features)
+        # The first run has nothing to be new against
+        if self.hashes and cfh not in self.hashes:
+            self.new_hashes += 1
+        self.hashes.append(cfh)
+        for name, value in features.items():
+            if name not in UNHASHED_FIELDS:
+                self.values.setdefault(name, set()).add(value)
+
+    @property
+    def varying(self) -> List[str]:
+        """Features that took more than one value, most values first."""
+        return sorted((n for n, v in self.values.items() if len(v) > 1), key=lambda n: -len(self.values[n]))
+
+class AdaptiveScheduler:
+    """Decides per configuration whether another run is needed."""
+
+    def __init__(self, min_runs: int = 3, max_runs: int = 20, epsilon: float = 0.3, confidence: float = 0.9):
+        self.min_runs = min_runs
+        self.max_runs = max_runs
+        self.epsilon = epsilon
+        self.delta = 1 - confidence
+        self.stats: Dict[str, ConfigStats] = {}
+        self.scheduled: Dict[str, int] = {}
+
+    def observe(self, config: str, features: dict) -> None:
+        self.stats.setdefault(config, ConfigStats()).observe(features)
+
+    def bound(self, config: str) -> float:
+        stats = self.stats.get(config)
+        if stats is None:
+            return 1.0
+        return rate_upper_bound(stats.new_hashes, len(stats.hashes) - 1, self.delta)
+
+    def settled(self, config: str) -> bool:
+        stats = self.stats.get(config)
+        return stats is not None and len(stats.hashes) >= self.min_runs and self.bound(config) <= self.epsilon
+
+    def next_run(self, config: str) -> Optional[int]:
+        """Number of the next run of a configuration, None once it is settled or out of runs."""
+        scheduled = self.scheduled.get(config, 0)
+        if scheduled >= self.max_runs or self.settled(config):
+            return None
+        self.scheduled[config] = scheduled + 1
+        return scheduled + 1
+
+    def summary(self) -> List[str]:
+        lines = []
+        for config, runs in self.scheduled.items():
+            stats = self.stats.get(config) or ConfigStats()
+            distinct = len(set(stats.hashes))
+            state = "settled" if self.settled(config) else "still varying"
+            line = (f"{config}: {state} after {runs} runs ({len(stats.hashes)} measured), {distinct} CFH, "
+                    f"new-CFH rate <= {self.bound(config):.2f}")
+            if stats.varying:
+                line += f", varying: {', '.join(stats.varying[:5])}"
+            lines.append(line)
+        return lines
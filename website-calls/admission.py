@@ -0,0 +1,207 @@
+"""
+Admission control of browser launches from the free memory and CPU of the host.
+
+The orchestrator asks for a slot before every session. A slot is granted when
+the available memory, minus what the running browsers are still expected to
+grow into, leaves room for the new browser's cost and the CPU is not
+saturated. The cost of a configuration starts at a per-browser weight (Tor and
+extensions cost more) and is replaced by the peak RSS of its process tree once
+such a session was observed. Everything is read from /proc (Linux only); on
+other systems every launch is admitted and only --concurrency applies.
+"""
+
+from __future__ import annotations
+import asyncio
+import contextlib
+import os
+import time
+from typing import Dict, List, Optional
+
+MIB = 1048576
+
+# Starting cost of a session in MiB, until one of its kind was observed
+DEFAULT_COST_MIB = {"chrome": 500, "brave": 550, "firefox": 600, "tor": 800}
+EXTENSION_COST_MIB = 60
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def proc_available() -> bool:
+    return os.path.exists("/proc/meminfo") and os.path.exists("/proc/stat")
+
+def mem_available() -> int:
+    """MemAvailable of /proc/meminfo in bytes."""
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError("MemAvailable missing from /proc/meminfo")
+
+def cpu_times() -> tuple:
+    """(busy, total) jiffies of all CPUs since boot."""
+    with open("/proc/stat") as f:
+        fields = [int(v) for v in f.readline().split()[1:]]
+    # idle and iowait
+    idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+    total = sum(fields[:8])
+    return total - idle, total
+
+def process_table() -> tuple:
+    """Children and RSS (bytes) of every process, keyed by PID."""
+    children: Dict[int, List[int]] = {}
+    rss: Dict[int, int] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        pid = int(entry)
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                stat = f.read()
+            with open(f"/proc/{pid}/statm") as f:
+                rss[pid] = int(f.read().split()[1]) * PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            # Exited while listing
+            continue
+        # The command name may contain spaces and parentheses, ppid follows the last ")"
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(ppid, []).append(pid)
+    return children, rss
+
+def tree_rss(pid: int, children: Dict[int, List[int]], rss: Dict[int, int]) -> int:
+    """RSS of a process and all its descendants.
+
+    Summed per process, so pages shared between e.g. Chromium's renderers are
+    counted more than once: an overestimate, which is the safe side here.
+    """
+    total, stack = 0, [pid]
+    while stack:
+        p = stack.pop()
+        total += rss.get(p, 0)
+        stack.extend(children.get(p, ()))
+    return total
+
+class Lease:
+    """An admitted session. The session attaches the PID of its browser (or driver) process."""
+
+    def __init__(self, kind: tuple, cost: int):
+        self.kind = kind
+        self.cost = cost
+        self.pid: Optional[int] = None
+        self.rss = 0
+        self.peak = 0
+
+    def attach(self, pid: Optional[int]) -> None:
+        # Called from the Selenium worker threads too, a plain assignment is enough
+        self.pid = pid
+
+    @property
+    def growth(self) -> int:
+        """Memory the session is still expected to take, not yet visible in MemAvailable."""
+        return max(0, self.cost - self.rss)
+
+class Admission:
+    """Grant browser launches while memory and CPU headroom exist."""
+
+    def __init__(self, min_free_mib: float = 1024, max_cpu: float = 0.9, costs: Optional[dict] = None,
+                 interval: float = 1.0, enabled: bool = True):
+        self.enabled = enabled and proc_available()
+        self.min_free = int(min_free_mib * MIB)
+        self.max_cpu = max_cpu
+        self.costs = {**DEFAULT_COST_MIB, **(costs or {})}
+        self.interval = interval
+        self.leases: List[Lease] = []
+        self.observed: Dict[tuple, int] = {}
+        self.available = 0
+        self.cpu = 0.0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.changed = asyncio.Condition()
+        self.monitor: Optional[asyncio.Task] = None
+        self._cpu_times = None
+
+    async def __aenter__(self):
+        if self.enabled:
+            self.sample()
+            self.monitor = asyncio.create_task(self._monitor())
+        return self
+
+    async def __aexit__(self, *exc):
+        if self.monitor:
+            self.monitor.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.monitor
+
+    @staticmethod
+    def kind(job) -> tuple:
+        return job.browser, len(job.extensions)
+
+    def cost(self, kind: tuple) -> int:
+        if kind in self.observed:
+            return self.observed[kind]
+        browser, extensions = kind
+        return int((self.costs.get(browser, max(self.costs.values())) + extensions * EXTENSION_COST_MIB) * MIB)
+
+    def sample(self) -> None:
+        """Read free memory, CPU load and the process tree RSS of every running session."""
+        self.available = mem_available()
+        busy, total = cpu_times()
+        if self._cpu_times and total > self._cpu_times[1]:
+            self.cpu = (busy - self._cpu_times[0]) / (total - self._cpu_times[1])
+        self._cpu_times = (busy, total)
+        if any(lease.pid for lease in self.leases):
+            children, rss = process_table()
+            for lease in self.leases:
+                if lease.pid:
+                    lease.rss = tree_rss(lease.pid, children, rss)
+                    lease.peak = max(lease.peak, lease.rss)
+
+    def headroom(self) -> int:
+        return self.available - sum(lease.growth for lease in self.leases) - self.min_free
+
+    def admissible(self, cost: int) -> bool:
+        # Never block the first session, the campaign would stall
+        if not self.leases:
+            return True
+        return self.headroom() >= cost and self.cpu <= self.max_cpu
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.sample)
+            except (OSError, RuntimeError) as e:
+                print(f"[warn] Admission control disabled, /proc not readable: {e}")
+                self.enabled = False
+            async with self.changed:
+                self.changed.notify_all()
+            if not self.enabled:
+                return
+
+    @contextlib.asynccontextmanager
+    async def slot(self, job):
+        """Wait until the job's browser can be launched, and hold its cost while it runs."""
+        kind = self.kind(job)
+        lease = Lease(kind, self.cost(kind))
+        started = time.monotonic()
+        async with self.changed:
+            if self.enabled and not self.admissible(lease.cost):
+                self.waits += 1
+                await self.changed.wait_for(lambda: not self.enabled or self.admissible(lease.cost))
+            # Still under the lock, so the next waiter already counts this session
+            self.leases.append(lease)
+        self.wait_seconds += time.monotonic() - started
+        try:
+            yield lease
+        finally:
+            self.leases.remove(lease)
+            if lease.peak:
+                self.observed[kind] = max(self.observed.get(kind, 0), lease.peak)
+            async with self.changed:
+                self.changed.notify_all()
+
+    def summary(self) -> str:
+        if not self.enabled:
+            return "admission control off"
+        peaks = ", ".join(f"{browser}{f'+{ext} ext' if ext else ''} {peak / MIB:.0f} MiB"
+                          for (browser, ext), peak in sorted(self.observed.items()))
+        return (f"{self.waits} launches delayed for {self.wait_seconds:.1f}s in total"
+                f"{', peak RSS ' + peaks if peaks else ''}")
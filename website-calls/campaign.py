@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Campaign plans and their progress journal, for orchestrator.py --plan.
+
+A plan file (JSON) fixes everything that decides what a campaign measures:
+the target server, the browser / privacy / extension / incognito matrix, the
+number of repeats, the seed of the execution order and the session settings.
+Every cell of the matrix (one combination and repeat) has a stable key such
+as "firefox/privacy-max/extensions/run2" and an index in plan order.
+
+Finished cells are appended to a journal (JSON lines, flushed and synced per
+cell) next to the plan. A campaign started again with the same plan skips
+every cell some journal of the plan records as done, so an interrupted
+campaign resumes where it stopped and only failed or unfinished cells are run
+again. A shard (--shard 2/3 or --shard 40-79) runs a contiguous range of cell
+indexes and writes its own journal; copied into one directory, the journals
+of all shards give the progress of the whole campaign.
+
+Example plan:
+        {"url": "http://localhost:80", "browsers": ["chrome", "brave", "firefox"],
+         "privacy_max": "both", "extensions": "both", "incognito": "both",
+         "repeats": 2, "seed": 1, "settings": {"wait": 12}}
+
+Example usage:
+        python3 orchestrator.py --plan baseline.json --concurrency 4
+        python3 orchestrator.py --plan baseline.json --shard 1/3
+        python3 campaign.py baseline.json
+"""
+
+from __future__ import annotations
+import argparse
+import glob
+import hashlib
+import json
+import os
+import random
+import re
+import socket
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+BROWSERS = ["chrome", "brave", "firefox", "tor"]
+CHOICES = ["no", "yes", "both"]
+
+# Session settings a plan may fix, with their orchestrator defaults
+SETTINGS = {"wait": 12.0, "headless": False, "behavior_traces": False}
+# Name of a shard journal after the plan's stem, see journal_path()
+SHARD_SUFFIX = re.compile(r"\.(\d+of\d+|\d+-\d+)\.journal\.jsonl")
+
+class PlanError(ValueError):
+    pass
+
+def load_plan(path: Path) -> dict:
+    """Read and validate a plan file, with defaults filled in."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            plan = json.load(f)
+    except (OSError, ValueError) as e:
+        raise PlanError(f"cannot read plan {path}: {e}")
+    if not isinstance(plan, dict):
+        raise PlanError(f"plan {path} is not a JSON object")
+    unknown = set(plan) - {"name", "url", "browsers", "privacy_max", "extensions", "incognito",
+                           "repeats", "seed", "settings"}
+    if unknown:
+        raise PlanError(f"unknown keys in plan: {', '.join(sorted(unknown))}")
+    plan = dict({"name": Path(path).stem, "browsers": ["chrome", "brave", "firefox"], "privacy_max": "both",
+                 "extensions": "both", "incognito": "both", "repeats": 1, "seed": None}, **plan)
+    if not plan.get("url"):
+        raise PlanError("plan has no url")
+    if not plan["browsers"] or set(plan["browsers"]) - set(BROWSERS):
+        raise PlanError(f"browsers must be a non-empty list of {', '.join(BROWSERS)}")
+    for dimension in ("privacy_max", "extensions", "incognito"):
+        if plan[dimension] not in CHOICES:
+            raise PlanError(f"{dimension} must be one of {', '.join(CHOICES)}")
+    if not isinstance(plan["repeats"], int) or plan["repeats"] < 1:
+        raise PlanError("repeats must be a positive integer")
+    if plan["seed"] is not None and not isinstance(plan["seed"], int):
+        raise PlanError("seed must be an integer or null")
+    settings = plan.get("settings") or {}
+    unknown = set(settings) - set(SETTINGS)
+    if unknown:
+        raise PlanError(f"unknown settings in plan: {', '.join(sorted(unknown))}")
+    plan["settings"] = dict(SETTINGS, **settings)
+    return plan
+
+def plan_digest(plan: dict) -> str:
+    """Short hash of what a plan measures; the target URL may differ between machines."""
+    measured = {k: v for k, v in plan.items() if k not in ("name", "url")}
+    return hashlib.sha256(json.dumps(measured, sort_keys=True).encode()).hexdigest()[:12]
+
+def parse_cells(spec: str, total: int) -> range:
+    """Cell indexes of a shard: "K/N" (the K-th of N equal ranges, from 1) or "START-END" (inclusive)."""
+    try:
+        if "/" in spec:
+            k, n = (int(v) for v in spec.split("/", 1))
+            if not 1 <= k <= n:
+                raise ValueError
+            return range((k - 1) * total // n, k * total // n)
+        start, end = (int(v) for v in spec.split("-", 1))
+    except ValueError:
+        raise PlanError(f"invalid cell range {spec!r}, expected K/N or START-END")
+    if not 0 <= start <= end:
+        raise PlanError(f"invalid cell range {spec!r}")
+    return range(start, min(end + 1, total))
+
+def execution_order(cells: list, seed: Optional[int]) -> list:
+    """Cells in the order to run them: shuffled by the plan's seed, so a
+    drifting server or network doesn't line up with one browser."""
+    cells = list(cells)
+    if seed is not None:
+        random.Random(seed).shuffle(cells)
+    return cells
+
+def journal_path(plan_path: Path, cells: Optional[str] = None) -> Path:
+    """Default journal of a plan, one per shard."""
+    plan_path = Path(plan_path)
+    shard = "." + cells.replace("/", "of") if cells else ""
+    return plan_path.with_name(f"{plan_path.stem}{shard}.journal.jsonl")
+
+def read_journals(plan_path: Path, digest: str) -> Dict[str, dict]:
+    """Latest record of every cell in all journals of the plan.
+
+    Only records that follow a header of this version of the plan count; the
+    records of a journal written for another version, or without a header,
+    are ignored, so their cells are run again.
+    """
+    plan_path = Path(plan_path)
+    records: Dict[str, dict] = {}
+    # The plan's own journal and those of its shards (journal_path), not those of "<stem>-v2.json" etc.
+    paths = [plan_path.with_name(f"{plan_path.stem}.journal.jsonl")]
+    paths += [p for p in plan_path.parent.glob(f"{glob.escape(plan_path.stem)}.*.journal.jsonl")
+              if SHARD_SUFFIX.fullmatch(p.name[len(plan_path.stem):])]
+    for path in sorted(p for p in paths if p.is_file()):
+        current = False
+        with open(path, encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Last line of a journal cut off by a crash
+                    print(f"[warn] {path.name}:{number}: unreadable journal line skipped")
+                    continue
+                if "plan" in record:
+                    current = record["plan"] == digest
+                    if not current:
+                        print(f"[warn] {path.name} was written for another version of the plan, "
+                              f"its records are ignored")
+                    continue
+                if not current:
+                    continue
+                previous = records.get(record["cell"])
+                # A success is never undone by a later failure of another shard
+                if previous is None or not previous["ok"]:
+                    records[record["cell"]] = record
+    return records
+
+class Journal:
+    """Append-only progress journal of one campaign shard."""
+
+    def __init__(self, path: Path, digest: str, cells: str = ""):
+        self.path = Path(path)
+        self.digest = digest
+        self.cells = cells
+
+    def open(self) -> None:
+        self._write({"plan": self.digest, "cells": self.cells, "host": socket.gethostname(),
+                     "started": time.strftime("%Y-%m-%dT%H:%M:%S")})
+
+    def record(self, cell: str, outcome: dict) -> None:
+        self._write(dict(outcome, cell=cell, host=socket.gethostname(),
+                         finished=time.strftime("%Y-%m-%dT%H:%M:%S")))
+
+    def _write(self, record: dict) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            # A cell counts as done only once it is on disk
+            os.fsync(f.fileno())
+
+def progress(keys: List[str], records: Dict[str, dict]) -> dict:
+    done = sum(1 for key in keys if records.get(key, {}).get("ok"))
+    failed = sum(1 for key in keys if key in records and not records[key]["ok"])
+    return {"cells": len(keys), "done": done, "failed": failed, "pending": len(keys) - done - failed}
+
+def parse_args(argv=None):
+    """Parse command-line arguments."""
+    p = argparse.ArgumentParser(description="Show the progress of a campaign plan")
+    p.add_argument("plan", type=Path, help="Plan file (JSON)")
+    p.add_argument("--shard", help="Only count the cells of a shard, K/N or START-END")
+    p.add_argument("--failed", action="store_true", help="List the failed cells with their last reason")
+    return p.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    # The cell keys come from the orchestrator's job list
+    from orchestrator import plan_jobs
+    try:
+        plan = load_plan(args.plan)
+        jobs = plan_jobs(plan)
+        if args.shard:
+            jobs = [jobs[i] for i in parse_cells(args.shard, len(jobs))]
+    except PlanError as e:
+        print(f"[error] {e}")
+        sys.exit(2)
+    records = read_journals(args.plan, plan_digest(plan))
+    counts = progress([job.key for job in jobs], records)
+    print(f"[info] {plan['name']}: {counts['done']}/{counts['cells']} cells done, "
+          f"{counts['failed']} failed, {counts['pending']} pending")
+    if args.failed:
+        for job in jobs:
+            record = records.get(job.key)
+            if record and not record["ok"]:
+                reason = record["failures"][-1]["reason"] if record.get("failures") else "unknown"
+                print(f"[info]   {job.key} ({record.get('host', '?')}): {reason}")
+    sys.exit(0 if counts["done"] == counts["cells"] else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Fake WebDriver backend, for testing and benchmarking the collectors without browsers.
+
+FakeDriver implements the part of the Selenium WebDriver API the collectors
+use (get, find_elements, execute_script, install_addon, quit, title) and
+serves a rendered feature list instead of a real page. The features are
+synthetic (stable per browser / privacy / incognito / extension combination,
+with an optional per-run variation of the canvas and audio fingerprints) or
+canned from a saved output.json. Launch, load and render latencies, launch
+and load failures and hanging loads are drawn at random from a FakeConfig,
+so the scheduler, watchdog, upload and extraction code can be driven at
+thousands of runs per minute.
+
+Example usage:
+        python3 orchestrator.py --url http://localhost:80 --fake --wait 0 --runs 50 --concurrency 32
+        python3 orchestrator.py --url http://localhost:80 --fake --fake-option load_failures=0.05 --fake-option hangs=0.01
+        python3 show_fp_MacOS.py --browser firefox --url http://localhost:80 --fake
+"""
+
+from __future__ import annotations
+import dataclasses
+import hashlib
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from selenium.common.exceptions import (NoSuchElementException, SessionNotCreatedException, TimeoutException,
+                                        WebDriverException)
+from selenium.webdriver.common.by import By
+
+from fp_common import EXCLUDED_FIELDS, EXPECTED_FIELDS, FEATURES_EXPRESSION
+
+# Features that change between runs of one configuration with FakeConfig.variability
+NOISY_FIELDS = ["Canvas Fingerprint", "Audio Fingerprint"]
+
+USER_AGENTS = {
+    "chrome": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36",
+    "brave": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36",
+    "firefox": "Mozilla/5.0 (X11; Linux x86_64; rv:131.0) Gecko/20100101 Firefox/131.0",
+    "tor": "Mozilla/5.0 (Windows NT 10.0; rv:128.0) Gecko/20100101 Firefox/128.0",
+}
+
+@dataclass
+class FakeConfig:
+    """Latencies (seconds, +-50% jitter), failure rates and page of the fake browsers."""
+    launch: float = 0.05
+    load: float = 0.05
+    render: float = 0.02
+    addon: float = 0.01
+    launch_failures: float = 0.0
+    load_failures: float = 0.0
+    hangs: float = 0.0
+    hang: float = 300.0
+    variability: float = 0.0
+    page: str = ""
+    seed: Optional[int] = None
+
+    def __post_init__(self):
+        self._rng = random.Random(self.seed)
+        self._lock = threading.Lock()
+
+    def driver_rng(self) -> random.Random:
+        """Random source of one fake browser; reproducible for a seed and one driver at a time."""
+        with self._lock:
+            return random.Random(self._rng.getrandbits(64))
+
+    @classmethod
+    def from_options(cls, options: List[str]) -> "FakeConfig":
+        """Build from KEY=VALUE strings, e.g. ["load=0.2", "hangs=0.01"]."""
+        fields = {f.name for f in dataclasses.fields(cls)}
+        values = {}
+        for option in options:
+            name, sep, value = option.partition("=")
+            if not sep or name not in fields:
+                raise ValueError(f"unknown fake option {option!r}, expected one of {', '.join(fields)}")
+            values[name] = value if name == "page" else int(value) if name == "seed" else float(value)
+        return cls(**values)
+
+class FakeElement:
+    def __init__(self, tag: str, text: str = "", children: Optional[list] = None):
+        self.tag_name = tag
+        self.text = text
+        self.children = children or []
+
+    def find_elements(self, by: str = By.TAG_NAME, value: Optional[str] = None) -> list:
+        if by != By.TAG_NAME:
+            raise WebDriverException(f"FakeElement only supports lookups by tag name, not {by}")
+        return [child for child in self.children if child.tag_name == value]
+
+    def find_element(self, by: str = By.TAG_NAME, value: Optional[str] = None) -> "FakeElement":
+        found = self.find_elements(by, value)
+        if not found:
+            raise NoSuchElementException(f"No <{value}> in <{self.tag_name}>")
+        return found[0]
+
+class FakeService:
+    """Stands in for the driver service; there is no process to watch."""
+    process = None
+
+def feature_hash(features: Dict[str, str]) -> str:
+    """The Comprehensive Fingerprint Hash the page computes for string features.
+
+    Like JSON.stringify(obj, Object.keys(obj).sort()): keys in UTF-16 code unit
+    order, no ASCII escaping (the encoding of analysis/rehash.py).
+    """
+    titles = sorted((k for k in features if k not in EXCLUDED_FIELDS), key=lambda k: k.encode("utf-16-be"))
+    body = json.dumps({k: features[k] for k in titles}, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+def synthetic_features(browser: str, privacy_max: bool, incognito: bool, extensions: list,
+                       rng: random.Random, variability: float = 0.0) -> Dict[str, str]:
+    """Feature values of one run: fixed per configuration, except the per-run fields and the noise."""
+    config = f"{browser}|{privacy_max}|{incognito}|{'|'.join(sorted(extensions))}"
+
+    def value(name: str, salt: str = "") -> str:
+        return hashlib.sha256(f"{config}|{name}|{salt}".encode()).hexdigest()[:32]
+
+    features = {name: value(name) for name in EXPECTED_FIELDS}
+    features.update({
+        "User-Agent": USER_AGENTS.get(browser, USER_AGENTS["chrome"]),
+        "Screen Resolution": "1920x1080",
+        "Device Pixel Ratio": "1",
+        "Color Depth": "24",
+        "CPU Cores": "2" if privacy_max else "8",
+        "Cookies Enabled": "true",
+        "Do Not Track": "1" if privacy_max else "unspecified",
+        "WASM Compile Time (ms)": f"{rng.uniform(0.5, 5):.2f}",
+        "Behavior Trace ID": f"{rng.getrandbits(64):016x}",
+        "TLS Request ID": f"{rng.getrandbits(64):016x}",
+    })
+    for name in NOISY_FIELDS:
+        if rng.random() < variability:
+            features[name] = value(name, str(rng.getrandbits(32)))
+    del features["Comprehensive Fingerprint Hash"]
+    features["Comprehensive Fingerprint Hash"] = feature_hash(features)
+    return features
+
+def canned_features(path: str) -> Dict[str, str]:
+    """Features of a saved page: an output.json of a collector or a plain {title: value} object."""
+    with open(path, encoding="utf-8") as f:
+        page = json.load(f)
+    return {str(k): str(v) for k, v in page.get("features", page).items()}
+
+class FakeDriver:
+    """A browser that renders the feature list without running one."""
+
+    def __init__(self, browser: str, privacy_max: bool = False, incognito: bool = False,
+                 extensions: Optional[list] = None, config: Optional[FakeConfig] = None):
+        self.config = config or FakeConfig()
+        self.browser = browser
+        self.privacy_max = privacy_max
+        self.incognito = incognito
+        self.extensions: List[str] = []
+        self.service = FakeService()
+        self.rng = self.config.driver_rng()
+        self.current_url = "about:blank"
+        self.title = ""
+        self._features: Dict[str, str] = {}
+        self._rendered_at = float("inf")
+        self._quit = threading.Event()
+        self._sleep(self.config.launch)
+        if self.rng.random() < self.config.launch_failures:
+            raise SessionNotCreatedException(f"fake {browser} failed to start")
+        for ext in extensions or []:
+            self.install_addon(ext)
+
+    def _sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            time.sleep(seconds * self.rng.uniform(0.5, 1.5))
+
+    def _check(self) -> None:
+        if self._quit.is_set():
+            raise WebDriverException("fake browser has quit")
+
+    def install_addon(self, path: str, temporary: bool = False) -> str:
+        self._check()
+        self._sleep(self.config.addon)
+        self.extensions.append(path)
+        return hashlib.sha1(path.encode()).hexdigest()[:16] + "@fake"
+
+    def get(self, url: str) -> None:
+        self._check()
+        if self.rng.random() < self.config.hangs:
+            # Released by quit(), like a browser killed mid-load
+            self._quit.wait(self.config.hang)
+            raise TimeoutException(f"fake {self.browser} hung loading {url}")
+        self._sleep(self.config.load)
+        if self.rng.random() < self.config.load_failures:
+            raise WebDriverException(f"unknown error: net::ERR_CONNECTION_RESET ({url})")
+        self.current_url = url
+        self.title = "Fingerprint Features"
+        if self.config.page:
+            self._features = canned_features(self.config.page)
+        else:
+            self._features = synthetic_features(self.browser, self.privacy_max, self.incognito, self.extensions,
+                                                self.rng, self.config.variability)
+        # The feature list fills in after the load, like the page's async probes
+        self._rendered_at = time.monotonic() + self.config.render * self.rng.uniform(0.5, 1.5)
+
+    def _feature_items(self) -> List[FakeElement]:
+        if time.monotonic() < self._rendered_at:
+            return []
+        return [FakeElement("li", children=[FakeElement("h3", name), FakeElement("pre", value)])
+                for name, value in self._features.items()]
+
+    def find_elements(self, by: str = By.ID, value: Optional[str] = None) -> list:
+        self._check()
+        if by == By.CSS_SELECTOR and value == "#featureList li":
+            return self._feature_items()
+        if by == By.TAG_NAME and value == "li":
+            return self._feature_items()
+        raise WebDriverException(f"FakeDriver does not support the lookup {by}={value!r}")
+
+    def find_element(self, by: str = By.ID, value: Optional[str] = None) -> FakeElement:
+        found = self.find_elements(by, value)
+        if not found:
+            raise NoSuchElementException(f"No element for {by}={value!r}")
+        return found[0]
+
+    def execute_script(self, script: str, *args):
+        self._check()
+        items = self._feature_items()
+        if script.strip() == FEATURES_EXPRESSION.strip():
+            return json.dumps([[li.children[0].text, li.children[1].text] for li in items])
+        if "document.body" in script:
+            return "\n".join(f"{li.children[0].text}\n{li.children[1].text}" for li in items)
+        if "document.title" in script:
+            return self.title
+        return None
+
+    def quit(self) -> None:
+        self._quit.set()
+
+def build_driver(browser: str, headless: bool = False, privacy_max: bool = False, incognito: bool = False,
+                 extensions: list = None, config: Optional[FakeConfig] = None, **kwargs) -> FakeDriver:
+    """Drop-in for build_driver() of show_fp_*.py."""
+    return FakeDriver(browser, privacy_max, incognito, extensions, config)
@@ -0,0 +1,133 @@
+"""
+Shared helpers of the collectors (show_fp_Windows.py / show_fp_MacOS.py):
+reading the rendered features, building the /api/testing payload and posting it.
+"""
+
+from __future__ import annotations
+import datetime
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+import requests
+
+# The analysis package sits next to website-calls; rehash.py and profiling.py only need the standard library
+ROOT = str(Path(__file__).resolve().parent.parent)
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
+# Fields left out of the Comprehensive Fingerprint Hash, they change on every run.
+# Defined once in analysis/rehash.py, which checks them against excludedParams of public/script.js
+from analysis.rehash import PAGE_EXCLUDED as EXCLUDED_FIELDS
+
+# List of all expected fingerprinting fields (update as needed)
+EXPECTED_FIELDS = [
+    "Canvas Fingerprint", "WebGL Vendor", "WebGL Renderer", "WebGL Shader Precision", "Detected Fonts", "User-Agent",
+    "Screen Resolution", "Device Pixel Ratio", "Color Depth", "Time Zone", "Locale", "Platform", "CPU Cores", "Device Memory (GB)",
+    "Multi-Monitor Position", "Media Devices", "WebRTC Candidate", "Cookies Enabled", "Accept-Language", "Do Not Track", "Plugins",
+    "Audio Fingerprint", "WASM Compile Time (ms)", "TLS / JA3", "SNI / DNS / Cert Info", "Device Motion", "Device Orientation",
+    "Mouse Sample", "Key Press Sample", "Scroll Sample", "Touch Gestures Sample", "Comprehensive Fingerprint Hash",
+    "Behavior Trace ID", "TLS Request ID"
+]
+
+# JS expression returning the rendered feature cards as a JSON string of
+# [[title, value], ...], for sessions not driven through Selenium element lookups
+FEATURES_EXPRESSION = """
+JSON.stringify(Array.from(document.querySelectorAll('#featureList li')).map(li => [
+    (li.querySelector('h3') || {}).innerText || '',
+    (li.querySelector('pre') || {}).innerText || ''
+]))
+"""
+
+def add_cache_buster(url: str, behavior_traces: bool = False) -> str:
+    """Add a unique query parameter so no browser serves a cached copy of the page."""
+    cache_buster = f"nocache={int(time.time()*1000)}_{random.randint(0,99999)}"
+    if "?" in url:
+        url = url + "&" + cache_buster
+    else:
+        url = url + "?" + cache_buster
+    if behavior_traces:
+        url = url + "&traces=1"
+    return url
+
+def extract_features(driver) -> dict:
+    """Read the feature cards from the rendered list of a Selenium driver."""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    # Wait for the feature list to be populated (up to 5 seconds)
+    try:
+        WebDriverWait(driver, 5).until(
+            lambda d: d.find_elements(By.CSS_SELECTOR, "#featureList li")
+        )
+    except Exception:
+        pass
+
+    features = {}
+    for li in driver.find_elements(By.CSS_SELECTOR, "#featureList li"):
+        try:
+            key = li.find_element(By.TAG_NAME, "h3").text.strip()
+            val = li.find_element(By.TAG_NAME, "pre").text.strip()
+            features[key] = val
+        except Exception:
+            continue
+    return features
+
+def features_from_json(text: str) -> dict:
+    """Turn the result of FEATURES_EXPRESSION into a feature dict."""
+    return {str(k).strip(): str(v).strip() for k, v in json.loads(text or "[]") if k}
+
+def extension_choices(browser: str, extensions: list) -> list:
+    """Map extension file names to the user-friendly names stored by the server."""
+    ext_choices = []
+    for ext in extensions:
+        ext_lc = ext.lower()
+        if "ublock" in ext_lc:
+            ext_choices.append("ublock origin (lite)")
+        elif "privacybadger" in ext_lc or "privacy-badger" in ext_lc or "privacy_badger" in ext_lc:
+            ext_choices.append("privacy badger")
+        elif "noscript" in ext_lc:
+            ext_choices.append("noscript")
+        elif "canvasblocker" in ext_lc:
+            ext_choices.append("canvasblocker")
+
+    # Tor uses noscript by default
+    if browser == "tor":
+        ext_choices.append("noscript")
+    return ext_choices
+
+def build_payload(browser: str, privacy_max: bool, incognito: bool, extensions: list,
+                  title: str, features: dict, timestamp: Optional[str] = None) -> dict:
+    """Build the combined JSON posted to /api/testing."""
+    # Fill missing fields with empty string or default value
+    features = {k: features.get(k, "") for k in EXPECTED_FIELDS}
+    return {
+        "timestamp": timestamp or datetime.datetime.now().isoformat(),
+        "config": {
+            "browser": browser,
+            "privacy_max": privacy_max,
+            "incognito": incognito,
+            "extensions": extension_choices(browser, extensions),
+        },
+        "title": title,
+        "features": features
+    }
+
+def start_profiler(directory: str, name: str):
+    """Profile this run into directory (analysis/profiling.py); stop() writes the files."""
+    from analysis.profiling import Profiler
+    return Profiler(directory, name).start()
+
+def post_results(base_url: str, payload: dict, session: Optional[requests.Session] = None,
+                 timeout: float = 30) -> Optional[requests.Response]:
+    """POST the payload to /api/testing and print the server response."""
+    try:
+        resp = (session or requests).post(base_url.rstrip("/") + "/api/testing", json=payload, timeout=timeout)
+        print("POST /api/testing status:", resp.status_code)
+        print("Response:", resp.text)
+        return resp
+    except Exception as e:
+        print("[error] Failed to POST to /api/testing:", e)
+        return None
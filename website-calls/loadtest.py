@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+"""
+Load generator and soak test for the Express server.
+
+Replays realistic /api/testing payloads (recorded rows of the tests table,
+shaped by testing_api_schema.json) and /api/fingerprint calls from asyncio
+workers. Every worker keeps one HTTP/1.1 keep-alive connection open, so the
+numbers measure the server and not connection setup. Workers run closed loop
+(next request after the previous answer); latency is measured from sending
+the request to reading the full response.
+
+Ramp mode runs every concurrency level of --ramp for --step seconds and
+reports throughput, latency percentiles and error rates per step. Soak mode
+runs one concurrency level for --soak seconds and reports every --interval
+seconds, together with the server's RSS (from /proc, Linux only) and the
+growth of the database file.
+
+Every /api/testing request inserts a row, so point the server at a scratch
+database (DB_PATH=/tmp/load.db node index.js) instead of db/data.db.
+
+Example usage:
+        python3 loadtest.py --url http://localhost:3000 --ramp 1,2,4,8,16,32 --step 10
+        python3 loadtest.py --url http://localhost:3000 --soak 3600 --concurrency 16 --db /tmp/load.db
+        python3 loadtest.py --url http://localhost:3000 --endpoint fingerprint-get --ramp 64 --json
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import re
+import sqlite3
+import ssl
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+ENDPOINTS = ["testing", "fingerprint-post", "fingerprint-get", "stats", "page"]
+DEFAULT_ENDPOINTS = ["testing", "fingerprint-post", "fingerprint-get"]
+
+# Names the collectors send for the extension columns (see fp_common.extension_choices)
+EXTENSION_NAMES = {
+    "ublock_origin": "ublock origin (lite)",
+    "privacy_badger": "privacy badger",
+    "noscript": "noscript",
+    "canvasblocker": "canvasblocker",
+}
+
+def column_name(title: str) -> str:
+    """Column of the tests table for a feature title, e.g. "Device Memory (GB)" -> device_memory_gb."""
+    return re.sub(r"[^a-z0-9]+", "_", title.lower()).strip("_")
+
+class HttpError(Exception):
+    pass
+
+class HttpConnection:
+    """HTTP/1.1 keep-alive connection on asyncio streams, reopened after errors."""
+
+    def __init__(self, url: str, timeout: float = 30):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "localhost"
+        self.https = parts.scheme == "https"
+        self.port = parts.port or (443 if self.https else 80)
+        self.host_header = parts.netloc
+        self.timeout = timeout
+        self.reader = self.writer = None
+
+    async def close(self) -> None:
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (OSError, ssl.SSLError):
+                pass
+        self.reader = self.writer = None
+
+    async def request(self, method: str, path: str, body: Optional[bytes] = None) -> tuple:
+        """Send a request and return (status, body)."""
+        try:
+            return await asyncio.wait_for(self._request(method, path, body), self.timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ssl.SSLError, ValueError) as e:
+            await self.close()
+            raise HttpError(type(e).__name__) from e
+
+    async def _request(self, method: str, path: str, body: Optional[bytes]) -> tuple:
+        if self.writer is None:
+            # Self-signed certificates of the TLS capture port are accepted
+            context = ssl._create_unverified_context() if self.https else None
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=context)
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host_header}\r\nConnection: keep-alive\r\n"
+        if body is not None:
+            head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        self.writer.write((head + "\r\n").encode("latin-1") + (body or b""))
+        await self.writer.drain()
+
+        status = int((await self.reader.readuntil(b"\r\n")).split(b" ", 2)[1])
+        headers = {}
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+                chunks.append(chunk[:-2])
+            data = b"".join(chunks)
+        else:
+            data = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, data
+
+class PayloadFactory:
+    """Generate request bodies shaped by testing_api_schema.json.
+
+    Feature values come from a recorded row of the tests table when one is
+    available, so sizes and value distributions match real submissions;
+    fields without a recorded value are generated from their schema type.
+    """
+
+    def __init__(self, schema: dict, rows: List[dict], seed: Optional[int] = None):
+        self.schema = schema
+        self.rows = rows
+        self.random = random.Random(seed)
+        self.fingerprint_ids: List[str] = []
+
+    @classmethod
+    def load(cls, schema_path: Path, db_path: Optional[Path], seed: Optional[int] = None) -> "PayloadFactory":
+        schema = json.loads(Path(schema_path).read_text(encoding="utf-8"))
+        rows = []
+        if db_path and Path(db_path).exists():
+            conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+            conn.row_factory = sqlite3.Row
+            try:
+                rows = [dict(row) for row in conn.execute("SELECT * FROM tests")]
+            except sqlite3.Error as e:
+                print(f"[warn] Could not read recorded rows from {db_path}: {e}")
+            finally:
+                conn.close()
+        return cls(schema, rows, seed)
+
+    def _value(self, schema: dict, title: str, row: Optional[dict]):
+        kind = schema.get("type")
+        if kind == "object":
+            props = schema.get("properties", {})
+            return {name: self._value(props.get(name, {}), name, row) for name in schema.get("required", props)}
+        if kind == "array":
+            return [self._value(schema.get("items", {}), title, row)]
+        if kind == "boolean":
+            return self.random.random() < 0.5
+        if kind in ("integer", "number"):
+            return self.random.randint(0, 100)
+        recorded = row.get(column_name(title)) if row else None
+        if recorded is not None:
+            return str(recorded)
+        return uuid.UUID(int=self.random.getrandbits(128)).hex
+
+    def testing(self) -> dict:
+        """Body for POST /api/testing."""
+        row = self.random.choice(self.rows) if self.rows else None
+        payload = self._value(self.schema, "", row)
+        payload["timestamp"] = datetime.datetime.now().isoformat()
+        payload["title"] = "Browser Fingerprinting Demo"
+        if row:
+            payload["config"] = {
+                "browser": row["browser"],
+                "privacy_max": bool(row["privacy_max"]),
+                "incognito": bool(row["incognito"]),
+                "extensions": [name for col, name in EXTENSION_NAMES.items() if row.get(col)],
+            }
+        return payload
+
+    def fingerprint(self) -> dict:
+        """Body for POST /api/fingerprint; the id is remembered for later GETs."""
+        row = self.random.choice(self.rows) if self.rows else None
+        fingerprint_id = (row or {}).get("canvas_fingerprint") or uuid.UUID(int=self.random.getrandbits(128)).hex
+        if fingerprint_id not in self.fingerprint_ids:
+            self.fingerprint_ids.append(fingerprint_id)
+        return {"fingerprintId": fingerprint_id, "behaviour": self.random.randint(1, 2)}
+
+    def known_fingerprint_id(self) -> Optional[str]:
+        return self.random.choice(self.fingerprint_ids) if self.fingerprint_ids else None
+
+class Stats:
+    """Latencies and errors of one endpoint over one step or interval."""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.status: Dict[str, int] = {}
+
+    def add(self, status: str, latency: float, ok: bool) -> None:
+        self.status[status] = self.status.get(status, 0) + 1
+        if ok:
+            self.latencies.append(latency)
+        else:
+            self.errors += 1
+
+    def summary(self, elapsed: float) -> dict:
+        total = len(self.latencies) + self.errors
+        ordered = sorted(self.latencies)
+
+        def pct(p):
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 2)
+
+        return {
+            "requests": total,
+            "rps": round(total / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": pct(50),
+            "p90_ms": pct(90),
+            "p99_ms": pct(99),
+            "max_ms": round(ordered[-1] * 1000, 2) if ordered else None,
+            "error_rate": round(self.errors / total, 4) if total else 0.0,
+            "status": dict(sorted(self.status.items())),
+        }
+
+async def send(conn: HttpConnection, endpoint: str, factory: PayloadFactory) -> tuple:
+    """Issue one request of an endpoint. Returns (status label, ok)."""
+    if endpoint == "testing":
+        method, path, body = "POST", "/api/testing", factory.testing()
+    elif endpoint == "fingerprint-post":
+        method, path, body = "POST", "/api/fingerprint", factory.fingerprint()
+    elif endpoint == "fingerprint-get":
+        fingerprint_id = factory.known_fingerprint_id() or factory.fingerprint()["fingerprintId"]
+        method, path, body = "GET", f"/api/fingerprint?fingerprintId={fingerprint_id}", None
+    elif endpoint == "stats":
+        method, path, body = "GET", "/api/stats", None
+    else:
+        method, path, body = "GET", "/", None
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    try:
+        status, _ = await conn.request(method, path, data)
+    except HttpError as e:
+        return str(e), False
+    # An id that was never stored is a valid 404 answer, not a server error
+    return str(status), status < 400 or (endpoint == "fingerprint-get" and status == 404)
+
+async def run_workers(args, factory: PayloadFactory, concurrency: int, duration: float,
+                      interval: Optional[float] = None, on_interval=None) -> tuple:
+    """Run concurrency workers for duration seconds.
+
+    Returns (per-endpoint stats, elapsed seconds). With interval, on_interval
+    is called with (stats, elapsed) every interval seconds and gets fresh
+    stats afterwards.
+    """
+    current = {"stats": {e: Stats() for e in args.endpoint}, "start": time.perf_counter()}
+    deadline = time.perf_counter() + duration
+    weights = [args.weight.get(e, 1) for e in args.endpoint]
+
+    async def worker(seed: int):
+        rnd = random.Random(seed)
+        conn = HttpConnection(args.url, timeout=args.timeout)
+        try:
+            while time.perf_counter() < deadline:
+                endpoint = rnd.choices(args.endpoint, weights)[0]
+                start = time.perf_counter()
+                status, ok = await send(conn, endpoint, factory)
+                current["stats"][endpoint].add(status, time.perf_counter() - start, ok)
+                if not ok and status in ("ConnectionRefusedError", "OSError"):
+                    await asyncio.sleep(0.1)
+        finally:
+            await conn.close()
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(interval)
+            now = time.perf_counter()
+            stats, elapsed = current["stats"], now - current["start"]
+            current["stats"], current["start"] = {e: Stats() for e in args.endpoint}, now
+            on_interval(stats, elapsed)
+
+    report_task = asyncio.create_task(reporter()) if interval and on_interval else None
+    try:
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    finally:
+        if report_task:
+            report_task.cancel()
+    return current["stats"], time.perf_counter() - current["start"]
+
+def summarize(stats: Dict[str, Stats], elapsed: float) -> dict:
+    total = Stats()
+    for s in stats.values():
+        total.latencies.extend(s.latencies)
+        total.errors += s.errors
+        for status, count in s.status.items():
+            total.status[status] = total.status.get(status, 0) + count
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "total": total.summary(elapsed),
+        "endpoints": {e: s.summary(elapsed) for e, s in stats.items()},
+    }
+
+def print_summary(label: str, summary: dict, extra: str = "") -> None:
+    t = summary["total"]
+    print(f"{label:>12}  {t['rps']:>9}  {t['p50_ms']!s:>8}  {t['p90_ms']!s:>8}  {t['p99_ms']!s:>8}"
+          f"  {t['max_ms']!s:>8}  {t['error_rate'] * 100:>6.2f}%{extra}")
+
+def print_header(extra: str = "") -> None:
+    print(f"{'':>12}  {'req/s':>9}  {'p50 ms':>8}  {'p90 ms':>8}  {'p99 ms':>8}  {'max ms':>8}  {'errors':>7}{extra}")
+
+def listening_pid(port: int) -> Optional[int]:
+    """PID of the process listening on a TCP port, from /proc (Linux only)."""
+    inodes = set()
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    # state 0A is LISTEN
+                    if fields[3] == "0A" and int(fields[1].rsplit(":", 1)[1], 16) == port:
+                        inodes.add(fields[9])
+        except OSError:
+            continue
+    if not inodes:
+        return None
+    targets = {f"socket:[{inode}]" for inode in inodes}
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            fd_dir = f"/proc/{pid}/fd"
+            if any(os.readlink(os.path.join(fd_dir, fd)) in targets for fd in os.listdir(fd_dir)):
+                return int(pid)
+        except OSError:
+            continue
+    return None
+
+def rss_bytes(pid: Optional[int]) -> Optional[int]:
+    if pid is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def db_bytes(db_path: Optional[Path]) -> Optional[int]:
+    """Size of the database including its WAL and journal files."""
+    if not db_path or not Path(db_path).exists():
+        return None
+    return sum(os.path.getsize(p) for p in (str(db_path), f"{db_path}-wal", f"{db_path}-journal")
+               if os.path.exists(p))
+
+def mib(value: Optional[int]) -> str:
+    return "-" if value is None else f"{value / 1048576:.1f}"
+
+async def warm_up(args, factory: PayloadFactory) -> bool:
+    """Check the server answers and store fingerprint ids for the GET requests."""
+    conn = HttpConnection(args.url, timeout=args.timeout)
+    try:
+        status, _ = await send(conn, "stats", factory)
+        if not status.isdigit():
+            print(f"[error] Server at {args.url} is not reachable ({status})")
+            return False
+        if "fingerprint-get" in args.endpoint:
+            for _ in range(min(50, max(1, len(factory.rows)))):
+                await send(conn, "fingerprint-post", factory)
+        return True
+    finally:
+        await conn.close()
+
+async def ramp(args, factory: PayloadFactory) -> dict:
+    steps = []
+    if not args.json:
+        print_header()
+    for concurrency in args.ramp:
+        stats, elapsed = await run_workers(args, factory, concurrency, args.step)
+        summary = {"concurrency": concurrency, **summarize(stats, elapsed)}
+        steps.append(summary)
+        if not args.json:
+            print_summary(f"c={concurrency}", summary)
+    return {"mode": "ramp", "steps": steps}
+
+async def soak(args, factory: PayloadFactory) -> dict:
+    pid = args.server_pid or listening_pid(urlsplit(args.url).port or 80)
+    if pid is None:
+        print("[warn] Server process not found, RSS is not reported (use --server-pid)")
+    intervals = []
+    start = time.perf_counter()
+    first = {"rss": rss_bytes(pid), "db": db_bytes(args.db)}
+
+    def on_interval(stats, elapsed):
+        summary = {
+            "t_s": round(time.perf_counter() - start, 1),
+            **summarize(stats, elapsed),
+            "rss_bytes": rss_bytes(pid),
+            "db_bytes": db_bytes(args.db),
+        }
+        intervals.append(summary)
+        if not args.json:
+            print_summary(f"{summary['t_s']:.0f}s", summary,
+                          f"  {mib(summary['rss_bytes']):>8}  {mib(summary['db_bytes']):>8}")
+
+    if not args.json:
+        print(f"[info] Soak test for {args.soak:.0f}s at concurrency {args.concurrency}"
+              f" (server pid {pid or '-'}, RSS {mib(first['rss'])} MiB, DB {mib(first['db'])} MiB)")
+        print_header(f"  {'RSS MiB':>8}  {'DB MiB':>8}")
+    stats, elapsed = await run_workers(args, factory, args.concurrency, args.soak, args.interval, on_interval)
+    # The remainder after the last report is kept unless it only holds the
+    # requests that were in flight at the deadline
+    if not intervals or elapsed >= args.interval / 2:
+        on_interval(stats, elapsed)
+
+    last = intervals[-1] if intervals else {}
+    inserted = sum(i["endpoints"].get("testing", {}).get("requests", 0) for i in intervals)
+    result = {"mode": "soak", "server_pid": pid, "intervals": intervals}
+    if first["rss"] is not None and last.get("rss_bytes") is not None:
+        result["rss_growth_bytes"] = last["rss_bytes"] - first["rss"]
+    if first["db"] is not None and last.get("db_bytes") is not None:
+        result["db_growth_bytes"] = last["db_bytes"] - first["db"]
+        if inserted:
+            result["db_bytes_per_testing_request"] = round(result["db_growth_bytes"] / inserted, 1)
+    if not args.json:
+        if "rss_growth_bytes" in result:
+            print(f"[info] RSS grew by {mib(result['rss_growth_bytes'])} MiB")
+        if "db_growth_bytes" in result:
+            per_row = result.get("db_bytes_per_testing_request")
+            print(f"[info] DB grew by {mib(result['db_growth_bytes'])} MiB"
+                  + (f" ({per_row} bytes per /api/testing request)" if per_row is not None else ""))
+    return result
+
+async def run(args) -> dict:
+    factory = PayloadFactory.load(args.schema, args.rows_db, args.seed)
+    if not args.json:
+        print(f"[info] {len(factory.rows)} recorded rows loaded from {args.rows_db}" if factory.rows
+              else "[info] No recorded rows, payloads are generated from the schema only")
+    if not await warm_up(args, factory):
+        return {"error": "unreachable"}
+    if args.soak:
+        return await soak(args, factory)
+    return await ramp(args, factory)
+
+def parse_args(argv=None):
+    """Parse command-line arguments."""
+    p = argparse.ArgumentParser(description="Load and soak test the fingerprinting server")
+    p.add_argument("--url", default="http://localhost:3000", help="Server base URL")
+    p.add_argument("--endpoint", action="append", choices=ENDPOINTS,
+                   help=f"Endpoint to load, can be repeated (default: {', '.join(DEFAULT_ENDPOINTS)})")
+    p.add_argument("--weight", action="append", default=[], metavar="ENDPOINT=N",
+                   help="Relative share of an endpoint's requests (default 1 each)")
+    p.add_argument("--ramp", default="1,2,4,8,16,32",
+                   help="Comma separated concurrency levels of the ramp")
+    p.add_argument("--step", type=float, default=10, help="Seconds per ramp step")
+    p.add_argument("--soak", type=float, help="Run a soak test for this many seconds instead of the ramp")
+    p.add_argument("--concurrency", type=int, default=8, help="Workers of the soak test")
+    p.add_argument("--interval", type=float, default=10, help="Seconds between soak reports")
+    p.add_argument("--server-pid", type=int, help="Server PID for RSS (default: process listening on the URL's port)")
+    p.add_argument("--db", type=Path, help="Database file the server writes to, for the growth report")
+    p.add_argument("--schema", type=Path, default=REPO_DIR / "testing_api_schema.json")
+    p.add_argument("--rows-db", type=Path, default=REPO_DIR / "db" / "data.db",
+                   help="Database with recorded rows to replay (read only)")
+    p.add_argument("--timeout", type=float, default=30, help="Seconds per request")
+    p.add_argument("--seed", type=int, help="Seed of the payload generator")
+    p.add_argument("--json", action="store_true", help="Print the result as JSON")
+    args = p.parse_args(argv)
+    args.endpoint = args.endpoint or DEFAULT_ENDPOINTS
+    try:
+        args.ramp = [int(c) for c in args.ramp.split(",") if c]
+        args.weight = {name: float(value) for name, value in (w.split("=", 1) for w in args.weight)}
+    except ValueError:
+        p.error("--ramp takes integers and --weight takes ENDPOINT=N")
+    if any(c < 1 for c in args.ramp) or args.concurrency < 1:
+        p.error("concurrency levels must be at least 1")
+    unknown = set(args.weight) - set(ENDPOINTS)
+    if unknown:
+        p.error(f"unknown endpoint in --weight: {', '.join(sorted(unknown))}")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        result = asyncio.run(run(args))
+    except KeyboardInterrupt:
+        print("[info] Interrupted by user.")
+        sys.exit(130)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    sys.exit(1 if "error" in result else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,696 @@
+#!/usr/bin/env python3
+"""
+Run many fingerprinting sessions concurrently from one asyncio event loop.
+
+Chromium based browsers (chrome, brave) are driven directly over the Chrome
+DevTools Protocol and Firefox over WebDriver BiDi, both through a single
+websocket per browser, so no chromedriver/geckodriver process and no blocking
+HTTP round trip per command is needed. Configurations these protocols cannot
+set up (Tor Browser, .crx extensions) fall back to the Selenium driver of
+show_fp_*.py, run in a worker thread.
+
+Jobs are fed through a bounded queue: the producer blocks while all workers
+are busy, so at most --concurrency browsers are running at any time. Within
+that bound a browser is only launched while the host has memory and CPU
+headroom for it (admission.py, Linux only). Every phase of a session has a
+deadline (session_watchdog.py); a session that exceeds it has its process tree killed
+and is retried in a fresh browser, and the reason is kept with the result.
+With --plan the jobs come from a campaign plan instead (campaign.py), every
+finished cell is journaled and a restarted campaign skips the done cells.
+With --metrics-port the progress is served for Prometheus (metrics.py).
+With --fake no browser is started: every session runs on the fake WebDriver
+of fakedriver.py, for testing and load-testing the runner and the server.
+
+Example usage:
+        python3 orchestrator.py --url http://localhost:80 --concurrency 4 --runs 2
+        python3 orchestrator.py --url http://localhost:80 --browser firefox --extensions yes --incognito both
+        python3 orchestrator.py --url http://localhost:80 --concurrency 16 --min-free-mem 2048 --cost tor=1000
+        python3 orchestrator.py --plan baseline.json --shard 1/2
+        python3 orchestrator.py --url http://localhost:80 --fake --wait 0 --runs 100 --concurrency 32
+
+Dependencies:
+        pip install -r requirements.txt
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import contextlib
+import functools
+import importlib
+import inspect
+import itertools
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Optional
+
+import requests
+import websockets
+
+from adaptive import AdaptiveScheduler
+from admission import DEFAULT_COST_MIB, Admission
+from campaign import (Journal, PlanError, execution_order, journal_path, load_plan, parse_cells, plan_digest,
+                      progress, read_journals)
+from fakedriver import FakeConfig, build_driver as build_fake_driver
+from fp_common import (FEATURES_EXPRESSION, add_cache_buster, build_payload, extract_features,
+                       features_from_json, post_results, start_profiler)
+from metrics import Registry, serve as serve_metrics
+from tbselenium.utils import write_user_js
+from session_watchdog import PHASE_TIMEOUTS, PhaseTimeout, Watch, run_in_thread, supervise
+
+# Platform specific browser paths and options
+fp = importlib.import_module("show_fp_Windows" if os.name == "nt" else "show_fp_MacOS")
+BINARY_PATHS = getattr(fp, "BINARY_PATHS", None) or getattr(fp, "MAC_PATHS", {})
+# Only the Windows collector drives Tor Browser (through the shared Tor daemon)
+TOR_SUPPORTED = "tor_worker" in inspect.signature(fp.build_driver).parameters
+
+EXTENSION_DIRS = {
+    ".crx": Path(__file__).parent / "extensions" / "chromium-crx",
+    ".xpi": Path(__file__).parent / "extensions" / "firefox-xpi",
+}
+
+BIDI_LISTENING = re.compile(r"WebDriver BiDi listening on (ws://\S+)")
+
+# Campaign metrics, served on /metrics with --metrics-port
+METRICS = Registry()
+sessions_planned = METRICS.gauge("orchestrator_sessions_planned",
+                                 "Sessions of the campaign (with --adaptive: scheduled so far)")
+sessions_in_flight = METRICS.gauge("orchestrator_sessions_in_flight", "Sessions with a running browser", ["browser"])
+sessions_completed = METRICS.counter("orchestrator_sessions_completed_total",
+                                     "Finished sessions, after their retries, by browser and result",
+                                     ["browser", "result"])
+attempt_duration = METRICS.histogram("orchestrator_attempt_duration_seconds",
+                                     "Duration of a session attempt by browser and result", ["browser", "result"])
+attempt_failures = METRICS.counter("orchestrator_attempt_failures_total",
+                                   "Failed session attempts by browser and the phase they failed in",
+                                   ["browser", "phase"])
+admission_wait = METRICS.histogram("orchestrator_admission_wait_seconds",
+                                   "Time a session waited for memory and CPU headroom",
+                                   buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+
+@dataclass
+class Job:
+    browser: str
+    privacy_max: bool
+    incognito: bool
+    extensions: list = field(default_factory=list)
+    run: int = 1
+
+    def __str__(self):
+        flags = [self.browser]
+        if self.privacy_max:
+            flags.append("privacy-max")
+        if self.incognito:
+            flags.append("incognito")
+        if self.extensions:
+            flags.append(f"{len(self.extensions)} extensions")
+        return f"{' '.join(flags)} (run {self.run})"
+
+    @property
+    def key(self) -> str:
+        """Stable name of the job's cell in a campaign plan."""
+        flags = [self.browser] + [name for name, on in (("privacy-max", self.privacy_max),
+                                                        ("extensions", self.extensions),
+                                                        ("incognito", self.incognito)) if on]
+        return "/".join(flags + [f"run{self.run}"])
+
+    @property
+    def config(self) -> str:
+        """The key without the run, shared by all repetitions of a combination."""
+        return self.key.rsplit("/", 1)[0]
+
+class ProtocolError(RuntimeError):
+    pass
+
+class WsClient:
+    """Minimal JSON command client shared by CDP and WebDriver BiDi.
+
+    Both protocols send {"id", "method", "params"} and answer with the same
+    id; events (messages without a pending id) are ignored.
+    """
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.next_id = 0
+        self.pending = {}
+        self.reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        try:
+            async for message in self.ws:
+                msg = json.loads(message)
+                future = self.pending.pop(msg.get("id"), None)
+                if future is None or future.done():
+                    continue
+                if "error" in msg:
+                    error = msg["error"]
+                    text = error.get("message") if isinstance(error, dict) else f"{error}: {msg.get('message')}"
+                    future.set_exception(ProtocolError(text))
+                else:
+                    future.set_result(msg.get("result", {}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ProtocolError("Connection closed"))
+            self.pending.clear()
+
+    async def send(self, method: str, params: Optional[dict] = None, session_id: Optional[str] = None,
+                   timeout: float = 30) -> dict:
+        self.next_id += 1
+        msg = {"id": self.next_id, "method": method, "params": params or {}}
+        if session_id:
+            msg["sessionId"] = session_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[self.next_id] = future
+        await self.ws.send(json.dumps(msg))
+        return await asyncio.wait_for(future, timeout)
+
+    async def close(self):
+        await self.ws.close()
+        self.reader.cancel()
+
+async def stop_process(proc: asyncio.subprocess.Process, timeout: float = 10) -> None:
+    if proc.returncode is not None:
+        return
+    try:
+        await asyncio.wait_for(proc.wait(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+
+class CdpSession:
+    """One Chromium instance driven over the DevTools protocol."""
+
+    def __init__(self, binary: str, options, insecure_certs: bool = False, on_start=None):
+        self.binary = binary
+        self.options = options
+        self.insecure_certs = insecure_certs
+        self.on_start = on_start
+
+    async def __aenter__(self):
+        self.user_data_dir = tempfile.mkdtemp(prefix="fp-cdp-")
+        # Port 0 lets the browser pick a free port and write it to DevToolsActivePort
+        args = ["--remote-debugging-port=0", f"--user-data-dir={self.user_data_dir}",
+                "--no-first-run", "--no-default-browser-check",
+                *self.options.arguments, "about:blank"]
+        if self.insecure_certs:
+            args.insert(0, "--ignore-certificate-errors")
+        self.proc = await asyncio.create_subprocess_exec(
+            self.binary, *args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        if self.on_start:
+            self.on_start(self.proc.pid)
+        active_port = Path(self.user_data_dir) / "DevToolsActivePort"
+        deadline = time.monotonic() + 30
+        while True:
+            lines = active_port.read_text().split("\n") if active_port.exists() else []
+            if len(lines) >= 2 and lines[1]:
+                break
+            if self.proc.returncode is not None or time.monotonic() > deadline:
+                await self._cleanup()
+                raise ProtocolError(f"{self.binary} did not open a DevTools port")
+            await asyncio.sleep(0.1)
+        try:
+            ws = await websockets.connect(f"ws://127.0.0.1:{lines[0].strip()}{lines[1].strip()}", max_size=None)
+            self.client = WsClient(ws)
+            target = await self.client.send("Target.createTarget", {"url": "about:blank"})
+            attached = await self.client.send("Target.attachToTarget",
+                                              {"targetId": target["targetId"], "flatten": True})
+            self.session_id = attached["sessionId"]
+        except BaseException:
+            await self.__aexit__(None, None, None)
+            raise
+        return self
+
+    async def navigate(self, url: str) -> None:
+        await self.client.send("Page.navigate", {"url": url}, self.session_id)
+
+    async def evaluate(self, expression: str):
+        result = await self.client.send("Runtime.evaluate",
+                                        {"expression": expression, "returnByValue": True},
+                                        self.session_id)
+        return result.get("result", {}).get("value")
+
+    async def _cleanup(self):
+        await stop_process(self.proc, timeout=5)
+        await asyncio.to_thread(shutil.rmtree, self.user_data_dir, True)
+
+    async def __aexit__(self, *exc):
+        with contextlib.suppress(Exception):
+            await self.client.send("Browser.close", timeout=5)
+        with contextlib.suppress(Exception):
+            await self.client.close()
+        await self._cleanup()
+
+class BidiSession:
+    """One Firefox instance driven over WebDriver BiDi."""
+
+    def __init__(self, binary: str, options, extensions: list, insecure_certs: bool = False, on_start=None):
+        self.binary = binary
+        self.options = options
+        self.extensions = extensions
+        self.insecure_certs = insecure_certs
+        self.on_start = on_start
+
+    async def __aenter__(self):
+        profile = self.options.profile
+        # Prefs set on the options (not on the profile) would otherwise be lost without geckodriver
+        if self.options.preferences:
+            write_user_js(profile.path, self.options.preferences)
+        args = ["--remote-debugging-port", "0", "-no-remote", "-profile", profile.path,
+                *self.options.arguments]
+        self.proc = await asyncio.create_subprocess_exec(
+            self.binary, *args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+        if self.on_start:
+            self.on_start(self.proc.pid)
+        try:
+            ws_url = await asyncio.wait_for(self._listening_url(), 30)
+        except (asyncio.TimeoutError, ProtocolError):
+            await stop_process(self.proc, timeout=5)
+            raise ProtocolError(f"{self.binary} did not start WebDriver BiDi")
+        # Keep draining stderr so the browser never blocks on a full pipe
+        self.drain = asyncio.create_task(self._drain())
+        try:
+            ws = await websockets.connect(ws_url + "/session", max_size=None)
+            self.client = WsClient(ws)
+            await self.client.send("session.new", {"capabilities": {
+                "alwaysMatch": {"acceptInsecureCerts": self.insecure_certs}}})
+            for ext in self.extensions:
+                await self.client.send("webExtension.install",
+                                       {"extensionData": {"type": "path", "path": str(Path(ext).resolve())}})
+            tree = await self.client.send("browsingContext.getTree", {"maxDepth": 0})
+            self.context = tree["contexts"][0]["context"]
+        except BaseException:
+            await self.__aexit__(None, None, None)
+            raise
+        return self
+
+    async def _listening_url(self) -> str:
+        while True:
+            line = await self.proc.stderr.readline()
+            if not line:
+                raise ProtocolError("Browser exited")
+            match = BIDI_LISTENING.search(line.decode("utf-8", "replace"))
+            if match:
+                return match.group(1)
+
+    async def _drain(self):
+        while await self.proc.stderr.read(65536):
+            pass
+
+    async def navigate(self, url: str) -> None:
+        await self.client.send("browsingContext.navigate",
+                               {"context": self.context, "url": url, "wait": "none"})
+
+    async def evaluate(self, expression: str):
+        result = await self.client.send("script.evaluate", {
+            "expression": expression,
+            "target": {"context": self.context},
+            "awaitPromise": False,
+        })
+        if result.get("type") == "exception":
+            raise ProtocolError(result.get("exceptionDetails", {}).get("text", "Script error"))
+        return result.get("result", {}).get("value")
+
+    async def __aexit__(self, *exc):
+        with contextlib.suppress(Exception):
+            await self.client.send("browser.close", timeout=5)
+        with contextlib.suppress(Exception):
+            await self.client.close()
+        await stop_process(self.proc, timeout=5)
+        self.drain.cancel()
+
+async def wait_for_features(session, timeout: float, behavior_traces: bool) -> tuple:
+    """Poll the feature list until the comprehensive hash (and trace id) is shown.
+
+    Replaces the fixed sleep of the Selenium collector: most pages are done well
+    before the worst case wait.
+    """
+    deadline = time.monotonic() + timeout
+    features = {}
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+        try:
+            features = features_from_json(await session.evaluate(FEATURES_EXPRESSION))
+        except (ProtocolError, ValueError):
+            # Page still loading or navigating
+            continue
+        if features.get("Comprehensive Fingerprint Hash") and \
+                (not behavior_traces or features.get("Behavior Trace ID")):
+            break
+    title = await session.evaluate("document.title") or ""
+    return features, title
+
+def collect_with_selenium(job: Job, url: str, args, watch: Watch, worker: int = 0) -> tuple:
+    """Blocking fallback through the Selenium driver of show_fp_*.py."""
+    # Tor sessions get the SOCKS port of their worker on the shared Tor daemon
+    extra = {"tor_worker": worker} if job.browser == "tor" and TOR_SUPPORTED else {}
+    build_driver = functools.partial(build_fake_driver, config=args.fake_config) if args.fake else fp.build_driver
+    watch.enter("launch")
+    driver = build_driver(job.browser, headless=args.headless, privacy_max=job.privacy_max,
+                          incognito=job.incognito, extensions=job.extensions,
+                          insecure_certs=url.startswith("https://"), **extra)
+    # The browser runs below the driver process (chromedriver/geckodriver)
+    process = getattr(getattr(driver, "service", None), "process", None)
+    watch.attach(getattr(process, "pid", None))
+    try:
+        watch.enter("load")
+        driver.get(url)
+        watch.enter("collect")
+        time.sleep(args.wait)
+        return extract_features(driver), driver.title
+    finally:
+        with contextlib.suppress(Exception):
+            driver.quit()
+
+def needs_selenium(job: Job) -> bool:
+    if job.browser == "tor":
+        return True
+    return job.browser in ("chrome", "brave") and any(e.endswith(".crx") for e in job.extensions)
+
+async def run_job(job: Job, args, http: requests.Session, watch: Watch, worker: int = 0) -> dict:
+    url = add_cache_buster(args.url, behavior_traces=args.behavior_traces)
+    if args.fake or needs_selenium(job):
+        features, title = await run_in_thread(collect_with_selenium, job, url, args, watch, worker)
+    else:
+        options = fp.build_options(job.browser, args.headless, job.privacy_max, job.incognito, job.extensions)
+        binary = getattr(options, "binary_location", "") or BINARY_PATHS.get(job.browser) \
+            or shutil.which(job.browser)
+        if not binary:
+            raise ProtocolError(f"No binary found for {job.browser}")
+        # The TLS capture port of the server uses a self-signed certificate
+        insecure_certs = url.startswith("https://")
+        if job.browser == "firefox":
+            session = BidiSession(binary, options, [e for e in job.extensions if e.endswith(".xpi")],
+                                  insecure_certs, on_start=watch.attach)
+        else:
+            session = CdpSession(binary, options, insecure_certs, on_start=watch.attach)
+        watch.enter("launch")
+        async with session:
+            watch.enter("load")
+            await session.navigate(url)
+            watch.enter("collect")
+            features, title = await wait_for_features(session, args.wait, args.behavior_traces)
+
+    watch.enter("upload")
+    payload = build_payload(job.browser, job.privacy_max, job.incognito, job.extensions, title, features)
+    resp = await asyncio.to_thread(post_results, args.url, payload, http)
+    if resp is None or not resp.ok:
+        raise ProtocolError(f"Upload failed ({'no response' if resp is None else resp.status_code})")
+    return features
+
+async def run_with_retries(name: int, job: Job, args, http: requests.Session, admission: Admission) -> dict:
+    """Run a job until it succeeds or --retries is used up, every attempt in a fresh browser."""
+    failures = []
+    for attempt in range(1, args.retries + 2):
+        waiting = time.monotonic()
+        async with admission.slot(job) as lease:
+            admission_wait.observe(time.monotonic() - waiting)
+            watch = Watch(args.deadlines, lease)
+            print(f"[info] worker {name}: {job}" + (f", attempt {attempt}" if attempt > 1 else ""))
+            started = time.monotonic()
+            sessions_in_flight.inc(browser=job.browser)
+            try:
+                features = await supervise(run_job(job, args, http, watch, name), watch)
+                attempt_duration.observe(time.monotonic() - started, browser=job.browser, result="ok")
+                return {"job": str(job), "ok": True, "attempts": attempt, "failures": failures,
+                        "cfh": features.get("Comprehensive Fingerprint Hash"), "features": features}
+            except PhaseTimeout as e:
+                reason = f"{e}, processes killed"
+            except Exception as e:
+                reason = f"{e.__class__.__name__}: {e}"
+            finally:
+                sessions_in_flight.dec(browser=job.browser)
+        attempt_duration.observe(time.monotonic() - started, browser=job.browser, result="failed")
+        attempt_failures.inc(browser=job.browser, phase=watch.phase)
+        print(f"[error] worker {name}: {job}: {watch.phase}: {reason}")
+        failures.append({"phase": watch.phase, "reason": reason})
+    return {"job": str(job), "ok": False, "attempts": args.retries + 1, "failures": failures}
+
+async def worker(name: int, queue: asyncio.Queue, args, http: requests.Session, results: dict,
+                 admission: Admission, journal: Optional[Journal] = None,
+                 scheduler: Optional[AdaptiveScheduler] = None) -> None:
+    while True:
+        job = await queue.get()
+        try:
+            if job is None:
+                return
+            outcome = await run_with_retries(name, job, args, http, admission)
+            results["ok" if outcome["ok"] else "failed"] += 1
+            sessions_completed.inc(browser=job.browser, result="ok" if outcome["ok"] else "failed")
+            # Only the CFH is kept with the outcome
+            features = outcome.pop("features", None)
+            if scheduler and features is not None:
+                scheduler.observe(job.config, features)
+            results["outcomes"].append(outcome)
+            if journal:
+                journal.record(job.key, outcome)
+            if args.report:
+                with open(args.report, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(outcome) + "\n")
+        finally:
+            queue.task_done()
+
+def matrix_jobs(browsers: list, privacy_choice: str, extension_choice: str, incognito_choice: str, runs: int) -> list:
+    """All browser / privacy / extension / incognito combinations, like run_all_combinations.sh."""
+    choices = {"no": [False], "yes": [True], "both": [False, True]}
+    jobs = []
+    for run in range(1, runs + 1):
+        for browser, privacy_max, with_ext, incognito in itertools.product(
+                browsers, choices[privacy_choice], choices[extension_choice], choices[incognito_choice]):
+            extensions = []
+            if with_ext:
+                suffix = ".xpi" if browser in ("firefox", "tor") else ".crx"
+                extensions = sorted(str(p) for p in EXTENSION_DIRS[suffix].glob("*" + suffix))
+            jobs.append(Job(browser, privacy_max, incognito, extensions, run))
+    return jobs
+
+def build_jobs(args) -> list:
+    return matrix_jobs(args.browser, args.privacy_max, args.extensions, args.incognito, args.runs)
+
+def plan_jobs(plan: dict) -> list:
+    """The cells of a campaign plan, in plan order (the order of their indexes)."""
+    return matrix_jobs(plan["browsers"], plan["privacy_max"], plan["extensions"], plan["incognito"],
+                       plan["repeats"])
+
+async def feed_adaptive(queue: asyncio.Queue, configs: list, scheduler: AdaptiveScheduler) -> None:
+    """Queue rounds of runs of every configuration the scheduler has not settled yet.
+
+    The first --min-runs rounds are queued back to back; after that a round
+    waits for the previous one, whose results decide the next.
+    """
+    while True:
+        jobs = []
+        for job in configs:
+            run = scheduler.next_run(job.config)
+            if run is not None:
+                jobs.append(replace(job, run=run))
+        if not jobs:
+            return
+        sessions_planned.inc(len(jobs))
+        for job in jobs:
+            await queue.put(job)  # Blocks while every worker is busy
+        if max(job.run for job in jobs) >= scheduler.min_runs:
+            await queue.join()
+
+def resume_plan(args) -> tuple:
+    """Jobs of the plan's shard that no journal records as done, and the journal of this run."""
+    jobs = plan_jobs(args.plan_spec)
+    cells = parse_cells(args.shard, len(jobs)) if args.shard else range(len(jobs))
+    digest = plan_digest(args.plan_spec)
+    records = read_journals(args.plan, digest)
+    shard = [jobs[i] for i in cells]
+    counts = progress([job.key for job in shard], records)
+    print(f"[info] plan {args.plan_spec['name']}: cells {cells.start}-{cells.stop - 1} of {len(jobs)}, "
+          f"{counts['done']} done, {counts['failed']} failed before")
+    pending = [job for job in shard if not records.get(job.key, {}).get("ok")]
+    journal = Journal(args.journal or journal_path(args.plan, args.shard), digest, args.shard or "")
+    return execution_order(pending, args.plan_spec["seed"]), journal
+
+async def orchestrate(args) -> dict:
+    journal = scheduler = None
+    if args.plan:
+        jobs, journal = resume_plan(args)
+        journal.open()
+    elif args.adaptive:
+        scheduler = AdaptiveScheduler(args.min_runs, args.runs, args.epsilon, args.confidence)
+        jobs = matrix_jobs(args.browser, args.privacy_max, args.extensions, args.incognito, 1)
+    else:
+        jobs = build_jobs(args)
+    if scheduler:
+        print(f"[info] {len(jobs)} configurations, {args.min_runs} to {args.runs} runs each, "
+              f"concurrency {args.concurrency}")
+    else:
+        print(f"[info] {len(jobs)} sessions, concurrency {args.concurrency}")
+        sessions_planned.set(len(jobs))
+    if args.metrics_port:
+        serve_metrics(METRICS, args.metrics_port)
+        print(f"[info] Metrics on http://127.0.0.1:{args.metrics_port}/metrics")
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.concurrency)
+    results = {"ok": 0, "failed": 0, "outcomes": []}
+    started = time.monotonic()
+    # Fake browsers have no processes to measure
+    admission = Admission(args.min_free_mem, args.max_cpu, args.cost, enabled=not (args.no_admission or args.fake))
+    if not admission.enabled and not (args.no_admission or args.fake):
+        print("[warn] /proc not available, browsers are only limited by --concurrency")
+    if "tor" in args.browser and "tor" in BINARY_PATHS and not args.fake:
+        # Bootstrap the shared daemon once, before the workers need it
+        from tor_service import TorService
+        await asyncio.to_thread(TorService(BINARY_PATHS["tor"]).ensure)
+    with requests.Session() as http:
+        async with admission:
+            workers = [asyncio.create_task(worker(i, queue, args, http, results, admission, journal, scheduler))
+                       for i in range(args.concurrency)]
+            if scheduler:
+                await feed_adaptive(queue, jobs, scheduler)
+            else:
+                for job in jobs:
+                    await queue.put(job)  # Blocks while every worker is busy
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+    elapsed = time.monotonic() - started
+    print(f"[info] {results['ok']} ok, {results['failed']} failed in {elapsed:.1f}s ({admission.summary()})")
+    phases = Counter(f["phase"] for outcome in results["outcomes"] for f in outcome["failures"])
+    if phases:
+        retried = sum(1 for outcome in results["outcomes"] if outcome["ok"] and outcome["failures"])
+        print(f"[info] failed attempts by phase: {', '.join(f'{p} {n}' for p, n in phases.most_common())}"
+              f" ({retried} sessions succeeded on a retry)")
+    if scheduler:
+        for line in scheduler.summary():
+            print(f"[info] {line}")
+    return results
+
+def parse_args(argv=None):
+    """Parse command-line arguments."""
+    p = argparse.ArgumentParser(description="Run fingerprinting sessions concurrently")
+    p.add_argument("--url", help="Target URL (required without --plan, overrides the URL of the plan)")
+    p.add_argument("--browser", action="append", choices=["chrome", "brave", "firefox", "tor"],
+                   help="Browser to include, can be repeated (default: chrome, brave, firefox)")
+    p.add_argument("--privacy-max", choices=["no", "yes", "both"], default="both")
+    p.add_argument("--extensions", choices=["no", "yes", "both"], default="both",
+                   help="Run without and/or with all extensions of ./extensions")
+    p.add_argument("--incognito", choices=["no", "yes", "both"], default="both")
+    p.add_argument("--runs", type=int, default=None,
+                   help="Repetitions of every combination (default 2), the most runs with --adaptive (default 20)")
+    p.add_argument("--concurrency", type=int, default=4, help="Browsers running at the same time")
+    p.add_argument("--wait", type=float, default=12,
+                   help="Maximum seconds to wait for the comprehensive hash per session")
+    p.add_argument("--headless", action="store_true", help="Run browsers headless (may change fingerprint)")
+    p.add_argument("--behavior-traces", action="store_true",
+                   help="Let the page record full behavioral traces and upload them as binary blobs")
+    p.add_argument("--min-free-mem", type=float, default=1024, metavar="MIB",
+                   help="Memory to keep available when launching a browser")
+    p.add_argument("--max-cpu", type=float, default=0.9,
+                   help="Launch no browser while the CPU is busier than this fraction")
+    p.add_argument("--cost", action="append", default=[], metavar="BROWSER=MIB",
+                   help="Expected memory of a browser until one was measured "
+                        f"(default {', '.join(f'{b}={c}' for b, c in DEFAULT_COST_MIB.items())})")
+    p.add_argument("--no-admission", action="store_true",
+                   help="Only limit the browsers by --concurrency, not by memory and CPU")
+    p.add_argument("--timeout", action="append", default=[], metavar="PHASE=SECONDS",
+                   help="Deadline of a session phase, the process tree is killed after it "
+                        f"(default {', '.join(f'{k}={v}' for k, v in PHASE_TIMEOUTS.items())}, collect plus --wait)")
+    p.add_argument("--retries", type=int, default=1, help="Attempts after a failed session, in a fresh browser")
+    p.add_argument("--report", type=Path, help="Append the outcome of every session (JSON lines) to this file")
+    p.add_argument("--adaptive", action="store_true",
+                   help="Repeat a combination only until the rate of new CFHs is bounded below --epsilon")
+    p.add_argument("--min-runs", type=int, default=3, help="Runs of every combination before --adaptive may stop it")
+    p.add_argument("--epsilon", type=float, default=0.3,
+                   help="New-CFH rate below which a combination counts as settled "
+                        "(a stable combination stops after 16 runs at the defaults, 8 with --epsilon 0.5)")
+    p.add_argument("--confidence", type=float, default=0.9, help="Confidence of the --adaptive bound")
+    p.add_argument("--fake", action="store_true",
+                   help="Run every session on the fake WebDriver of fakedriver.py instead of a browser")
+    p.add_argument("--fake-option", action="append", default=[], metavar="KEY=VALUE",
+                   help="Latency, failure rate or page of the fake browsers, e.g. load=0.2 or hangs=0.01")
+    p.add_argument("--profile", metavar="DIR",
+                   help="Profile the campaign (cProfile and stack samples of all threads) into this directory")
+    p.add_argument("--metrics-port", type=int,
+                   help="Serve Prometheus metrics of the campaign on http://127.0.0.1:PORT/metrics")
+    p.add_argument("--plan", type=Path,
+                   help="Campaign plan (campaign.py) instead of the matrix options; resumes from its journals")
+    p.add_argument("--shard", help="Only run these cells of the plan, K/N (e.g. 2/3) or START-END")
+    p.add_argument("--journal", type=Path,
+                   help="Progress journal of this run (default: next to the plan, one per shard)")
+    args = p.parse_args(argv)
+    args.browser = args.browser or ["chrome", "brave", "firefox"]
+    if args.plan:
+        try:
+            args.plan_spec = load_plan(args.plan)
+            if args.shard:
+                parse_cells(args.shard, 0)
+        except PlanError as e:
+            p.error(str(e))
+        # The plan decides what is measured
+        args.url = args.url or args.plan_spec["url"]
+        args.browser = args.plan_spec["browsers"]
+        for name, value in args.plan_spec["settings"].items():
+            setattr(args, name, value)
+    elif args.shard or args.journal:
+        p.error("--shard and --journal need --plan")
+    elif not args.url:
+        p.error("--url is required without --plan")
+    try:
+        args.fake_config = FakeConfig.from_options(args.fake_option)
+    except ValueError as e:
+        p.error(str(e))
+    if args.fake_option and not args.fake:
+        p.error("--fake-option needs --fake")
+    if "tor" in args.browser and not (TOR_SUPPORTED or args.fake):
+        p.error(f"tor is not supported by {fp.__name__}.py on this OS (only with --fake)")
+    if args.adaptive and args.plan:
+        p.error("--adaptive can't be combined with --plan, whose repeats are fixed")
+    if args.runs is None:
+        args.runs = 20 if args.adaptive else 2
+    if args.runs < 1:
+        p.error("--runs must be at least 1")
+    if args.adaptive and not 2 <= args.min_runs <= args.runs:
+        p.error("--min-runs must be between 2 and --runs")
+    if not 0 < args.epsilon < 1 or not 0 < args.confidence < 1:
+        p.error("--epsilon and --confidence must be between 0 and 1")
+    if args.concurrency < 1:
+        p.error("--concurrency must be at least 1")
+    try:
+        args.cost = {name: float(value) for name, value in (c.split("=", 1) for c in args.cost)}
+    except ValueError:
+        p.error("--cost takes BROWSER=MIB")
+    unknown = set(args.cost) - set(DEFAULT_COST_MIB)
+    if unknown:
+        p.error(f"unknown browser in --cost: {', '.join(sorted(unknown))}")
+    args.deadlines = dict(PHASE_TIMEOUTS, collect=PHASE_TIMEOUTS["collect"] + args.wait)
+    try:
+        args.deadlines.update({name: float(value) for name, value in (t.split("=", 1) for t in args.timeout)})
+    except ValueError:
+        p.error("--timeout takes PHASE=SECONDS")
+    unknown = set(args.deadlines) - set(PHASE_TIMEOUTS)
+    if unknown:
+        p.error(f"unknown phase in --timeout: {', '.join(sorted(unknown))}")
+    if args.retries < 0:
+        p.error("--retries must not be negative")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    profiler = start_profiler(args.profile, "orchestrator") if args.profile else None
+    try:
+        results = asyncio.run(orchestrate(args))
+    except KeyboardInterrupt:
+        print("[info] Interrupted by user.")
+        sys.exit(130)
+    finally:
+        if profiler:
+            profiler.stop()
+    sys.exit(1 if results["failed"] else 0)
+
+if __name__ == "__main__":
+    main()
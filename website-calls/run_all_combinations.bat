@@ -11,6 +11,8 @@ set EXT_CHROME=extensions\chromium-crx\ublock_origin_lite.crx extensions\chromiu
 set EXT_FIREFOX=extensions\firefox-xpi\ublock_origin-1.66.4.xpi extensions\firefox-xpi\privacy-badger-latest.xpi extensions\firefox-xpi\canvasblocker-1.11.xpi extensions\firefox-xpi\noscript-13.0.9.xpi
 set EXT_TOR=extensions\firefox-xpi\ublock_origin-1.66.4.xpi extensions\firefox-xpi\privacy-badger-latest.xpi extensions\firefox-xpi\canvasblocker-1.11.xpi
 
+REM Set PROFILE_DIR to profile every run (merge with: python -m analysis profile %PROFILE_DIR%)
+
 REM Define browsers, privacy, extensions, and incognito settings
 set BROWSERS=tor
 set PRIVACY=_none_ --privacy-max
@@ -60,6 +62,10 @@ for /l %%R in (1,1,2) do (
                         )
                     )
 
+                    if defined PROFILE_DIR (
+                        set CMD=!CMD! --profile "%PROFILE_DIR%"
+                    )
+
                     echo Running ^(repeat %%R^): !CMD!
                     cmd /c "!CMD!"
                     echo --------------------------------------------------------------
@@ -5,6 +5,7 @@ SCRIPT="show_fp_MacOS.py"
 URL="http://localhost:80"
 EXT_CHROME="./extensions/chromium-crx/ublock_origin_lite.crx ./extensions/chromium-crx/privacy-badger-chrome.crx ./extensions/chromium-crx/NoScript.crx"
 EXT_FIREFOX="./extensions/firefox-xpi/ublock_origin-1.66.4.xpi ./extensions/firefox-xpi/privacy-badger-latest.xpi ./extensions/firefox-xpi/canvasblocker-1.11.xpi ./extensions/firefox-xpi/noscript-13.0.9.xpi"
+# Set PROFILE_DIR to profile every run (merge with: python3 -m analysis profile $PROFILE_DIR)
 BROWSERS=(chrome brave firefox)
 PRIVACY=("" "--privacy-max")
 EXTENSIONS=("" "--extension-all")
@@ -35,6 +36,9 @@ for REPEAT in 1 2; do
               done
             fi
           fi
+          if [ -n "$PROFILE_DIR" ]; then
+            CMD+=" --profile $PROFILE_DIR"
+          fi
           echo "Running (repeat $REPEAT): $CMD"
           eval $CMD
           echo "Sleeping 5 seconds..."
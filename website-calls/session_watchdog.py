@@ -0,0 +1,177 @@
+"""
+Per-phase deadlines for browser runs.
+
+A run reports the phase it is in (launch, load, collect, upload) on its Watch
+and attaches the PIDs of the processes it starts. The supervisor (an asyncio
+task in orchestrator.py, a thread in the show_fp_*.py collectors) checks the
+watch; when a phase exceeds its deadline, the whole process tree of the run
+(driver, browser and all their children) is killed, which also makes the
+blocked WebDriver/DevTools call of the run fail, and the phase is recorded as
+the failure reason.
+"""
+
+from __future__ import annotations
+import asyncio
+import contextlib
+import os
+import signal
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+# Seconds per phase; "collect" gets the page wait on top
+PHASE_TIMEOUTS = {"launch": 90, "load": 60, "collect": 30, "upload": 45}
+# Exit status of a collector whose run was aborted by the watchdog
+EXIT_TIMEOUT = 4
+
+class PhaseTimeout(Exception):
+    def __init__(self, phase: str, seconds: float):
+        super().__init__(f"{phase} phase exceeded {seconds:.0f}s")
+        self.phase = phase
+
+class Watch:
+    """Phase and processes of one run, updated by the run and read by its supervisor."""
+
+    def __init__(self, deadlines: Dict[str, float], lease=None):
+        self.deadlines = deadlines
+        self.lease = lease
+        self.pids: List[int] = []
+        self.phase = "start"
+        self.since = time.monotonic()
+        self.expired: Optional[str] = None
+
+    def enter(self, phase: str) -> None:
+        self.phase, self.since = phase, time.monotonic()
+
+    def attach(self, pid: Optional[int]) -> None:
+        if pid:
+            self.pids.append(pid)
+            if self.lease:
+                self.lease.attach(pid)
+
+    def overdue(self) -> Optional[float]:
+        """The deadline of the current phase if it has passed."""
+        limit = self.deadlines.get(self.phase)
+        if limit is not None and time.monotonic() - self.since > limit:
+            return limit
+        return None
+
+    def kill(self) -> None:
+        for pid in self.pids:
+            kill_tree(pid)
+
+def children_map() -> Dict[int, List[int]]:
+    out = subprocess.run(["ps", "-A", "-o", "pid=", "-o", "ppid="], capture_output=True, text=True).stdout
+    children: Dict[int, List[int]] = {}
+    for line in out.splitlines():
+        fields = line.split()
+        if len(fields) == 2:
+            children.setdefault(int(fields[1]), []).append(int(fields[0]))
+    return children
+
+def descendants(pid: int) -> List[int]:
+    children = children_map()
+    found, stack = [], list(children.get(pid, ()))
+    while stack:
+        p = stack.pop()
+        found.append(p)
+        stack.extend(children.get(p, ()))
+    return found
+
+def kill_tree(pid: int, include_root: bool = True) -> None:
+    """Kill a process and all its descendants."""
+    if os.name == "nt":
+        if include_root:
+            subprocess.run(["taskkill", "/T", "/F", "/PID", str(pid)], capture_output=True)
+        else:
+            for child in _windows_children(pid):
+                subprocess.run(["taskkill", "/T", "/F", "/PID", str(child)], capture_output=True)
+        return
+    # Collected before killing: children of a killed process are reparented
+    pids = descendants(pid) + ([pid] if include_root else [])
+    for p in pids:
+        with contextlib.suppress(ProcessLookupError, PermissionError):
+            os.kill(p, signal.SIGKILL)
+
+def _windows_children(pid: int) -> List[int]:
+    query = f"(Get-CimInstance Win32_Process -Filter 'ParentProcessId={pid}').ProcessId"
+    out = subprocess.run(["powershell", "-NoProfile", "-Command", query], capture_output=True, text=True).stdout
+    return [int(v) for v in out.split() if v.isdigit()]
+
+async def supervise(awaitable, watch: Watch, poll: float = 0.5):
+    """Await a run, killing its processes when a phase exceeds its deadline."""
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll)
+            if done:
+                return task.result()
+            limit = watch.overdue()
+            if limit is not None:
+                watch.expired = watch.phase
+                await asyncio.to_thread(watch.kill)
+                raise PhaseTimeout(watch.phase, limit)
+    finally:
+        if not task.done():
+            task.cancel()
+            # Lets the sessions close their websockets; a blocked thread is abandoned
+            with contextlib.suppress(BaseException):
+                await asyncio.wait_for(task, 10)
+
+async def run_in_thread(fn, *args):
+    """Like asyncio.to_thread, but on a thread of its own.
+
+    A run blocked in a WebDriver call can't be interrupted; when its
+    supervisor gives up on it, the thread is abandoned without taking a slot
+    of the default executor for the rest of the campaign.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def settle(result, error):
+        if not future.done():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def target():
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            result, error = None, e
+        else:
+            error = None
+        # The loop may be closed by the time an abandoned run returns
+        with contextlib.suppress(RuntimeError):
+            loop.call_soon_threadsafe(settle, result, error)
+
+    threading.Thread(target=target, daemon=True).start()
+    return await future
+
+def start_watchdog(watch: Watch, on_expire: Callable[[str, float], None], poll: float = 0.5) -> threading.Thread:
+    """Supervise a blocking run from a daemon thread (the show_fp_*.py collectors)."""
+    def run():
+        while watch.expired is None:
+            time.sleep(poll)
+            limit = watch.overdue()
+            if limit is not None:
+                watch.expired = watch.phase
+                on_expire(watch.phase, limit)
+    thread = threading.Thread(target=run, daemon=True, name="watchdog")
+    thread.start()
+    return thread
+
+def abort_collector(watch: Watch, grace: float = 15) -> Callable[[str, float], None]:
+    """on_expire of the show_fp_*.py collectors: kill the browser, exit if the blocked call doesn't return."""
+    def on_expire(phase: str, limit: float) -> None:
+        print(f"[error] {phase} phase exceeded {limit:.0f}s, killing the browser")
+        if watch.pids:
+            watch.kill()
+        else:
+            # No driver yet (hung launch): everything this collector started
+            kill_tree(os.getpid(), include_root=False)
+        time.sleep(grace)
+        os._exit(EXIT_TIMEOUT)
+    return on_expire
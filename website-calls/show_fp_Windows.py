@@ -18,15 +18,17 @@ from __future__ import annotations
 import argparse
 import json
 import sys
-import subprocess
 from pathlib import Path
 from typing import Optional
-import requests
+import time
 
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.common.exceptions import WebDriverException
 
+from fp_common import add_cache_buster, build_payload, extract_features, post_results, start_profiler
+from session_watchdog import EXIT_TIMEOUT, PHASE_TIMEOUTS, Watch, abort_collector, start_watchdog
+
 # Paths to browser executables; adjust as needed for your system.
 BINARY_PATHS = {
     "chrome": "C:/Program Files/Google/Chrome/Application/chrome.exe",
@@ -40,8 +42,8 @@ def detect_path(p: str) -> Optional[str]:
     """Return path if it exists, else None."""
     return p if Path(p).exists() else None
 
-def build_driver(browser: str, headless: bool, privacy_max: bool = False, incognito: bool = False, extensions: list = None) -> webdriver.Remote:
-    """Build a Selenium WebDriver for the specified browser and options."""
+def build_options(browser: str, headless: bool, privacy_max: bool = False, incognito: bool = False, extensions: list = None):
+    """Build the Selenium options (flags, prefs, .crx extensions) for the specified browser without launching it."""
     b = browser.lower()
     extensions = extensions or []
 
@@ -128,7 +130,7 @@ def build_driver(browser: str, headless: bool, privacy_max: bool = False, incogn
             if ext.endswith(".crx"):
                 # options.add_argument('--load-extension={ext}')
                 options.add_extension(ext)
-        return webdriver.Chrome(options=options)
+        return options
 
     if b == "brave":
         from selenium.webdriver.chrome.options import Options as ChromeOptions
@@ -187,7 +189,7 @@ def build_driver(browser: str, headless: bool, privacy_max: bool = False, incogn
         for ext in extensions:
             if ext.endswith(".crx"):
                 options.add_extension(ext)
-        return webdriver.Chrome(options=options)
+        return options
 
     if b == "firefox":
         from selenium.webdriver.firefox.options import Options as FirefoxOptions
@@ -287,18 +289,9 @@ def build_driver(browser: str, headless: bool, privacy_max: bool = False, incogn
             profile.set_preference("dom.event.clipboardevents.enabled", False)  # prevents sites detecting copy/paste behavior
         options.profile = profile
         profile.update_preferences()
-        
-        driver =  webdriver.Firefox(options=options)
-
-        for ext in extensions:
-            if ext.endswith(".xpi"):
-                driver.install_addon(ext)
-
-        return driver
+        return options
     
     if b == "tor":
-        from tbselenium.common import USE_STEM
-        from tbselenium.tbdriver import TorBrowserDriver
         from selenium.webdriver.firefox.options import Options as FirefoxOptions
         options = FirefoxOptions()
         if headless:
@@ -396,15 +389,48 @@ def build_driver(browser: str, headless: bool, privacy_max: bool = False, incogn
             pref_dict.update({"security.enterprise_roots.enabled": False})
             pref_dict.update({"dom.event.clipboardevents.enabled": False})  # prevents sites detecting copy/paste behavior
 
+        for name, value in pref_dict.items():
+            options.set_preference(name, value)
+        return options
+
+    raise ValueError(f"Unsupported browser: {browser}")
+
+def build_driver(browser: str, headless: bool, privacy_max: bool = False, incognito: bool = False, extensions: list = None,
+                 tor_worker: int = 0, insecure_certs: bool = False) -> webdriver.Remote:
+    """Build a Selenium WebDriver for the specified browser and options.
+
+    Tor Browser uses the shared Tor daemon (tor_service.py) on the SOCKS port of tor_worker.
+    insecure_certs accepts the self-signed certificate of the server's TLS capture port."""
+    b = browser.lower()
+    extensions = extensions or []
+    options = build_options(browser, headless, privacy_max, incognito, extensions)
+    if insecure_certs:
+        options.accept_insecure_certs = True
+
+    if b in ("chrome", "brave"):
+        return webdriver.Chrome(options=options)
+
+    if b == "tor":
+        from tbselenium.common import USE_STEM
+        from tbselenium.tbdriver import TorBrowserDriver
+        from tor_service import TorService
+        tor = TorService(BINARY_PATHS["tor"])
+        tor.ensure()  # Returns at once while the daemon of a previous run is healthy
+        # TorBrowserDriver sets its own defaults on the options first, passing
+        # our prefs as pref_dict makes them override those defaults again
         driver = TorBrowserDriver(tbb_path=BINARY_PATHS["tor"],
                             executable_path=BINARY_PATHS["geckodriver"],
                             tor_cfg=USE_STEM,
+                            socks_port=tor.socks_port(tor_worker),
+                            control_port=tor.control_port,
                             options=options, 
-                            pref_dict=pref_dict)
-        for ext in extensions:
-            if ext.endswith(".xpi"):
-                driver.install_addon(ext)
-        return driver
+                            pref_dict=dict(options.preferences))
+    else:
+        driver = webdriver.Firefox(options=options)
+    for ext in extensions:
+        if ext.endswith(".xpi"):
+            driver.install_addon(ext)
+    return driver
 
 def dump_body(driver) -> str:
     """Return the text content of the page body."""
@@ -448,20 +474,27 @@ def parse_args():
         action="append",
         help="Path to browser extension (.crx or .xpi). Can be repeated."
     )
+    p.add_argument(
+        "--behavior-traces",
+        action="store_true",
+        help="Let the page record full behavioral traces and upload them as binary blobs"
+    )
+    p.add_argument(
+        "--fake",
+        action="store_true",
+        help="Use the fake WebDriver of fakedriver.py instead of a browser (for tests)"
+    )
+    p.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="Profile the run (cProfile and stack samples) into this directory"
+    )
     return p.parse_args()
 
 def main():
     args = parse_args()
     browser = args.browser
-    import random
-    import time as _time
-    url = args.url
-    # Add cache-busting query parameter
-    cache_buster = f"nocache={int(_time.time()*1000)}_{random.randint(0,99999)}"
-    if "?" in url:
-        url = url + "&" + cache_buster
-    else:
-        url = url + "?" + cache_buster
+    url = add_cache_buster(args.url, behavior_traces=args.behavior_traces)
     privacy_max = args.privacy_max
     incognito = args.incognito
     extensions = args.extension or []
@@ -472,100 +505,51 @@ def main():
     print(f"[config] Extensions: {extensions}")
 
     driver = None
+    profiler = start_profiler(args.profile, f"collect-{browser}") if args.profile else None
+    # Kills the browser when a phase hangs, instead of blocking the calling loop
+    watch = Watch(dict(PHASE_TIMEOUTS, collect=PHASE_TIMEOUTS["collect"] + 12))
+    start_watchdog(watch, abort_collector(watch))
     try:
         print(f"[info] Launching {browser} ...")
-        if browser == "tor":
-            process = subprocess.Popen(BINARY_PATHS["tor"] + "/Browser/TorBrowser/Tor/tor.exe", 
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.STDOUT)
-        driver = build_driver(
+        if browser == "tor" and not args.fake:
+            from tor_service import BOOTSTRAP_TIMEOUT, TorService
+            # Bootstrapping the shared daemon has a deadline of its own
+            watch.deadlines["tor"] = BOOTSTRAP_TIMEOUT + 30
+            watch.enter("tor")
+            TorService(BINARY_PATHS["tor"]).ensure()
+        watch.enter("launch")
+        if args.fake:
+            from fakedriver import build_driver as build_fake_driver
+        driver = (build_fake_driver if args.fake else build_driver)(
             browser,
             headless=args.headless,
             privacy_max=privacy_max,
             incognito=incognito,
-            extensions=extensions
+            extensions=extensions,
+            # Only the TLS capture port (https) has a self-signed certificate
+            insecure_certs=url.startswith("https://")
         )
+        watch.attach(getattr(getattr(driver.service, "process", None), "pid", None))
         print(f"[info] Navigating to {url} ...")
+        watch.enter("load")
         driver.get(url)
-        _time.sleep(12)  # Increased wait time to ensure comprehensive hash is generated
-
-        # Wait for the feature list to be populated (up to 5 seconds)
-        from selenium.webdriver.common.by import By
-        from selenium.webdriver.support.ui import WebDriverWait
-        from selenium.webdriver.support import expected_conditions as EC
-        try:
-            WebDriverWait(driver, 5).until(
-                lambda d: d.find_elements(By.CSS_SELECTOR, "#featureList li")
-            )
-        except Exception:
-            pass
+        watch.enter("collect")
+        if not args.fake:
+            time.sleep(12)  # Increased wait time to ensure comprehensive hash is generated
 
         # Extract features from the rendered list
-        features = {}
-        for li in driver.find_elements(By.CSS_SELECTOR, "#featureList li"):
-            try:
-                key = li.find_element(By.TAG_NAME, "h3").text.strip()
-                val = li.find_element(By.TAG_NAME, "pre").text.strip()
-                features[key] = val
-            except Exception:
-                continue
-
-        # List of all expected fingerprinting fields (update as needed)
-        expected_fields = [
-            "Canvas Fingerprint", "WebGL Vendor", "WebGL Renderer", "WebGL Shader Precision", "Detected Fonts", "User-Agent",
-            "Screen Resolution", "Device Pixel Ratio", "Color Depth", "Time Zone", "Locale", "Platform", "CPU Cores", "Device Memory (GB)",
-            "Multi-Monitor Position", "Media Devices", "WebRTC Candidate", "Cookies Enabled", "Accept-Language", "Do Not Track", "Plugins",
-            "Audio Fingerprint", "WASM Compile Time (ms)", "TLS / JA3", "SNI / DNS / Cert Info", "Device Motion", "Device Orientation",
-            "Mouse Sample", "Key Press Sample", "Scroll Sample", "Touch Gestures Sample", "Comprehensive Fingerprint Hash"
-        ]
-        # Fill missing fields with empty string or default value
-        for field in expected_fields:
-            if field not in features:
-                features[field] = ""
-
-        # Map extension file names to user-friendly names
-        ext_choices = []
-        for ext in extensions:
-            ext_lc = ext.lower()
-            if "ublock" in ext_lc:
-                ext_choices.append("ublock origin (lite)")
-            elif "privacybadger" in ext_lc or "privacy-badger" in ext_lc or "privacy_badger" in ext_lc:
-                ext_choices.append("privacy badger")
-            elif "noscript" in ext_lc:
-                ext_choices.append("noscript")
-            elif "canvasblocker" in ext_lc:
-                ext_choices.append("canvasblocker")
-        
-        # Tor uses noscript by default
-        if browser == "tor":
-            ext_choices.append("noscript")
+        features = extract_features(driver)
 
         # Output combined JSON
-        import datetime
-        timestamp = datetime.datetime.now().isoformat()
-        combined_output = {
-            "timestamp": timestamp,
-            "config": {
-            "browser": browser,
-            "privacy_max": privacy_max,
-            "incognito": incognito,
-            "extensions": ext_choices,
-            },
-            "title": driver.title,
-            "features": {k: features[k] for k in expected_fields}
-        }
+        combined_output = build_payload(browser, privacy_max, incognito, extensions,
+                                        driver.title, features)
         with open("output.json", "w", encoding="utf-8") as f:
             json.dump(combined_output, f, ensure_ascii=False, indent=2)
 
         # POST output.json to /api/testing
-        try:
-            with open("output.json", "r", encoding="utf-8") as f:
-                data = json.load(f)
-            resp = requests.post(args.url + "/api/testing", json=data)
-            print("POST /api/testing status:", resp.status_code)
-            print("Response:", resp.text)
-        except Exception as e:
-            print("[error] Failed to POST to /api/testing:", e)
+        watch.enter("upload")
+        post_results(args.url, combined_output)
+        watch.enter("done")
 
         sys.exit(3)
     except KeyboardInterrupt:
@@ -573,15 +557,17 @@ def main():
         sys.exit(130)
     except Exception as e:
         print(f"[error] {e.__class__.__name__}: {e}")
-        sys.exit(1)
+        if watch.expired:
+            print(f"[error] Aborted by the watchdog in the {watch.expired} phase")
+        sys.exit(EXIT_TIMEOUT if watch.expired else 1)
     finally:
-        if browser == "tor":
-            process.kill()
         if driver:
             try:
                 driver.quit()
             except Exception:
                 pass
+        if profiler:
+            profiler.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
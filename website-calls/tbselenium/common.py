@@ -37,6 +37,9 @@ TBB_CONTROL_PORT = 9151
 STEM_SOCKS_PORT = 9250
 STEM_CONTROL_PORT = 9251
 
+# Firefox's default, only used when no port is allocated
+DEFAULT_MARIONETTE_PORT = 2828
+
 KNOWN_SOCKS_PORTS = [DEFAULT_SOCKS_PORT, TBB_SOCKS_PORT]
 PORT_BAN_PREFS = ["extensions.torbutton.banned_ports",
                   "network.security.ports.banned"]
@@ -25,3 +25,7 @@ class TorBrowserDriverInitError(Exception):
 
 class StemLaunchError(Exception):
     pass
+
+
+class TBPrefError(Exception):
+    pass
@@ -1,4 +1,3 @@
-import shutil
 from os import environ, chdir
 from os.path import isdir, isfile, join, abspath, dirname
 from time import sleep
@@ -11,7 +10,9 @@ from selenium.webdriver.firefox.webdriver import WebDriver as FirefoxDriver
 from selenium.webdriver.firefox.options import Options
 from selenium.common.exceptions import WebDriverException
 import tbselenium.common as cm
-from tbselenium.utils import prepend_to_env_var, is_busy
+from tbselenium.utils import (
+    prepend_to_env_var, is_busy, port_allocator, get_profile_cleaner,
+    write_user_js)
 from tbselenium.tbbinary import TBBinary
 from tbselenium.exceptions import (
     TBDriverConfigError, TBDriverPortError, TBDriverPathError)
@@ -39,7 +40,9 @@ class TorBrowserDriver(FirefoxDriver):
                  headless=False,
                  options=None,
                  use_custom_profile=False,
-                 geckodriver_port=0  # by default a random port will be used
+                 geckodriver_port=0,  # by default a free port is allocated
+                 marionette_port=0,  # by default a free port is allocated
+                 bake_prefs=False
                  ):
 
         # use_custom_profile: whether to launch from and *write to* the given
@@ -48,9 +51,14 @@ class TorBrowserDriver(FirefoxDriver):
         # True: use the given profile without copying. This can be used to keep
         # a stateful profile across different launches of the Tor Browser.
         # It uses firefox's `-profile`` command line parameter under the hood
+        #
+        # bake_prefs: with use_custom_profile, also write the preferences to
+        # the profile's user.js, so they are read at startup and stay in it
 
         self.use_custom_profile = use_custom_profile
         self.tor_cfg = tor_cfg
+        # Starts the background cleaner, which sweeps what crashed runs left
+        get_profile_cleaner()
         self.setup_tbb_paths(tbb_path, tbb_fx_binary_path,
                              tbb_profile_path, tor_data_dir)
         self.options = Options() if options is None else options
@@ -71,42 +79,73 @@ class TorBrowserDriver(FirefoxDriver):
             install_noscript = True
 
         self.init_ports(tor_cfg, socks_port, control_port)
-        self.init_prefs(pref_dict, default_bridge_type)
-        self.export_env_vars()
-        # TODO:
-        # self.binary = self.get_tb_binary(logfile=tbb_logfile_path)
-        if use_custom_profile:
-            print(f'Using custom profile: {self.tbb_profile_path}')
+        # Ports of this instance, released on quit so parallel instances
+        # never share the geckodriver or marionette port
+        self.allocated_ports = []
+        # Everything up to the browser start releases the ports when it fails
+        try:
+            geckodriver_port = geckodriver_port or self.allocate_port()
+            self.marionette_port = marionette_port or self.allocate_port()
+            self.init_prefs(pref_dict, default_bridge_type)
+            # geckodriver writes it to the profile as well, set it for -profile
+            self.options.set_preference('marionette.port', self.marionette_port)
+            if bake_prefs and use_custom_profile:
+                write_user_js(self.tbb_profile_path, self.options.preferences)
+            self.export_env_vars()
+            # TODO:
+            # self.binary = self.get_tb_binary(logfile=tbb_logfile_path)
+            if use_custom_profile:
+                print(f'Using custom profile: {self.tbb_profile_path}')
             tbb_service = Service(
                 executable_path=executable_path,
                 log_path=tbb_logfile_path,  # TODO: deprecated, use log_output
-                service_args=["--marionette-port", "2828"],
+                service_args=["--marionette-port", str(self.marionette_port)],
                 port=geckodriver_port
                 )
-        else:
-            tbb_service = Service(
-                executable_path=executable_path,
-                log_path=tbb_logfile_path,
-                port=geckodriver_port
+            # options.binary is path to the Firefox binary and it can be a string
+            # or a FirefoxBinary object. If it's a string, it will be converted to
+            # a FirefoxBinary object.
+            # https://github.com/SeleniumHQ/selenium/blob/7cfd137085fcde932cd71af78642a15fd56fe1f1/py/selenium/webdriver/firefox/options.py#L54
+            self.options.binary = self.tbb_fx_binary_path
+            self.options.add_argument('--class')
+            self.options.add_argument('"Tor Browser"')
+            if headless:
+                self.options.add_argument('-headless')
+            super(TorBrowserDriver, self).__init__(
+                service=tbb_service,
+                options=self.options,
                 )
-        # options.binary is path to the Firefox binary and it can be a string
-        # or a FirefoxBinary object. If it's a string, it will be converted to
-        # a FirefoxBinary object.
-        # https://github.com/SeleniumHQ/selenium/blob/7cfd137085fcde932cd71af78642a15fd56fe1f1/py/selenium/webdriver/firefox/options.py#L54
-        self.options.binary = self.tbb_fx_binary_path
-        self.options.add_argument('--class')
-        self.options.add_argument('"Tor Browser"')
-        if headless:
-            self.options.add_argument('-headless')
-
-        super(TorBrowserDriver, self).__init__(
-            service=tbb_service,
-            options=self.options,
-            )
+        except BaseException:
+            self.release_ports()
+            raise
         self.is_running = True
         self.install_extensions(extensions, install_noscript)
         self.temp_profile_dir = self.capabilities["moz:profile"]
-        sleep(1)
+        self.wait_for_startup()
+
+    def wait_for_startup(self, timeout=10):
+        """Wait until the browser window finished its delayed startup.
+
+        Polls instead of sleeping a fixed time. Returns after the timeout
+        if the chrome context can't be queried.
+        """
+        script = ("return typeof gBrowserInit !== 'undefined' && "
+                  "gBrowserInit.delayedStartupFinished;")
+        try:
+            with self.context(self.CONTEXT_CHROME):
+                WebDriverWait(self, timeout, poll_frequency=0.05).until(
+                    lambda driver: driver.execute_script(script))
+        except WebDriverException:
+            pass
+
+    def allocate_port(self):
+        port, = port_allocator.allocate()
+        self.allocated_ports.append(port)
+        return port
+
+    def release_ports(self):
+        port_allocator.release(*self.allocated_ports)
+        self.allocated_ports = []
 
     def install_extensions(self, extensions, install_noscript):
         """Install the given extensions to the profile we are launching."""
@@ -132,7 +171,7 @@ class TorBrowserDriver(FirefoxDriver):
             if tor_cfg == cm.USE_RUNNING_TOR:
                 socks_port = cm.DEFAULT_SOCKS_PORT  # 9050
             else:
-                socks_port = cm.DEFAULT_SOCKS_PORT
+                socks_port = cm.STEM_SOCKS_PORT
         if control_port is None:
             if tor_cfg == cm.USE_RUNNING_TOR:
                 control_port = cm.DEFAULT_CONTROL_PORT
@@ -318,23 +357,30 @@ class TorBrowserDriver(FirefoxDriver):
         """Check if we get a connection error, i.e. 'Problem loading page'."""
         return "ENTITY connectionFailure.title" in self.page_source
 
-    def clean_up_profile_dirs(self):
-        """Remove temporary profile directories.
-        Only called when WebDriver.quit() is interrupted
+    def clean_up_profile_dirs(self, geckodriver_profile=True):
+        """Hand the temporary profile directories to the background cleaner.
+
+        geckodriver removes its copy (moz:profile) itself when it quits, so
+        that one is only passed when WebDriver.quit() is interrupted. The
+        copy selenium made of the TBB profile is always removed.
         """
         if self.use_custom_profile:
             # don't remove the profile if we are writing into it
             # i.e. stateful mode
             return
 
-        if self.temp_profile_dir and isdir(self.temp_profile_dir):
-            shutil.rmtree(self.temp_profile_dir)
+        cleaner = get_profile_cleaner()
+        if geckodriver_profile:
+            cleaner.submit(getattr(self, "temp_profile_dir", None))
+        profile = getattr(self.options, "profile", None)
+        cleaner.submit(getattr(profile, "tempfolder", None))
 
     def quit(self):
         """Quit the driver. Clean up if the parent's quit fails."""
         self.is_running = False
         try:
             super(TorBrowserDriver, self).quit()
+            self.clean_up_profile_dirs(geckodriver_profile=False)
         except (CannotSendRequest, AttributeError, WebDriverException):
             try:  # Clean up  if webdriver.quit() throws
                 if hasattr(self, "service"):
@@ -344,6 +390,8 @@ class TorBrowserDriver(FirefoxDriver):
                     self.clean_up_profile_dirs()
             except Exception as e:
                 print("[tbselenium] Exception while quitting: %s" % e)
+        finally:
+            self.release_ports()
 
     def __enter__(self):
         return self
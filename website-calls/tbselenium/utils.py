@@ -1,10 +1,17 @@
+import os
+import queue
+import shutil
+import socket
 import tempfile
+import threading
+import time
+import uuid
 import tbselenium.common as cm
 import json
 from os import environ
 from os.path import dirname, isfile, join
 from time import sleep
-from tbselenium.exceptions import StemLaunchError
+from tbselenium.exceptions import StemLaunchError, TBPrefError
 from selenium.webdriver.common.utils import is_connectable
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.wait import WebDriverWait
@@ -57,6 +64,145 @@ def is_busy(port_no):
     return is_connectable(port_no)
 
 
+class PortAllocator(object):
+    """Hand out free local ports, each to one driver at a time.
+
+    Ports are picked by the OS (bind to port 0) and remembered until they are
+    released, so concurrent TorBrowserDriver instances of one process never
+    get the same port even before their processes bind it. The known Tor
+    ports are never handed out.
+    """
+
+    def __init__(self, excluded=None):
+        self.excluded = set(excluded or [])
+        self.in_use = set()
+        self.lock = threading.Lock()
+
+    def allocate(self, count=1):
+        ports = []
+        with self.lock:
+            while len(ports) < count:
+                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+                    sock.bind(("127.0.0.1", 0))
+                    port = sock.getsockname()[1]
+                if port in self.in_use or port in self.excluded:
+                    continue
+                self.in_use.add(port)
+                ports.append(port)
+        return ports
+
+    def release(self, *ports):
+        with self.lock:
+            self.in_use.difference_update(ports)
+
+
+# Shared by all drivers of the process
+port_allocator = PortAllocator(excluded=[
+    cm.DEFAULT_SOCKS_PORT, cm.DEFAULT_CONTROL_PORT,
+    cm.TBB_SOCKS_PORT, cm.TBB_CONTROL_PORT,
+    cm.STEM_SOCKS_PORT, cm.STEM_CONTROL_PORT,
+    cm.DEFAULT_MARIONETTE_PORT])
+
+
+class ProfileCleaner(object):
+    """Delete profile directories in a background thread.
+
+    A directory is first renamed into a trash directory (fast, atomic on the
+    same file system) and then removed by the worker thread, so quitting a
+    driver does not wait for the deletion. When more than max_backlog
+    directories are queued, the caller deletes its directory itself. Trash
+    left behind by a crashed run, and profile copies of selenium/geckodriver
+    older than stale_age seconds, are swept when the cleaner starts.
+    """
+
+    def __init__(self, trash_dir=None, max_backlog=32, stale_age=6 * 3600):
+        self.trash_dir = trash_dir or join(tempfile.gettempdir(),
+                                           "tbselenium-trash")
+        self.stale_age = stale_age
+        self.backlog = queue.Queue(maxsize=max_backlog)
+        os.makedirs(self.trash_dir, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, daemon=True,
+                                       name="tbselenium-profile-cleaner")
+        self.thread.start()
+        self.backlog.put(self.sweep)
+
+    def submit(self, path):
+        """Schedule a directory for deletion."""
+        if not path or not os.path.isdir(path):
+            return
+        target = join(self.trash_dir, uuid.uuid4().hex)
+        try:
+            os.rename(path, target)
+        except OSError:
+            # Other file system, or (Windows) still in use by the browser
+            target = path
+        try:
+            self.backlog.put_nowait(target)
+        except queue.Full:
+            remove_dir(target)
+
+    def sweep(self):
+        """Remove the trash of earlier runs and stale profile copies."""
+        for name in os.listdir(self.trash_dir):
+            remove_dir(join(self.trash_dir, name))
+        tmp = tempfile.gettempdir()
+        now = time.time()
+        for name in os.listdir(tmp):
+            path = join(tmp, name)
+            is_profile = name.startswith("rust_mozprofile") or \
+                os.path.isdir(join(path, "webdriver-py-profilecopy"))
+            try:
+                stale = now - os.path.getmtime(path) > self.stale_age
+            except OSError:
+                continue
+            if is_profile and stale:
+                remove_dir(path)
+
+    def _run(self):
+        while True:
+            task = self.backlog.get()
+            try:
+                if callable(task):
+                    task()
+                else:
+                    remove_dir(task)
+            except Exception as e:
+                print("[tbselenium] Profile cleanup failed: %s" % e)
+            finally:
+                self.backlog.task_done()
+
+    def wait(self):
+        """Block until every queued directory is deleted."""
+        self.backlog.join()
+
+
+def remove_dir(path, attempts=5):
+    """rmtree, retried while files are still locked (Windows)."""
+    for attempt in range(attempts):
+        try:
+            shutil.rmtree(path)
+            return
+        except FileNotFoundError:
+            return
+        except OSError:
+            if attempt == attempts - 1:
+                raise
+            sleep(0.5 * (attempt + 1))
+
+
+_profile_cleaner = None
+_profile_cleaner_lock = threading.Lock()
+
+
+def get_profile_cleaner():
+    """The cleaner of the process, started (and sweeping) on first use."""
+    global _profile_cleaner
+    with _profile_cleaner_lock:
+        if _profile_cleaner is None:
+            _profile_cleaner = ProfileCleaner()
+        return _profile_cleaner
+
+
 def prepend_to_env_var(env_var, new_value):
     """Add the given value to the beginning of the environment var."""
     if environ.get(env_var, None):
@@ -73,8 +219,12 @@ def read_file(file_path, mode='r'):
     return content
 
 
-def launch_tbb_tor_with_stem(tbb_path=None, torrc=None, tor_binary=None):
-    """Launch the Tor binary in tbb_path using Stem."""
+def launch_tbb_tor_with_stem(tbb_path=None, torrc=None, tor_binary=None,
+                             **launch_kwargs):
+    """Launch the Tor binary in tbb_path using Stem.
+
+    Extra keyword arguments (e.g. take_ownership, timeout) are passed to
+    stem.process.launch_tor_with_config."""
     if not (tor_binary or tbb_path):
         raise StemLaunchError("Either pass tbb_path or tor_binary")
 
@@ -90,28 +240,81 @@ def launch_tbb_tor_with_stem(tbb_path=None, torrc=None, tor_binary=None):
                  'SOCKSPort': str(cm.STEM_SOCKS_PORT),
                  'DataDirectory': tempfile.mkdtemp()}
 
-    # return launch_tor_with_config(config=torrc, tor_cmd=tor_binary)
-
-
-def set_tbb_pref(driver, name, value):
+    return launch_tor_with_config(config=torrc, tor_cmd=tor_binary,
+                                  **launch_kwargs)
+
+
+# Sets every pref of arguments[0] and reads it back, returns
+# {name: reason} for the prefs that did not take effect
+SET_PREFS_SCRIPT = """
+const S = typeof Services !== "undefined" ? Services
+    : ChromeUtils.import("resource://gre/modules/Services.jsm").Services;
+const failed = {};
+for (const [name, value] of Object.entries(arguments[0])) {
+    try {
+        if (typeof value === "boolean") {
+            S.prefs.setBoolPref(name, value);
+        } else if (typeof value === "number") {
+            S.prefs.setIntPref(name, value);
+        } else {
+            S.prefs.setStringPref(name, value);
+        }
+        let actual;
+        switch (S.prefs.getPrefType(name)) {
+            case S.prefs.PREF_BOOL: actual = S.prefs.getBoolPref(name); break;
+            case S.prefs.PREF_INT: actual = S.prefs.getIntPref(name); break;
+            default: actual = S.prefs.getStringPref(name);
+        }
+        if (actual !== value) {
+            failed[name] = "reads back as " + JSON.stringify(actual);
+        }
+    } catch (e) {
+        failed[name] = String(e);
+    }
+}
+return failed;
+"""
+
+
+def set_tbb_prefs(driver, prefs):
+    """Set preferences of the running browser in one chrome-context call.
+
+    Every preference is read back; raises TBPrefError naming the ones that
+    did not take effect (e.g. a value of the wrong type).
+    """
+    if not prefs:
+        return
     try:
-        script = 'const { Services } = '\
-                 'ChromeUtils.import("resource://gre/modules/Services.jsm");'
-        script += 'Services.prefs.'
-        if isinstance(value, bool):
-            script += 'setBoolPref'
-        elif isinstance(value, (str)):
-            script += 'setStringPref'
-        else:
-            script += 'setIntPref'
-        script += '({0}, {1});'.format(json.dumps(name), json.dumps(value))
-        # driver.set_context(driver.CONTEXT_CHROME)
         with driver.context(driver.CONTEXT_CHROME):
-            driver.execute_script(script)
-    except Exception:
-        raise
+            failed = driver.execute_script(SET_PREFS_SCRIPT, dict(prefs))
     finally:
         driver.set_context(driver.CONTEXT_CONTENT)
+    if failed:
+        raise TBPrefError("Preferences not set: %s" % ", ".join(
+            "%s (%s)" % item for item in sorted(failed.items())))
+
+
+def set_tbb_pref(driver, name, value):
+    set_tbb_prefs(driver, {name: value})
+
+
+def write_user_js(profile_path, prefs):
+    """Bake preferences into the user.js of a profile before the launch.
+
+    Firefox reads user.js at startup, so the prefs are in place without any
+    round trip to the browser. Prefs already in the file are replaced.
+    """
+    user_js = join(profile_path, "user.js")
+    lines = []
+    if isfile(user_js):
+        with open(user_js, encoding="utf-8") as f:
+            lines = [line for line in f.read().splitlines()
+                     if not any('user_pref(%s,' % json.dumps(name) in line
+                                for name in prefs)]
+    lines += ['user_pref(%s, %s);' % (json.dumps(name), json.dumps(value))
+              for name, value in prefs.items()]
+    with open(user_js, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
 
 
 def set_security_level(driver, level):
@@ -176,8 +379,8 @@ def click_to_set_security_level(driver, level):
 
 
 def disable_js(driver):
+    # Read back by set_tbb_prefs, no need to wait for the update
     set_tbb_pref(driver, "javascript.enabled", False)
-    sleep(1)  # wait for the pref to update
 
 def get_js_status_text(driver):
     """Return the text of the JS status element."""
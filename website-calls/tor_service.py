@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+One Tor daemon shared by all Tor Browser runs.
+
+The daemon is launched once with Stem from the Tor Browser bundle
+(tbselenium.utils.launch_tbb_tor_with_stem) and keeps running after the
+collector exits, so the next run (or the next combination of
+run_all_combinations.bat) finds it on the control port and skips the
+bootstrap. Its data directory is kept too, so even a restarted daemon starts
+from the cached consensus. Every worker gets its own SOCKS port: Tor never
+shares circuits between streams of different SOCKS ports, so parallel
+sessions don't see each other's exit. Workers beyond the ports of the torrc
+get a free port added to the running daemon (SETCONF).
+
+Example usage:
+        python3 tor_service.py --start
+        python3 tor_service.py --status
+        python3 tor_service.py --stop
+
+Dependencies:
+        pip install -r requirements.txt
+"""
+
+from __future__ import annotations
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import tbselenium.common as cm
+from tbselenium.utils import launch_tbb_tor_with_stem, port_allocator
+
+# SOCKS ports of the workers, around the control port of the Stem launched Tor
+WORKER_PORTS = 8
+SOCKS_PORTS = [cm.STEM_SOCKS_PORT] + list(range(cm.STEM_CONTROL_PORT + 1, cm.STEM_CONTROL_PORT + WORKER_PORTS))
+CONTROL_PORT = cm.STEM_CONTROL_PORT
+DATA_DIR = Path(tempfile.gettempdir()) / "fp-tor-data"
+BOOTSTRAP_TIMEOUT = 300
+
+# Threads of the orchestrator must not launch the daemon twice
+_launch_lock = threading.Lock()
+
+def _port(socks_port: str) -> int:
+    """Port of a SocksPort value, e.g. "127.0.0.1:9250 IsolateDestAddr"."""
+    return int(socks_port.split()[0].rsplit(":", 1)[-1])
+
+class TorService:
+    """The shared Tor daemon, started on first use and health-checked over the control port."""
+
+    def __init__(self, tbb_path: str, control_port: int = CONTROL_PORT, socks_ports: Optional[List[int]] = None,
+                 data_dir: Path = DATA_DIR):
+        self.tbb_path = tbb_path
+        self.control_port = control_port
+        self.socks_ports = socks_ports or SOCKS_PORTS
+        self.data_dir = Path(data_dir)
+
+    def socks_port(self, worker: int = 0) -> int:
+        """SOCKS port of a worker, opened on the daemon if it has none yet."""
+        if worker < len(self.socks_ports):
+            return self.socks_ports[worker]
+        from stem.control import Controller
+
+        with _launch_lock, Controller.from_port(port=self.control_port) as controller:
+            controller.authenticate()
+            ports = controller.get_conf("SocksPort", multiple=True)
+            # Added for the workers of earlier runs, in worker order
+            extra = [p for p in ports if _port(p) not in self.socks_ports]
+            while len(extra) <= worker - len(self.socks_ports):
+                port, = port_allocator.allocate()
+                extra.append(str(port))
+                ports.append(str(port))
+                controller.set_conf("SocksPort", ports)
+            return _port(extra[worker - len(self.socks_ports)])
+
+    def torrc(self) -> dict:
+        return {
+            "ControlPort": str(self.control_port),
+            "SOCKSPort": [str(port) for port in self.socks_ports],
+            # The controller finds the cookie through PROTOCOLINFO
+            "CookieAuthentication": "1",
+            "DataDirectory": str(self.data_dir),
+        }
+
+    def status(self) -> Optional[str]:
+        """None when the daemon is up with circuits, otherwise why not."""
+        from stem import SocketError
+        from stem.connection import AuthenticationFailure
+        from stem.control import Controller, Listener
+
+        try:
+            with Controller.from_port(port=self.control_port) as controller:
+                controller.authenticate()
+                if "PROGRESS=100" not in controller.get_info("status/bootstrap-phase"):
+                    return "bootstrapping"
+                if controller.get_info("status/circuit-established") != "1":
+                    return "no circuit established"
+                missing = set(self.socks_ports) - {port for _, port in controller.get_listeners(Listener.SOCKS)}
+                if missing:
+                    return f"SOCKS ports {sorted(missing)} not open"
+                return None
+        except SocketError:
+            return "not running"
+        except AuthenticationFailure as e:
+            return f"control port authentication failed: {e}"
+
+    def ensure(self) -> None:
+        """Start the daemon unless a healthy one already listens on the control port."""
+        with _launch_lock:
+            problem = self.status()
+            deadline = time.monotonic() + BOOTSTRAP_TIMEOUT
+            # Launched by another run that is still waiting for it
+            while problem in ("bootstrapping", "no circuit established") and time.monotonic() < deadline:
+                time.sleep(1)
+                problem = self.status()
+            if problem is None:
+                return
+            if problem != "not running":
+                # Something else holds the control port, or a daemon that never finished
+                raise RuntimeError(f"Tor on control port {self.control_port} is unusable: {problem}")
+            print(f"[info] Starting the shared Tor daemon (control port {self.control_port}) ...")
+            self.data_dir.mkdir(parents=True, exist_ok=True)
+            # Not owned by this process: it keeps serving the next runs
+            launch_tbb_tor_with_stem(tbb_path=self.tbb_path, torrc=self.torrc(),
+                                     take_ownership=False, timeout=None if os.name == "nt" else BOOTSTRAP_TIMEOUT)
+            problem = self.status()
+            if problem is not None:
+                raise RuntimeError(f"Tor daemon started but is unusable: {problem}")
+            print("[info] Tor daemon bootstrapped")
+
+    def stop(self) -> bool:
+        from stem import SocketError, Signal
+        from stem.control import Controller
+
+        try:
+            with Controller.from_port(port=self.control_port) as controller:
+                controller.authenticate()
+                controller.signal(Signal.HALT)
+                return True
+        except SocketError:
+            return False
+
+def parse_args(argv=None):
+    """Parse command-line arguments."""
+    p = argparse.ArgumentParser(description="Manage the Tor daemon shared by the Tor Browser runs")
+    action = p.add_mutually_exclusive_group(required=True)
+    action.add_argument("--start", action="store_true", help="Start the daemon unless it is running")
+    action.add_argument("--status", action="store_true", help="Check the daemon over its control port")
+    action.add_argument("--stop", action="store_true", help="Shut the daemon down")
+    p.add_argument("--tbb-path", help="Tor Browser directory (default: BINARY_PATHS['tor'] of show_fp_Windows.py)")
+    return p.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    tbb_path = args.tbb_path
+    if not tbb_path:
+        from show_fp_Windows import BINARY_PATHS
+        tbb_path = BINARY_PATHS["tor"]
+    service = TorService(tbb_path)
+    if args.start:
+        try:
+            service.ensure()
+        except Exception as e:
+            print(f"[error] {e.__class__.__name__}: {e}")
+            sys.exit(1)
+        print(f"[info] Tor is up, SOCKS ports {', '.join(map(str, service.socks_ports))}")
+    elif args.status:
+        problem = service.status()
+        print("[info] Tor is up" if problem is None else f"[info] Tor is {problem}")
+        sys.exit(0 if problem is None else 1)
+    else:
+        print("[info] Tor daemon stopped" if service.stop() else "[info] Tor is not running")
+
+if __name__ == "__main__":
+    main()